@@ -4,6 +4,7 @@ Manages all environment variables and bot settings
 """
 
 import os
+import re
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -14,25 +15,115 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN", "your_bot_token_here")
 API_ID = int(os.getenv("API_ID", "0"))
 API_HASH = os.getenv("API_HASH", "your_api_hash_here")
+# Bot API endpoint (point at a local Bot API server to lift the 50MB upload cap)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
 
 # Database Configuration
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "terabox_bot")
+# Write-behind batching of user stats, downloaded files and log entries
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "100"))  # queued writes that trigger a flush
+DB_BATCH_INTERVAL = float(os.getenv("DB_BATCH_INTERVAL", "2"))  # seconds after which the next write flushes the queue
+DB_BATCH_MAX_PENDING = int(os.getenv("DB_BATCH_MAX_PENDING", "5000"))  # oldest writes are dropped beyond this
 
 # Channel Configuration
 STORE_CHANNEL = int(os.getenv("STORE_CHANNEL", "0"))
 ERROR_CHANNEL = int(os.getenv("ERROR_CHANNEL", "0"))
 LOG_CHANNEL = int(os.getenv("LOG_CHANNEL", "0"))
 
+# Telegram user ids allowed to run admin commands (comma-separated)
+ADMIN_IDS = [int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()]
+
 # API Configuration
 TERABOX_API = "https://my-noor-queen-api.woodmirror.workers.dev/api"
+# Comma-separated resolver backends, ranked at runtime by latency and success rate
+TERABOX_API_BACKENDS = [
+    url.strip() for url in os.getenv("TERABOX_API_BACKENDS", TERABOX_API).split(",") if url.strip()
+]
 API_TIMEOUT = int(os.getenv("API_TIMEOUT", "30"))
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))
 
+# Resolver Concurrency & Circuit Breaker
+RESOLVER_MIN_CONCURRENCY = int(os.getenv("RESOLVER_MIN_CONCURRENCY", "1"))
+RESOLVER_MAX_CONCURRENCY = int(os.getenv("RESOLVER_MAX_CONCURRENCY", "16"))
+RESOLVER_LATENCY_TARGET = float(os.getenv("RESOLVER_LATENCY_TARGET", "5"))  # seconds
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))  # seconds
+RESOLVER_MAX_RETRY_AFTER = float(os.getenv("RESOLVER_MAX_RETRY_AFTER", "60"))  # seconds, longer Retry-After values are capped
+RESOLVER_MAX_WAIT = float(os.getenv("RESOLVER_MAX_WAIT", "10"))  # seconds a caller waits out a Retry-After before failing fast
+
+# Resolver Backend Selection & Hedging
+RESOLVER_EWMA_ALPHA = float(os.getenv("RESOLVER_EWMA_ALPHA", "0.3"))
+RESOLVER_LATENCY_WINDOW = int(os.getenv("RESOLVER_LATENCY_WINDOW", "50"))  # samples kept for p95
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "10"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "3"))  # seconds, until p95 is known
+
+# Download Link Expiry (CDN links are re-resolved when they return 403/410)
+LINK_TTL = int(os.getenv("LINK_TTL", "1800"))  # seconds a resolve result is reused, lowered as links expire
+LINK_TTL_MIN = int(os.getenv("LINK_TTL_MIN", "60"))
+LINK_REFRESH_ATTEMPTS = int(os.getenv("LINK_REFRESH_ATTEMPTS", "2"))  # re-resolves per download
+
 # Download Configuration
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "10485760"))  # 10MB in bytes
 DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", "3600"))  # 1 hour
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1048576"))  # 1MB chunks
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "1"))  # seconds between progress callbacks
+
+# Segmented Downloads (HTTP Range, multiple connections per file)
+SEGMENTED_DOWNLOADS = os.getenv("SEGMENTED_DOWNLOADS", "true").lower() == "true"
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "4"))
+SEGMENT_MIN_SIZE = int(os.getenv("SEGMENT_MIN_SIZE", "8388608"))  # 8MB, smallest segment worth a connection
+
+# Source Selection (download_link vs proxy_url, raced until each host has a measured speed)
+SOURCE_RACE_BYTES = int(os.getenv("SOURCE_RACE_BYTES", "262144"))  # 256KB read from each source in a race
+SOURCE_HISTORY_TTL = int(os.getenv("SOURCE_HISTORY_TTL", "3600"))  # seconds a host's speed or failure is trusted
+SOURCE_EWMA_ALPHA = float(os.getenv("SOURCE_EWMA_ALPHA", "0.3"))
+
+# Bandwidth Scheduling (0 = unlimited)
+BANDWIDTH_LIMIT = int(os.getenv("BANDWIDTH_LIMIT", "0"))  # bytes/s across all downloads
+USER_BANDWIDTH_LIMIT = int(os.getenv("USER_BANDWIDTH_LIMIT", "0"))  # bytes/s per user
+BANDWIDTH_BURST = float(os.getenv("BANDWIDTH_BURST", "0.5"))  # seconds of traffic a bucket can save up
+BANDWIDTH_SMALL_FILE = int(os.getenv("BANDWIDTH_SMALL_FILE", "20971520"))  # 20MB left counts as small
+BANDWIDTH_SMALL_BOOST = float(os.getenv("BANDWIDTH_SMALL_BOOST", "4"))  # weight multiplier for small downloads
+
+# Integrity Checks (hashed while downloading; resolver checksums such as md5 are added per file)
+CHECKSUM_ALGORITHMS = [a.strip() for a in os.getenv("CHECKSUM_ALGORITHMS", "sha256").split(",") if a.strip()]
+HASH_THREADS = int(os.getenv("HASH_THREADS", "2"))
+
+# Resumable Downloads
+RESUME_STATE_INTERVAL = int(os.getenv("RESUME_STATE_INTERVAL", "8388608"))  # save .part progress every 8MB
+
+# Disk Writes (off the event loop)
+DISK_WRITER_THREADS = int(os.getenv("DISK_WRITER_THREADS", "4"))
+WRITE_QUEUE_CHUNKS = int(os.getenv("WRITE_QUEUE_CHUNKS", "8"))  # queued chunks per file before reads pause
+
+# In-Memory Fast Path (small files skip the disk)
+MEMORY_FAST_PATH_SIZE = int(os.getenv("MEMORY_FAST_PATH_SIZE", str(MAX_FILE_SIZE)))
+MEMORY_BUFFER_BUDGET = int(os.getenv("MEMORY_BUFFER_BUDGET", "134217728"))  # 128MB across all jobs
+
+# Download Cache (completed files kept on disk, least recently used evicted first)
+DOWNLOAD_CACHE_BYTES = int(os.getenv("DOWNLOAD_CACHE_BYTES", "5368709120"))  # 5GB
+
+# Disk Quota (space reserved before each download starts)
+DISK_BUDGET_BYTES = int(os.getenv("DISK_BUDGET_BYTES", "10737418240"))  # 10GB for cache plus in-flight downloads
+DISK_MIN_FREE_BYTES = int(os.getenv("DISK_MIN_FREE_BYTES", "536870912"))  # 512MB always left free on the volume
+DISK_RESERVE_TIMEOUT = int(os.getenv("DISK_RESERVE_TIMEOUT", "900"))  # seconds a job waits for space
+
+# Disk Janitor (reclaims orphaned and stale files)
+JANITOR_INTERVAL = int(os.getenv("JANITOR_INTERVAL", "600"))  # 10 minutes between sweeps
+PARTIAL_MAX_AGE = int(os.getenv("PARTIAL_MAX_AGE", "21600"))  # 6 hours before an abandoned .part is removed
+DOWNLOAD_MAX_AGE = int(os.getenv("DOWNLOAD_MAX_AGE", "86400"))  # 24 hours before an unused download is removed
+
+# Uploads (files on disk are streamed to the Bot API)
+UPLOAD_TIMEOUT = int(os.getenv("UPLOAD_TIMEOUT", "3600"))  # 1 hour
+# Largest file one upload may carry: 50MB on api.telegram.org, 2000MB on a local Bot API server
+UPLOAD_LIMIT_BYTES = int(os.getenv(
+    "UPLOAD_LIMIT_BYTES", "52428800" if TELEGRAM_API_URL == "https://api.telegram.org" else "2097152000"
+))
+
+# Splitting (files over UPLOAD_LIMIT_BYTES are sent in parts while they download)
+SPLIT_PART_SIZE = int(os.getenv("SPLIT_PART_SIZE", "0"))  # bytes per part (0 = upload limit minus 1MB)
+SPLIT_UPLOAD_CONCURRENCY = int(os.getenv("SPLIT_UPLOAD_CONCURRENCY", "3"))  # parts uploading at once per file
 
 # Paths
 BASE_DIR = Path(__file__).parent
@@ -48,28 +139,62 @@ LOGS_DIR.mkdir(exist_ok=True)
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
+# TeraBox mirror domains - links on any of these resolve to the same share ids
+TERABOX_MIRRORS = [
+    "terabox.com",
+    "1024terabox.com",
+    "freeterabox.com",
+    "teraboxapp.com",
+    "terashare.co",
+    "terabox.net",
+]
+
+# Canonical form every share link is rewritten to before resolving/caching
+TERABOX_CANONICAL_URL = "https://www.terabox.com/s/{share_id}"
+
 # Regex Patterns for TeraBox Links
 TERABOX_DOMAINS = [
-    r"https://(?:www\.)?terabox\.com/s/[\w-]+",
-    r"https://(?:www\.)?1024terabox\.com/s/[\w-]+",
-    r"https://(?:www\.)?freeterabox\.com/s/[\w-]+",
-    r"https://(?:www\.)?teraboxapp\.com/s/[\w-]+",
-    r"https://(?:www\.)?terashare\.co/s/[\w-]+",
-    r"https://(?:www\.)?terabox\.net/s/[\w-]+",
+    rf"https?://(?:www\.)?{re.escape(domain)}/s/[\w-]+" for domain in TERABOX_MIRRORS
 ]
 
 # File size limits for different actions
 SIZE_LIMIT_USER_MB = 10  # MB
-SIZE_LIMIT_CHANNEL_MB = 2000  # MB (Telegram max is ~2GB)
+SIZE_LIMIT_CHANNEL_MB = int(os.getenv("SIZE_LIMIT_CHANNEL_MB", "2000"))  # MB, largest file downloaded (split above the upload limit)
 
 # Thumbnail Configuration
-THUMBNAIL_SIZE = (320, 180)
-THUMBNAIL_QUALITY = 85
+THUMBNAIL_SIZE = (int(os.getenv("THUMBNAIL_WIDTH", "320")), int(os.getenv("THUMBNAIL_HEIGHT", "180")))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "85"))
+THUMBNAIL_THREADS = int(os.getenv("THUMBNAIL_THREADS", "2"))  # threads resizing resolver thumbnails
+THUMBNAIL_CACHE_ENTRIES = int(os.getenv("THUMBNAIL_CACHE_ENTRIES", "512"))  # shares whose thumbnail is kept
+THUMBNAIL_SOURCE_MAX_BYTES = int(os.getenv("THUMBNAIL_SOURCE_MAX_BYTES", "5242880"))  # 5MB largest image fetched
 
 # Metadata Extraction
 FFMPEG_TIMEOUT = int(os.getenv("FFMPEG_TIMEOUT", "30"))
 EXTRACT_VIDEO_METADATA = os.getenv("EXTRACT_VIDEO_METADATA", "true").lower() == "true"
 
+# Media Processing (ffmpeg jobs share a bounded pool, smallest files first)
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "0"))  # concurrent jobs (0 = one per available CPU core)
+MEDIA_QUEUE_LIMIT = int(os.getenv("MEDIA_QUEUE_LIMIT", "32"))  # waiting jobs before new ones are skipped
+MEDIA_CPU_LIMIT = int(os.getenv("MEDIA_CPU_LIMIT", "60"))  # CPU seconds per ffmpeg process (0 = unlimited)
+
+# Early Probing (videos are probed from their first and last bytes before the full download)
+EARLY_PROBE_ENABLED = os.getenv("EARLY_PROBE_ENABLED", "true").lower() == "true"
+EARLY_PROBE_MIN_SIZE = int(os.getenv("EARLY_PROBE_MIN_SIZE", "52428800"))  # smaller files are probed after download
+MEDIA_SAMPLE_HEAD_BYTES = int(os.getenv("MEDIA_SAMPLE_HEAD_BYTES", "4194304"))  # 4MB from the start
+MEDIA_SAMPLE_TAIL_BYTES = int(os.getenv("MEDIA_SAMPLE_TAIL_BYTES", "2097152"))  # 2MB from the end (MP4 moov)
+
+# Faststart Remux (MP4s with the index at the end are copied with it moved to the front before sending)
+FASTSTART_ENABLED = os.getenv("FASTSTART_ENABLED", "true").lower() == "true"
+FASTSTART_MAX_SIZE = int(os.getenv("FASTSTART_MAX_SIZE", "2097152000"))  # larger files are sent as they are
+FASTSTART_TIMEOUT = int(os.getenv("FASTSTART_TIMEOUT", "300"))  # seconds before the remux is abandoned
+
+# Media Metadata Store (probe results in MongoDB by share id and content hash, recent ones in memory)
+MEDIA_STORE_ENTRIES = int(os.getenv("MEDIA_STORE_ENTRIES", "4096"))  # records kept in memory
+
+# User Activity (a user's record is rewritten at most once per USER_CACHE_TTL)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "10"))  # seconds
+USER_CACHE_ENTRIES = int(os.getenv("USER_CACHE_ENTRIES", "10000"))  # users remembered
+
 # Rate Limiting
 RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
 REQUESTS_PER_MINUTE = int(os.getenv("REQUESTS_PER_MINUTE", "20"))
@@ -5,21 +5,344 @@ Handles API requests to TeraBox resolver
 
 import aiohttp
 import asyncio
-from typing import Optional, Dict, Any
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, Deque, List, Tuple
 import json
+import random
+import time
 
 import config
+from helpers.links import canonical_share_id
 from helpers.logger import get_logger
 
 logger = get_logger("terabox_bot")
 
 
+class CircuitOpenError(Exception):
+    """Raised when the resolver circuit is open and requests should fail fast"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"Resolver circuit open, retry in {retry_in:.1f}s")
+        self.retry_in = retry_in
+
+
+class ResolverController:
+    """
+    Shared concurrency limiter and circuit breaker for the resolver backend
+
+    The in-flight limit follows AIMD: it grows by about one slot per window
+    of fast successes and is halved on failures, throttling (429) or
+    responses slower than RESOLVER_LATENCY_TARGET. Other 4xx answers reject
+    the link, not the backend, and leave both alone. After
+    CIRCUIT_FAILURE_THRESHOLD consecutive failures or throttled responses
+    the circuit opens and callers fail fast; once
+    CIRCUIT_RESET_TIMEOUT has passed a single half-open trial request
+    decides whether to close it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    SUCCESS = "success"
+    THROTTLED = "throttled"
+    FAILURE = "failure"
+    REJECTED = "rejected"
+    CANCELLED = "cancelled"
+
+    def __init__(
+        self,
+        min_limit: int = config.RESOLVER_MIN_CONCURRENCY,
+        max_limit: int = config.RESOLVER_MAX_CONCURRENCY,
+        latency_target: float = config.RESOLVER_LATENCY_TARGET,
+        failure_threshold: int = config.CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = config.CIRCUIT_RESET_TIMEOUT,
+        max_wait: float = config.RESOLVER_MAX_WAIT,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.latency_target = latency_target
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_wait = max_wait
+
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self):
+        """
+        Wait for a free request slot
+
+        Raises:
+            CircuitOpenError: If the circuit is open, a half-open trial is
+                running, or a Retry-After blocks requests for longer than
+                max_wait
+        """
+        while True:
+            now = time.monotonic()
+            self._check_circuit(now)
+
+            if self.blocked_until > now:
+                # Honor Retry-After from the last 429 for every caller, unless
+                # waiting it out would stall the update for too long
+                if self.blocked_until - now > self.max_wait:
+                    raise CircuitOpenError(self.blocked_until - now)
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+
+            if self.in_flight < int(self.limit):
+                break
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Woken for a free slot just as we were cancelled: pass it on
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+        self.in_flight += 1
+        if self.state == self.HALF_OPEN:
+            self.trial_in_flight = True
+
+    def release(self, latency: float, outcome: str, retry_after: Optional[float] = None):
+        """
+        Return a slot and feed the request outcome back into the controller
+
+        Args:
+            latency: Seconds the request took
+            outcome: One of SUCCESS, THROTTLED, FAILURE, REJECTED or CANCELLED
+            retry_after: Seconds the backend asked us to wait (429 only)
+        """
+        now = time.monotonic()
+        self.in_flight = max(0, self.in_flight - 1)
+        half_open = self.state == self.HALF_OPEN
+        self.trial_in_flight = False
+
+        if outcome in (self.CANCELLED, self.REJECTED):
+            # A cancelled hedge or a rejected link tells us nothing about backend health
+            pass
+
+        elif outcome == self.SUCCESS:
+            self.consecutive_failures = 0
+            if half_open:
+                self.state = self.CLOSED
+                logger.info("Resolver circuit closed after successful trial request")
+            if latency > self.latency_target:
+                self._decrease(now, latency)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+        elif outcome == self.THROTTLED:
+            self.consecutive_failures += 1
+            self._decrease(now, latency)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            if half_open or self.consecutive_failures >= self.failure_threshold:
+                self._open(now)
+
+        else:
+            self.consecutive_failures += 1
+            self._decrease(now, latency)
+            if half_open or self.consecutive_failures >= self.failure_threshold:
+                self._open(now)
+
+        self._wake(all_waiters=self.state != self.CLOSED)
+
+    def is_available(self) -> bool:
+        """Check whether a request could be admitted right now"""
+        if self.state == self.OPEN:
+            return time.monotonic() >= self.opened_at + self.reset_timeout
+        if self.state == self.HALF_OPEN:
+            return not self.trial_in_flight
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get current controller state for logging and diagnostics"""
+        return {
+            "state": self.state,
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+    def _check_circuit(self, now: float):
+        """Fail fast while open, move to half-open once the reset timeout passes"""
+        if self.state == self.OPEN:
+            remaining = self.opened_at + self.reset_timeout - now
+            if remaining > 0:
+                raise CircuitOpenError(remaining)
+            self.state = self.HALF_OPEN
+            self.trial_in_flight = False
+            logger.info("Resolver circuit half-open, sending trial request")
+
+        if self.state == self.HALF_OPEN and self.trial_in_flight:
+            raise CircuitOpenError(0.0)
+
+    def _open(self, now: float):
+        """Open the circuit"""
+        if self.state != self.OPEN:
+            logger.warning(
+                f"Resolver circuit opened after {self.consecutive_failures} consecutive failures"
+            )
+        self.state = self.OPEN
+        self.opened_at = now
+        self.limit = float(self.min_limit)
+
+    def _decrease(self, now: float, latency: float):
+        """Halve the limit, at most once per observed round trip"""
+        if now - self.last_decrease < latency:
+            return
+        self.limit = max(float(self.min_limit), self.limit / 2)
+        self.last_decrease = now
+
+    def _wake(self, all_waiters: bool = False):
+        """Wake waiters for newly freed slots"""
+        free = len(self._waiters) if all_waiters else int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class ResolverBackend:
+    """
+    A resolver endpoint scored by live latency and success-rate EWMAs
+
+    Each backend has its own ResolverController, so one endpoint's outage
+    opens only its own circuit.
+    """
+
+    def __init__(self, url: str, alpha: float = config.RESOLVER_EWMA_ALPHA):
+        self.url = url
+        self.alpha = alpha
+        self.latency_ewma: Optional[float] = None
+        self.success_ewma = 1.0
+        self.samples: Deque[float] = deque(maxlen=config.RESOLVER_LATENCY_WINDOW)
+        self.controller = ResolverController()
+
+    def record(self, latency: float, outcome: str):
+        """Fold one request into the latency and success-rate averages"""
+        self.samples.append(latency)
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = self.alpha * latency + (1 - self.alpha) * self.latency_ewma
+
+        # Cancelled hedges only contribute their elapsed time as a latency lower bound
+        if outcome not in (ResolverController.CANCELLED, ResolverController.REJECTED):
+            ok = 1.0 if outcome == ResolverController.SUCCESS else 0.0
+            self.success_ewma = self.alpha * ok + (1 - self.alpha) * self.success_ewma
+
+    def score(self) -> float:
+        """Expected cost of a request; lower is better and untried backends go first"""
+        latency = self.latency_ewma if self.latency_ewma is not None else 0.0
+        return latency / max(self.success_ewma, 0.05)
+
+    def p95(self) -> float:
+        """95th percentile latency, or HEDGE_DEFAULT_DELAY until enough samples exist"""
+        if len(self.samples) < config.HEDGE_MIN_SAMPLES:
+            return config.HEDGE_DEFAULT_DELAY
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get current backend scoring for logging and diagnostics"""
+        return {
+            "url": self.url,
+            "latency_ewma": self.latency_ewma,
+            "success_ewma": round(self.success_ewma, 3),
+            "p95": self.p95(),
+            **self.controller.snapshot(),
+        }
+
+
+class LinkCache:
+    """
+    Recently resolved links, reused while their download URLs are fresh
+
+    CDN download links expire after a lifetime the resolver doesn't report.
+    Results are reused for ttl seconds, starting at LINK_TTL. When a download
+    finds a link expired, ttl drops below the age the link had reached (but
+    not under LINK_TTL_MIN), so later results are re-resolved before they
+    are likely to expire. Each result that reaches the ttl without being
+    reported expired grows it again by GROWTH, up to LINK_TTL, so one early
+    expiry doesn't lower the hit rate for good.
+    """
+
+    # Fraction of an observed expiry age that stays within the ttl
+    SAFETY = 0.8
+    # Factor the ttl grows by for each result that outlived it
+    GROWTH = 1.25
+
+    def __init__(self, ttl: float = config.LINK_TTL, min_ttl: float = config.LINK_TTL_MIN):
+        self.ttl = float(ttl)
+        self.max_ttl = float(ttl)
+        self.min_ttl = float(min_ttl)
+        self.entries: Dict[str, Tuple[Dict[str, Any], float]] = {}
+
+    def get(self, share_id: str) -> Optional[Dict[str, Any]]:
+        """Get a copy of a cached result that is still within the ttl"""
+        entry = self.entries.get(share_id)
+        if entry is None:
+            return None
+        result, resolved_at = entry
+        if time.monotonic() - resolved_at >= self.ttl:
+            del self.entries[share_id]
+            self._outlived()
+            return None
+        return dict(result)
+
+    def put(self, share_id: str, result: Dict[str, Any]):
+        self.entries[share_id] = (dict(result), time.monotonic())
+        # Drop expired entries so the cache stays bounded by recent traffic
+        now = time.monotonic()
+        for key in [k for k, (_, at) in self.entries.items() if now - at >= self.ttl]:
+            del self.entries[key]
+            self._outlived()
+
+    def expired(self, share_id: str):
+        """Forget a result whose download URLs expired and learn from its age"""
+        entry = self.entries.pop(share_id, None)
+        if entry is None:
+            return
+        age = time.monotonic() - entry[1]
+        ttl = max(self.min_ttl, min(self.ttl, age * self.SAFETY))
+        if ttl < self.ttl:
+            logger.info(f"Download link expired after {age:.0f}s, reusing resolved links for {ttl:.0f}s")
+            self.ttl = ttl
+
+    def _outlived(self):
+        """Grow a lowered ttl back after a result reached it without expiring"""
+        if self.ttl < self.max_ttl:
+            self.ttl = min(self.max_ttl, self.ttl * self.GROWTH)
+            logger.debug(f"Resolved link outlived the ttl, reusing resolved links for {self.ttl:.0f}s")
+
+
 class TeraBoxAPI:
     """TeraBox API client"""
 
-    def __init__(self):
+    def __init__(self, backends: Optional[List[str]] = None):
         self.session: Optional[aiohttp.ClientSession] = None
         self.timeout = aiohttp.ClientTimeout(total=config.API_TIMEOUT)
+        self.backends = [ResolverBackend(url) for url in (backends or config.TERABOX_API_BACKENDS)]
+        self.link_cache = LinkCache()
 
     async def init_session(self):
         """Initialize aiohttp session"""
@@ -33,30 +356,138 @@ class TeraBoxAPI:
             await self.session.close()
             logger.info("API session closed")
 
-    async def resolve_link(self, terabox_link: str) -> Optional[Dict[str, Any]]:
+    async def resolve_link(self, terabox_link: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
         """
         Resolve TeraBox link and get file information
 
+        A result resolved within the link cache's ttl is reused. Otherwise
+        the best-scored backend is tried first. If it is still running after
+        its p95 latency, a hedged request goes to the next backend and the
+        loser is cancelled. A failed backend falls over to the next one.
+
         Args:
             terabox_link: TeraBox link to resolve
+            fresh: Bypass the link cache
 
         Returns:
             Dictionary with file info or None on failure
         """
+        share_id = canonical_share_id(terabox_link)
+        if share_id and not fresh:
+            cached = self.link_cache.get(share_id)
+            if cached:
+                logger.debug(f"Reusing resolved link for {share_id}")
+                return cached
+
+        result = await self._resolve(terabox_link)
+        if result and share_id:
+            self.link_cache.put(share_id, result)
+        return result
+
+    async def refresh_link(self, terabox_link: str) -> List[str]:
+        """
+        Resolve a link again after the CDN rejected its download URLs
+
+        The expired result's age lowers the link cache ttl.
+
+        Args:
+            terabox_link: TeraBox link whose download URLs expired
+
+        Returns:
+            Fresh download_link and proxy_url (empty if resolving failed)
+        """
+        share_id = canonical_share_id(terabox_link)
+        if share_id:
+            self.link_cache.expired(share_id)
+        logger.info(f"Download link expired, re-resolving {terabox_link}")
+        result = await self.resolve_link(terabox_link, fresh=True)
+        if not result:
+            return []
+        return [url for url in (result.get("download_link", ""), result.get("proxy_url", "")) if url]
+
+    async def _resolve(self, terabox_link: str) -> Optional[Dict[str, Any]]:
+        """Resolve a link against the backends (see resolve_link())"""
         if not self.session:
             await self.init_session()
 
+        candidates = self._rank_backends()
+        if not candidates:
+            logger.warning(f"All resolver backends unavailable, failing fast for {terabox_link}")
+            return None
+
+        primary = candidates.pop(0)
+        pending = {asyncio.ensure_future(self._resolve_with(primary, terabox_link))}
+        hedge_delay: Optional[float] = primary.p95()
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=hedge_delay if candidates else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                if not done:
+                    # Slower than its p95 - hedge once to the next best backend
+                    backend = candidates.pop(0)
+                    logger.info(f"Hedging {terabox_link} to {backend.url} after {hedge_delay:.2f}s")
+                    pending.add(asyncio.ensure_future(self._resolve_with(backend, terabox_link)))
+                    hedge_delay = None
+                    continue
+
+                for task in done:
+                    result = task.result()
+                    if result:
+                        return result
+
+                if not pending and candidates:
+                    backend = candidates.pop(0)
+                    logger.info(f"Falling over to {backend.url} for {terabox_link}")
+                    pending.add(asyncio.ensure_future(self._resolve_with(backend, terabox_link)))
+
+            return None
+
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def _rank_backends(self) -> List[ResolverBackend]:
+        """Available backends ordered best first"""
+        available = [b for b in self.backends if b.controller.is_available()]
+        return sorted(available, key=lambda b: b.score())
+
+    def backend_stats(self) -> List[Dict[str, Any]]:
+        """Get per-backend scoring and controller state"""
+        return [backend.snapshot() for backend in self.backends]
+
+    async def _resolve_with(self, backend: ResolverBackend, terabox_link: str) -> Optional[Dict[str, Any]]:
+        """Resolve a link against one backend, retrying within its controller"""
+        controller = backend.controller
+
         for attempt in range(config.MAX_RETRIES):
+            try:
+                await controller.acquire()
+            except CircuitOpenError as e:
+                logger.warning(f"Failing fast for {terabox_link} on {backend.url}: {e}")
+                return None
+
+            started = time.monotonic()
+            outcome = ResolverController.FAILURE
+            retry_after = None
+
             try:
                 params = {"url": terabox_link}
-                async with self.session.get(config.TERABOX_API, params=params) as response:
+                async with self.session.get(backend.url, params=params) as response:
                     if response.status == 200:
                         data = await response.json()
+                        outcome = ResolverController.SUCCESS
 
                         # Validate response - status could be "Successfully" or "✅ Successfully"
                         api_status = data.get("status", "").strip()
                         has_download_link = data.get("download_link") or data.get("server_filename")
-                        
+
                         if ("Successfully" in api_status or "success" in api_status.lower()) and has_download_link:
                             logger.debug(f"Successfully resolved: {terabox_link}")
                             return {
@@ -66,52 +497,92 @@ class TeraBoxAPI:
                                 "download_link": data.get("download_link", ""),
                                 "thumbnail": data.get("thumbnail", ""),
                                 "proxy_url": data.get("proxy_url", ""),
+                                "md5": str(data.get("md5", "") or "").lower(),
+                                "sha256": str(data.get("sha256", "") or "").lower(),
+                                "share_id": canonical_share_id(terabox_link),
                             }
                         else:
                             logger.warning(f"API error for {terabox_link}: {api_status} | has_link: {has_download_link}")
                             return None
                     elif response.status == 429:
-                        # Rate limited
-                        wait_time = 2 ** attempt
-                        logger.warning(f"Rate limited, waiting {wait_time}s before retry")
-                        await asyncio.sleep(wait_time)
+                        # Rate limited - the controller delays every caller until Retry-After passes
+                        outcome = ResolverController.THROTTLED
+                        retry_after = self._parse_retry_after(response.headers.get("Retry-After"))
+                        if retry_after is None:
+                            retry_after = 2 ** attempt
+                        logger.warning(f"Rate limited, waiting {retry_after:.1f}s before retry")
+                    elif response.status >= 500:
+                        # Retried after a backoff, like timeouts
+                        logger.warning(
+                            f"API returned status {response.status} for {terabox_link} "
+                            f"(attempt {attempt + 1}/{config.MAX_RETRIES})"
+                        )
                     else:
+                        # 4xx (e.g. 403 for a private share) means the link was rejected,
+                        # not that the resolver is unhealthy
+                        outcome = ResolverController.REJECTED
                         logger.warning(f"API returned status {response.status} for {terabox_link}")
                         return None
 
             except asyncio.TimeoutError:
                 logger.warning(f"API timeout for {terabox_link} (attempt {attempt + 1}/{config.MAX_RETRIES})")
-                if attempt < config.MAX_RETRIES - 1:
-                    await asyncio.sleep(2 ** attempt)
-                    continue
-                return None
+                if attempt == config.MAX_RETRIES - 1:
+                    return None
 
             except aiohttp.ClientError as e:
                 logger.error(f"API client error for {terabox_link}: {e}")
-                if attempt < config.MAX_RETRIES - 1:
-                    await asyncio.sleep(2 ** attempt)
-                    continue
-                return None
+                if attempt == config.MAX_RETRIES - 1:
+                    return None
 
             except json.JSONDecodeError:
                 logger.error(f"Invalid JSON response for {terabox_link}")
                 return None
 
+            except asyncio.CancelledError:
+                outcome = ResolverController.CANCELLED
+                raise
+
             except Exception as e:
                 logger.error(f"Unexpected error resolving {terabox_link}: {e}", exc_info=True)
                 return None
 
-        logger.error(f"Failed to resolve {terabox_link} after {config.MAX_RETRIES} attempts")
+            finally:
+                latency = time.monotonic() - started
+                backend.record(latency, outcome)
+                controller.release(latency, outcome, retry_after)
+
+            # Back off outside the slot; 429s are already delayed by the controller
+            if outcome == ResolverController.FAILURE and attempt < config.MAX_RETRIES - 1:
+                await asyncio.sleep(self._backoff(attempt))
+
+        logger.error(f"Failed to resolve {terabox_link} on {backend.url} after {config.MAX_RETRIES} attempts")
         return None
 
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Exponential backoff with full jitter so retries don't arrive in lockstep"""
+        return random.uniform(0, 2 ** attempt)
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Parse a Retry-After header given as seconds or an HTTP date, capped at RESOLVER_MAX_RETRY_AFTER"""
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(value)
+                if retry_at.tzinfo is None:
+                    retry_at = retry_at.replace(tzinfo=timezone.utc)
+                seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                return None
+        return min(max(0.0, seconds), config.RESOLVER_MAX_RETRY_AFTER)
+
     async def validate_link(self, link: str) -> bool:
         """Check if link is a valid TeraBox link"""
-        import re
-
-        for pattern in config.TERABOX_DOMAINS:
-            if re.match(pattern, link):
-                return True
-        return False
+        return canonical_share_id(link) is not None
 
 
 # Global API client instance
@@ -0,0 +1,293 @@
+"""
+Bandwidth module for TeraBox Downloader Bot
+Shares download bandwidth between jobs with token buckets and weighted fair queuing
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Iterator
+
+import config
+from helpers.logger import get_logger
+
+logger = get_logger("terabox_bot")
+
+# Smoothing factor for the per-download rate
+RATE_EWMA_ALPHA = 0.2
+
+
+class TokenBucket:
+    """Token bucket refilled at rate bytes per second (0 = unlimited)"""
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    @property
+    def capacity(self) -> float:
+        # Enough burst for one chunk so a single read never waits twice
+        return max(self.rate * config.BANDWIDTH_BURST, config.CHUNK_SIZE)
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def refill(self, now: float):
+        """Add tokens for the time elapsed since the last refill"""
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self) -> bool:
+        """Whether a chunk may be taken (tokens can go into debt by one chunk)"""
+        return self.unlimited or self.tokens > 0
+
+    def take(self, amount: int):
+        if not self.unlimited:
+            self.tokens -= amount
+
+    def wait_time(self) -> float:
+        """Seconds until ready() becomes true"""
+        if self.unlimited or self.tokens > 0:
+            return 0.0
+        return -self.tokens / self.rate + 0.001
+
+    def set_rate(self, rate: int):
+        self.rate = rate
+        self.tokens = min(self.tokens, self.capacity)
+
+
+class Flow:
+    """One download's share of the bandwidth, with throughput tracking"""
+
+    def __init__(self, name: str, user_id: Optional[int], total: int, priority: float):
+        self.name = name
+        self.user_id = user_id
+        self.total = total
+        self.priority = priority
+        self.received = 0
+        self.resumed = 0
+        self.started = time.monotonic()
+        self.vtime = 0.0
+        self.rate = 0.0
+        self._last = self.started
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.total - self.resumed - self.received) if self.total else -1
+
+    def record(self, amount: int):
+        """Count received bytes and update the smoothed rate"""
+        now = time.monotonic()
+        elapsed = max(now - self._last, 1e-3)
+        sample = amount / elapsed
+        self.rate = sample if not self.rate else RATE_EWMA_ALPHA * sample + (1 - RATE_EWMA_ALPHA) * self.rate
+        self.received += amount
+        self._last = now
+
+    def average_rate(self) -> float:
+        """Average bytes per second since the flow started"""
+        return self.received / max(time.monotonic() - self.started, 1e-3)
+
+    def snapshot(self) -> dict:
+        """Get throughput figures for logging and diagnostics"""
+        return {
+            "name": self.name,
+            "user_id": self.user_id,
+            "received": self.received,
+            "total": self.total,
+            "priority": self.priority,
+            "rate": round(self.rate),
+            "average_rate": round(self.average_rate()),
+        }
+
+
+class BandwidthScheduler:
+    """
+    Token-bucket bandwidth scheduler
+
+    Every chunk a download reads is charged to the global bucket
+    (BANDWIDTH_LIMIT) and its user's bucket (USER_BANDWIDTH_LIMIT). When a
+    bucket is empty, waiting chunks are granted in weighted fair order: each
+    flow's virtual time advances by bytes / weight and the smallest goes
+    first. A user's weight is split across their flows, so opening more
+    downloads doesn't earn a bigger share. Flows with at most
+    BANDWIDTH_SMALL_FILE bytes left are boosted so small and nearly finished
+    jobs get through. With both limits at 0 chunks never wait, but
+    throughput is still tracked.
+    """
+
+    def __init__(
+        self,
+        global_rate: int = config.BANDWIDTH_LIMIT,
+        user_rate: int = config.USER_BANDWIDTH_LIMIT,
+    ):
+        self.global_bucket = TokenBucket(global_rate)
+        self.user_rate = user_rate
+        self.user_buckets: Dict[Optional[int], TokenBucket] = {}
+        self.user_overrides: Dict[int, int] = {}
+        self.flows: List[Flow] = []
+        self.vclock = 0.0
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @contextmanager
+    def flow(self, name: str, user_id: Optional[int] = None, total: int = 0, priority: float = 1.0) -> Iterator[Flow]:
+        """
+        Register a download for the duration of a with-block
+
+        Args:
+            name: File name (for logging)
+            user_id: Telegram user the download belongs to
+            total: Expected size in bytes (0 if unknown)
+            priority: Relative weight (higher gets more bandwidth)
+        """
+        flow = Flow(name, user_id, total, priority)
+        flow.vtime = self.vclock
+        self.flows.append(flow)
+        try:
+            yield flow
+        finally:
+            self.flows.remove(flow)
+            if flow.received:
+                logger.info(
+                    f"Throughput for {name}: {flow.average_rate() / (1024 * 1024):.2f} MB/s "
+                    f"({flow.received} bytes)"
+                )
+
+    async def consume(self, flow: Flow, amount: int):
+        """
+        Charge received bytes to a flow, waiting for its turn when limited
+
+        Args:
+            flow: Flow from flow()
+            amount: Bytes just read
+        """
+        flow.record(amount)
+        user_bucket = self._user_bucket(flow.user_id)
+        if self.global_bucket.unlimited and user_bucket.unlimited:
+            return
+
+        now = time.monotonic()
+        self.global_bucket.refill(now)
+        user_bucket.refill(now)
+
+        flow.vtime = max(flow.vtime, self.vclock)
+        start = flow.vtime
+        flow.vtime += amount / self._weight(flow)
+
+        if not self._waiters and self.global_bucket.ready() and user_bucket.ready():
+            self._grant(start, amount, user_bucket)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (start, next(self._seq), amount, flow, waiter))
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            self._waiters = [w for w in self._waiters if w[4] is not waiter]
+            heapq.heapify(self._waiters)
+            raise
+
+    def set_limits(self, global_rate: Optional[int] = None, user_rate: Optional[int] = None):
+        """
+        Change bandwidth caps at runtime
+
+        Args:
+            global_rate: Total bytes per second (0 = unlimited, None = keep)
+            user_rate: Default bytes per second per user (0 = unlimited, None = keep)
+        """
+        if global_rate is not None:
+            self.global_bucket.set_rate(global_rate)
+        if user_rate is not None:
+            self.user_rate = user_rate
+            for user_id, bucket in self.user_buckets.items():
+                if user_id not in self.user_overrides:
+                    bucket.set_rate(user_rate)
+        logger.info(f"Bandwidth limits: global={self.global_bucket.rate} B/s, per user={self.user_rate} B/s")
+        if self._waiters:
+            self._dispatch()
+
+    def set_user_limit(self, user_id: int, rate: Optional[int]):
+        """Override one user's cap (None restores the default)"""
+        if rate is None:
+            self.user_overrides.pop(user_id, None)
+        else:
+            self.user_overrides[user_id] = rate
+        if user_id in self.user_buckets:
+            self.user_buckets[user_id].set_rate(self.user_overrides.get(user_id, self.user_rate))
+        if self._waiters:
+            self._dispatch()
+
+    def stats(self) -> dict:
+        """Get limits and per-download throughput"""
+        return {
+            "global_rate": self.global_bucket.rate,
+            "user_rate": self.user_rate,
+            "waiting": len(self._waiters),
+            "flows": [flow.snapshot() for flow in self.flows],
+        }
+
+    def _user_bucket(self, user_id: Optional[int]) -> TokenBucket:
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_overrides.get(user_id, self.user_rate))
+            self.user_buckets[user_id] = bucket
+        return bucket
+
+    def _weight(self, flow: Flow) -> float:
+        """Flow weight: priority, boosted near the end, split across the user's flows"""
+        weight = max(flow.priority, 0.01)
+        if 0 <= flow.remaining <= config.BANDWIDTH_SMALL_FILE:
+            weight *= config.BANDWIDTH_SMALL_BOOST
+        siblings = sum(1 for other in self.flows if other.user_id == flow.user_id)
+        return weight / max(siblings, 1)
+
+    def _grant(self, start: float, amount: int, user_bucket: TokenBucket):
+        self.vclock = max(self.vclock, start)
+        self.global_bucket.take(amount)
+        user_bucket.take(amount)
+
+    def _dispatch(self):
+        """Grant waiting chunks in virtual time order while buckets have tokens"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        now = time.monotonic()
+        self.global_bucket.refill(now)
+        for bucket in self.user_buckets.values():
+            bucket.refill(now)
+
+        deferred = []
+        while self._waiters and self.global_bucket.ready():
+            start, seq, amount, flow, waiter = heapq.heappop(self._waiters)
+            if waiter.done():
+                continue
+            user_bucket = self._user_bucket(flow.user_id)
+            if not user_bucket.ready():
+                # Capped user; let other users' chunks go ahead
+                deferred.append((start, seq, amount, flow, waiter))
+                continue
+            self._grant(start, amount, user_bucket)
+            waiter.set_result(None)
+
+        for item in deferred:
+            heapq.heappush(self._waiters, item)
+
+        if self._waiters:
+            delay = self.global_bucket.wait_time()
+            if not delay:
+                delay = min(self._user_bucket(w[3].user_id).wait_time() for w in self._waiters)
+            loop = self._waiters[0][4].get_loop()
+            self._timer = loop.call_later(max(delay, 0.001), self._dispatch)
+
+
+# Global bandwidth scheduler instance
+bandwidth = BandwidthScheduler()
@@ -0,0 +1,285 @@
+"""
+Download cache module for TeraBox Downloader Bot
+Keeps completed downloads on disk under a byte budget with LRU eviction
+"""
+
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Tuple
+
+import config
+from helpers.logger import get_logger
+
+logger = get_logger("terabox_bot")
+
+# In-progress files that live next to cached files but are never cache entries
+PARTIAL_SUFFIXES = (".part", ".part.json", ".tmp")
+
+# Directories holding a single job's uncached download
+JOB_DIR_PREFIX = "job-"
+
+
+class CacheEntry:
+    """A completed download in the cache"""
+
+    def __init__(self, key: str, path: Path, size: int, last_access: float):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.last_access = last_access
+        self.refs = 0
+        self.hashes: Dict[str, str] = {}
+
+
+class DownloadCache:
+    """
+    Content-addressed cache of completed downloads
+
+    Entries are keyed by canonical share id plus size and stored as
+    "<root>/<key>/<file_name>", so the upload keeps its original name. Files
+    only enter the cache after an atomic rename, so an entry is always
+    complete. Jobs hold a reference while they upload. Once the cache
+    exceeds DOWNLOAD_CACHE_BYTES, the least recently used unreferenced
+    entries are evicted.
+    """
+
+    def __init__(self, root: Path = config.DOWNLOAD_DIR, max_bytes: int = config.DOWNLOAD_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._by_path: Dict[Path, CacheEntry] = {}
+        self._by_hash: Dict[Tuple[str, str], CacheEntry] = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def make_key(share_id: str, size: int = 0) -> str:
+        """Build a cache key from a canonical share id and the expected size"""
+        return f"{share_id}-{size}" if size else share_id
+
+    def path_for(self, key: str, file_name: str) -> Path:
+        """Path where a download for key should be placed"""
+        entry_dir = self.root / key
+        entry_dir.mkdir(parents=True, exist_ok=True)
+        return entry_dir / file_name
+
+    def acquire(self, key: str, expected_size: int = 0) -> Optional[Path]:
+        """
+        Look up a cached file and take a reference to it
+
+        Args:
+            key: Cache key
+            expected_size: Size the file must have (0 to skip the check)
+
+        Returns:
+            Path to the cached file, or None on a miss
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        try:
+            actual_size = entry.path.stat().st_size
+        except OSError:
+            actual_size = -1
+
+        if actual_size != entry.size or (expected_size and actual_size != expected_size):
+            logger.warning(f"Dropping stale cache entry: {entry.path}")
+            if not entry.refs:
+                self._remove(entry)
+            return None
+
+        entry.refs += 1
+        self._touch(entry)
+        self.hits += 1
+        return entry.path
+
+    def acquire_by_hash(self, algorithm: str, digest: str, expected_size: int = 0) -> Optional[Path]:
+        """
+        Look up a cached file by content digest and take a reference to it
+
+        Lets a share whose resolver reports a checksum reuse identical
+        content cached under another share id.
+
+        Returns:
+            Path to the cached file, or None on a miss
+        """
+        entry = self._by_hash.get((algorithm, (digest or "").strip().lower()))
+        if entry is None:
+            return None
+        return self.acquire(entry.key, expected_size)
+
+    def hashes_for(self, path: Path) -> Dict[str, str]:
+        """Digests recorded for a cached file (empty if unknown)"""
+        entry = self._by_path.get(path)
+        return dict(entry.hashes) if entry else {}
+
+    def add(self, key: str, path: Path, hashes: Optional[Dict[str, str]] = None) -> Path:
+        """
+        Register a completed download and take a reference to it
+
+        Args:
+            key: Cache key
+            path: File that was atomically renamed into place
+            hashes: Digests computed while downloading
+
+        Returns:
+            The same path
+        """
+        old = self.entries.get(key)
+        if old is not None and old.path != path:
+            self._remove(old)
+
+        entry = CacheEntry(key, path, path.stat().st_size, time.time())
+        entry.refs = 1
+        entry.hashes = dict(hashes or {})
+        self.misses += 1
+        self.entries[key] = entry
+        self._by_path[path] = entry
+        for algorithm, digest in entry.hashes.items():
+            self._by_hash[(algorithm, digest)] = entry
+        self.entries.move_to_end(key)
+        self._evict()
+        return path
+
+    def release(self, path: Path) -> bool:
+        """
+        Drop a job's reference to a cached file
+
+        Returns:
+            False if the path is not a cache entry
+        """
+        entry = self._by_path.get(path)
+        if entry is None:
+            return False
+        entry.refs = max(0, entry.refs - 1)
+        self._evict()
+        return True
+
+    def owns(self, path: Path) -> bool:
+        """Whether a path is a cache entry"""
+        return path in self._by_path
+
+    def clear(self):
+        """Remove every entry not currently in use"""
+        for entry in list(self.entries.values()):
+            if not entry.refs:
+                self._remove(entry)
+
+    def evict_for(self, needed: int) -> int:
+        """
+        Evict least recently used unreferenced entries to free space
+
+        Args:
+            needed: Bytes to free
+
+        Returns:
+            Bytes actually freed
+        """
+        freed = 0
+        for entry in list(self.entries.values()):
+            if freed >= needed:
+                break
+            if entry.refs:
+                continue
+            freed += entry.size
+            logger.info(f"Evicting cached download for space: {entry.path} ({entry.size} bytes)")
+            self._remove(entry)
+        return freed
+
+    def evict_older_than(self, max_age: float) -> int:
+        """
+        Evict unreferenced entries not accessed for max_age seconds
+
+        Returns:
+            Bytes freed
+        """
+        cutoff = time.time() - max_age
+        freed = 0
+        for entry in list(self.entries.values()):
+            if entry.last_access > cutoff:
+                break
+            if entry.refs:
+                continue
+            freed += entry.size
+            self._remove(entry)
+        return freed
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry.size for entry in self.entries.values())
+
+    def stats(self) -> dict:
+        """Get cache usage for logging and diagnostics"""
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "in_use": sum(1 for entry in self.entries.values() if entry.refs),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _touch(self, entry: CacheEntry):
+        """Mark an entry as most recently used (persisted through mtime)"""
+        entry.last_access = time.time()
+        self.entries.move_to_end(entry.key)
+        try:
+            os.utime(entry.path, (entry.last_access, entry.last_access))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Evict least recently used unreferenced entries until under budget"""
+        total = self.total_bytes
+        for entry in list(self.entries.values()):
+            if total <= self.max_bytes:
+                break
+            if entry.refs:
+                continue
+            total -= entry.size
+            logger.info(f"Evicting cached download: {entry.path} ({entry.size} bytes)")
+            self._remove(entry)
+
+    def _remove(self, entry: CacheEntry):
+        """Delete an entry's file and forget it"""
+        self.entries.pop(entry.key, None)
+        self._by_path.pop(entry.path, None)
+        for algorithm, digest in entry.hashes.items():
+            if self._by_hash.get((algorithm, digest)) is entry:
+                del self._by_hash[(algorithm, digest)]
+        try:
+            entry.path.unlink(missing_ok=True)
+            entry.path.parent.rmdir()
+        except OSError:
+            # Directory still holds an in-progress download for the same key
+            pass
+
+    def _load(self):
+        """Rebuild the index from disk, oldest access first"""
+        found = []
+        try:
+            for entry_dir in self.root.iterdir():
+                if not entry_dir.is_dir() or entry_dir.name.startswith(JOB_DIR_PREFIX):
+                    continue
+                for path in entry_dir.iterdir():
+                    if path.is_file() and not path.name.endswith(PARTIAL_SUFFIXES):
+                        stat = path.stat()
+                        found.append(CacheEntry(entry_dir.name, path, stat.st_size, stat.st_mtime))
+        except OSError as e:
+            logger.error(f"Failed to scan download cache: {e}")
+
+        for entry in sorted(found, key=lambda e: e.last_access):
+            self.entries[entry.key] = entry
+            self._by_path[entry.path] = entry
+
+        if found:
+            logger.info(f"Download cache loaded: {len(found)} files, {self.total_bytes} bytes")
+        self._evict()
+
+
+# Global download cache instance
+download_cache = DownloadCache()
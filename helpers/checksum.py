@@ -0,0 +1,151 @@
+"""
+Checksum module for TeraBox Downloader Bot
+Hashes downloads incrementally while they are being written
+"""
+
+import asyncio
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Callable, Deque, Dict, Tuple
+
+import config
+from helpers.logger import get_logger
+
+logger = get_logger("terabox_bot")
+
+# hashlib releases the GIL on large updates, so hashing runs beside the event loop
+_hash_executor = ThreadPoolExecutor(
+    max_workers=config.HASH_THREADS,
+    thread_name_prefix="hasher",
+)
+
+
+class StreamHasher:
+    """
+    Incremental digests (e.g. SHA-256, MD5) of a file being downloaded
+
+    Bytes are hashed in file order on the hasher threads. Chunks that
+    continue the hashed prefix are hashed from memory as they are written
+    (feed()). Ranges that arrive out of order, such as later segments of a
+    segmented download or data resumed from a .part file, are hashed from
+    the file once the prefix reaches them (catch_up()). They are read back
+    while the download is still running, usually from the page cache.
+    Updates for one file run one at a time and in order.
+    """
+
+    def __init__(self, algorithms=None):
+        self._hashes = {name: hashlib.new(name) for name in (algorithms or config.CHECKSUM_ALGORITHMS)}
+        self.cursor = 0
+        self._queue: Deque[Tuple[Callable, tuple, asyncio.Future]] = deque()
+        self._running = False
+        self.error: Optional[BaseException] = None
+
+    def feed(self, offset: int, data) -> Optional[asyncio.Future]:
+        """
+        Hash data written at offset if it continues the hashed prefix
+
+        The data must stay unchanged until the returned future is done.
+
+        Returns:
+            Future done once the data is hashed, or None if the data is out
+            of order and will be picked up by catch_up()
+        """
+        if offset != self.cursor or not data:
+            return None
+        self.cursor += len(data)
+        return self._submit(self._update, data)
+
+    def catch_up(self, path: Path, end: int) -> Optional[asyncio.Future]:
+        """
+        Hash the file from the hashed prefix up to end
+
+        Bytes in that range must already have been written to the file.
+        """
+        if end <= self.cursor:
+            return None
+        start, self.cursor = self.cursor, end
+        return self._submit(self._update_from_file, path, start, end)
+
+    async def hexdigests(self) -> Dict[str, str]:
+        """
+        Wait for queued updates and return {algorithm: hex digest}
+
+        Raises:
+            OSError: If reading the file back for catch_up() failed
+        """
+        if self._queue or self._running:
+            done = asyncio.get_running_loop().create_future()
+            self._queue.append((None, (), done))
+            self._run_next()
+            await done
+        if self.error:
+            raise self.error
+        return {name: h.hexdigest() for name, h in self._hashes.items()}
+
+    def _submit(self, func: Callable, *args) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((func, args, future))
+        self._run_next()
+        return future
+
+    def _run_next(self):
+        """Start the next queued update if none is running"""
+        if self._running or not self._queue:
+            return
+        func, args, future = self._queue.popleft()
+        if func is None:
+            # hexdigests() marker: everything queued before it is done
+            if not future.done():
+                future.set_result(None)
+            self._run_next()
+            return
+
+        self._running = True
+        task = asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+
+        def _done(task: asyncio.Future):
+            self._running = False
+            if task.exception() and not self.error:
+                self.error = task.exception()
+            if not future.done():
+                future.set_result(None)
+            self._run_next()
+
+        task.add_done_callback(_done)
+
+    def _update(self, data):
+        for h in self._hashes.values():
+            h.update(data)
+
+    def _update_from_file(self, path: Path, start: int, end: int):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            while start < end:
+                data = os.pread(fd, min(config.CHUNK_SIZE, end - start), start)
+                if not data:
+                    raise OSError(f"{path} is shorter than {end} bytes")
+                self._update(data)
+                start += len(data)
+        finally:
+            os.close(fd)
+
+
+def verify_hashes(actual: Dict[str, str], expected: Optional[Dict[str, str]], name: str) -> bool:
+    """
+    Compare computed digests with expected ones (e.g. from the resolver)
+
+    Only algorithms present in both with a non-empty expected value are
+    compared.
+
+    Returns:
+        False on any mismatch
+    """
+    for algorithm, digest in (expected or {}).items():
+        digest = (digest or "").strip().lower()
+        if digest and algorithm in actual and actual[algorithm] != digest:
+            logger.warning(f"{algorithm} mismatch for {name}: expected {digest}, got {actual[algorithm]}")
+            return False
+    return True
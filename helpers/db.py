@@ -4,16 +4,189 @@ Handles MongoDB operations using Motor (async)
 """
 
 import asyncio
+import time
 from datetime import datetime
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Tuple
 
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
 import config
 from helpers.logger import get_logger
 
 logger = get_logger("terabox_bot")
 
 
+class WriteBuffer:
+    """
+    Write-behind queue of MongoDB writes
+
+    Writes are queued per collection and flushed as one bulk_write each,
+    ordered where their order matters (a user's updates) and unordered
+    otherwise (log entries). The event loop only runs while a webhook
+    update is handled, so nothing flushes in the background: add() flushes
+    once batch_size writes are queued or the oldest has waited interval
+    seconds, and the bot flushes at the end of every update and on
+    shutdown. A batch that fails is queued again ahead of newer writes
+    (retried no sooner than interval seconds later), and past max_pending
+    the oldest writes are dropped, so memory stays bounded while MongoDB is
+    unreachable.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = config.DB_BATCH_SIZE,
+        interval: float = config.DB_BATCH_INTERVAL,
+        max_pending: int = config.DB_BATCH_MAX_PENDING,
+    ):
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.max_pending = max(self.batch_size, max_pending)
+        # collection name -> (collection, ordered, operations)
+        self.pending: Dict[str, Tuple[Any, bool, list]] = {}
+        self.queued = 0
+        self.oldest_at = 0.0
+        # Created on the loop that uses it: wsgi.py and the webhook routes run different loops
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.failed_at = float("-inf")
+        self._dropping = False
+        self.batched = 0
+        self.max_batch = 0
+        self.flush_time = 0.0
+        self.max_flush_time = 0.0
+
+    async def add(self, collection, operation, ordered: bool = True):
+        """
+        Queue a write
+
+        Args:
+            collection: Motor collection to write to
+            operation: pymongo write model (InsertOne, UpdateOne, ...)
+            ordered: Whether this collection's writes must apply in order
+        """
+        now = time.monotonic()
+        if not self.queued:
+            self.oldest_at = now
+        entry = self.pending.setdefault(collection.name, (collection, ordered, []))
+        entry[2].append(operation)
+        self.queued += 1
+
+        due = self.queued >= self.batch_size or now - self.oldest_at >= self.interval
+        # While writes are failing, retrying on every call would only stall the callers
+        if due and now - self.failed_at >= self.interval:
+            await self.flush()
+        self._trim(self.max_pending)
+
+    def queued_for(self, collection) -> int:
+        """Number of writes queued for a collection"""
+        entry = self.pending.get(collection.name)
+        return len(entry[2]) if entry else 0
+
+    async def flush(self) -> bool:
+        """
+        Write everything queued
+
+        Returns:
+            True if every batch was written
+        """
+        async with self._get_lock():
+            if not self.queued:
+                return True
+            batches, self.pending, self.queued = self.pending, {}, 0
+            self.oldest_at = time.monotonic()
+            ok = True
+            for name, (collection, ordered, operations) in batches.items():
+                started = time.monotonic()
+                retry = []
+                try:
+                    await collection.bulk_write(operations, ordered=ordered)
+                    written = len(operations)
+                except BulkWriteError as e:
+                    errors = e.details.get("writeErrors", [])
+                    # Invalid writes won't succeed later; an ordered batch stops at the first one
+                    if ordered and errors:
+                        retry = operations[errors[0]["index"] + 1:]
+                    written = len(operations) - len(retry) - len(errors)
+                    self.failed += len(errors)
+                    logger.error(f"Error writing {len(errors)} queued {name} writes: {errors[0]['errmsg'] if errors else e}")
+                except Exception as e:
+                    retry, written = operations, 0
+                    logger.error(f"Error writing {len(operations)} queued {name} writes: {e}")
+
+                elapsed = time.monotonic() - started
+                self.flushes += 1
+                self.written += written
+                self.batched += len(operations)
+                self.max_batch = max(self.max_batch, len(operations))
+                self.flush_time += elapsed
+                self.max_flush_time = max(self.max_flush_time, elapsed)
+                logger.debug(f"Flushed {written}/{len(operations)} {name} writes in {elapsed * 1000:.1f}ms")
+
+                if retry:
+                    ok = False
+                    self.failed_at = time.monotonic()
+                    self._requeue(name, collection, ordered, retry)
+            if ok:
+                self._dropping = False
+            self._trim(self.max_pending)
+            return ok
+
+    async def close(self):
+        """Flush everything queued, giving up on writes that still fail"""
+        if not await self.flush():
+            logger.warning(f"Discarding {self.queued} database writes that could not be flushed")
+            self.dropped += self.queued
+            self.pending, self.queued = {}, 0
+        logger.info(f"Database write buffer: {self.stats()}")
+
+    def stats(self) -> dict:
+        """Get batching metrics for logging and diagnostics"""
+        return {
+            "queued": self.queued,
+            "flushes": self.flushes,
+            "written": self.written,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "avg_batch": round(self.batched / self.flushes, 1) if self.flushes else 0,
+            "max_batch": self.max_batch,
+            "avg_flush_ms": round(self.flush_time / self.flushes * 1000, 1) if self.flushes else 0,
+            "max_flush_ms": round(self.max_flush_time * 1000, 1),
+        }
+
+    def _get_lock(self) -> asyncio.Lock:
+        """Get the flush lock for the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    def _requeue(self, name: str, collection, ordered: bool, operations: list):
+        """Put failed writes back ahead of those queued since"""
+        entry = self.pending.get(name)
+        newer = entry[2] if entry else []
+        self.pending[name] = (collection, ordered, operations + newer)
+        self.queued += len(operations)
+
+    def _trim(self, limit: int):
+        """Drop the oldest writes of the longest queues until at most limit are queued"""
+        while self.queued > limit:
+            name = max(self.pending, key=lambda key: len(self.pending[key][2]))
+            operations = self.pending[name][2]
+            excess = min(len(operations), self.queued - limit)
+            del operations[:excess]
+            self.queued -= excess
+            self.dropped += excess
+            if not self._dropping:
+                logger.warning(f"Database write queue full, dropping the oldest {name} writes")
+            self._dropping = True
+
+
 class DatabaseManager:
     """MongoDB async database manager"""
 
@@ -22,6 +195,8 @@ class DatabaseManager:
         self.db = None
         self.users_collection = None
         self.logs_collection = None
+        self.media_collection = None
+        self.writes = WriteBuffer()
 
     async def connect(self):
         """Connect to MongoDB"""
@@ -32,11 +207,13 @@ class DatabaseManager:
             # Create collections and indexes
             self.users_collection = self.db["users"]
             self.logs_collection = self.db["logs"]
+            self.media_collection = self.db["media"]
 
             # Create indexes
             await self.users_collection.create_index("user_id", unique=True)
             await self.logs_collection.create_index("timestamp")
             await self.logs_collection.create_index("user_id")
+            await self.media_collection.create_index("keys")
 
             # Test connection
             await self.client.admin.command("ping")
@@ -46,14 +223,18 @@ class DatabaseManager:
             raise
 
     async def disconnect(self):
-        """Disconnect from MongoDB"""
+        """Disconnect from MongoDB, flushing queued writes first"""
         if self.client:
+            await self.writes.close()
             self.client.close()
             logger.info("Disconnected from MongoDB")
 
     async def get_user(self, user_id: int) -> Optional[Dict]:
         """Get user by ID"""
         try:
+            # Apply the user's queued updates so the record read is current
+            if self.writes.queued_for(self.users_collection):
+                await self.writes.flush()
             return await self.users_collection.find_one({"user_id": user_id})
         except Exception as e:
             logger.error(f"Error getting user {user_id}: {e}")
@@ -80,57 +261,99 @@ class DatabaseManager:
             logger.error(f"Error creating user {user_id}: {e}")
             return None
 
-    async def update_user(self, user_id: int, **updates):
-        """Update user record"""
+    async def upsert_user(self, user_id: int, first_name: str, last_name: Optional[str] = None) -> bool:
+        """
+        Create a user record or refresh its names and last_active
+
+        One round trip in place of get_user + create_user + update_user, and
+        safe to repeat: counters and first_seen are only set on insert.
+
+        Returns:
+            True if the write succeeded
+        """
         try:
-            update_data = {
-                **updates,
-                "last_active": datetime.utcnow(),
-            }
-            result = await self.users_collection.update_one(
+            now = datetime.utcnow()
+            await self.users_collection.update_one(
                 {"user_id": user_id},
-                {"$set": update_data},
+                {
+                    "$setOnInsert": {
+                        "first_seen": now,
+                        "total_requests": 0,
+                        "links_processed": 0,
+                        "last_bulk_count": 0,
+                        "downloaded_files": [],
+                    },
+                    "$set": {
+                        "first_name": first_name,
+                        "last_name": last_name or "",
+                    },
+                    # $max, so a queued update applied after this can't move it back
+                    "$max": {"last_active": now},
+                    # Left on older records by update_user(last_active_now=True)
+                    "$unset": {"last_active_now": ""},
+                },
+                upsert=True,
             )
-            return result.modified_count > 0
+            return True
         except Exception as e:
-            logger.error(f"Error updating user {user_id}: {e}")
+            logger.error(f"Error upserting user {user_id}: {e}")
             return False
 
+    async def update_user(self, user_id: int, **updates):
+        """
+        Queue an update to a user record
+
+        The write is deferred to the write buffer, so whether it modified
+        the record isn't known here and nothing is returned.
+        """
+        try:
+            update: Dict[str, Any] = {"$max": {"last_active": datetime.utcnow()}}
+            if updates:
+                update["$set"] = updates
+            await self.writes.add(self.users_collection, UpdateOne({"user_id": user_id}, update))
+        except Exception as e:
+            logger.error(f"Error updating user {user_id}: {e}")
+
     async def increment_user_stats(self, user_id: int, links_count: int = 1):
-        """Increment user statistics"""
+        """Queue an increment of user statistics"""
         try:
-            await self.users_collection.update_one(
-                {"user_id": user_id},
-                {
-                    "$inc": {"total_requests": 1, "links_processed": links_count},
-                    "$set": {"last_active": datetime.utcnow()},
-                },
+            await self.writes.add(
+                self.users_collection,
+                UpdateOne(
+                    {"user_id": user_id},
+                    {
+                        "$inc": {"total_requests": 1, "links_processed": links_count},
+                        "$max": {"last_active": datetime.utcnow()},
+                    },
+                ),
             )
         except Exception as e:
             logger.error(f"Error incrementing user stats for {user_id}: {e}")
 
     async def add_downloaded_file(self, user_id: int, file_info: Dict):
-        """Add downloaded file to user's list"""
+        """Queue adding a downloaded file to user's list"""
         try:
             file_data = {
                 "file_name": file_info.get("file_name", ""),
                 "file_size": file_info.get("file_size", ""),
                 "size_bytes": file_info.get("size_bytes", 0),
                 "download_link": file_info.get("download_link", ""),
+                "share_id": file_info.get("share_id", ""),
                 "timestamp": datetime.utcnow(),
             }
-            await self.users_collection.update_one(
-                {"user_id": user_id},
-                {"$push": {"downloaded_files": file_data}},
+            await self.writes.add(
+                self.users_collection,
+                UpdateOne({"user_id": user_id}, {"$push": {"downloaded_files": file_data}}),
             )
         except Exception as e:
             logger.error(f"Error adding downloaded file for user {user_id}: {e}")
 
     async def insert_log(self, log_entry: Dict):
-        """Insert log entry to database"""
+        """Queue a log entry for the database"""
         try:
             log_entry["timestamp"] = datetime.utcnow()
-            await self.logs_collection.insert_one(log_entry)
+            # Log entries are independent, so their batch is written unordered
+            await self.writes.add(self.logs_collection, InsertOne(log_entry), ordered=False)
         except Exception as e:
             logger.error(f"Error inserting log: {e}")
 
@@ -164,6 +387,29 @@ class DatabaseManager:
             logger.error(f"Error getting logs: {e}")
             return []
 
+    async def get_media(self, keys: List[str]) -> Optional[Dict]:
+        """Get stored media metadata recorded under any of the keys"""
+        try:
+            return await self.media_collection.find_one({"keys": {"$in": keys}}, {"_id": 0})
+        except Exception as e:
+            logger.error(f"Error getting media metadata for {keys}: {e}")
+            return None
+
+    async def save_media(self, keys: List[str], media: Dict[str, Any]):
+        """Store media metadata under all of the keys, merging with a record that has any of them"""
+        try:
+            update = {**media, "updated": datetime.utcnow()}
+            existing = await self.media_collection.find_one({"keys": {"$in": keys}}, {"_id": 1})
+            if existing:
+                await self.media_collection.update_one(
+                    {"_id": existing["_id"]},
+                    {"$set": update, "$addToSet": {"keys": {"$each": keys}}},
+                )
+            else:
+                await self.media_collection.insert_one({**update, "keys": keys})
+        except Exception as e:
+            logger.error(f"Error saving media metadata for {keys}: {e}")
+
 
 # Global database instance
 db = DatabaseManager()
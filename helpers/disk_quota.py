@@ -0,0 +1,253 @@
+"""
+Disk quota module for TeraBox Downloader Bot
+Reserves download space up front and reclaims stale files
+"""
+
+import asyncio
+import shutil
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional, Deque, Set, Tuple
+
+import config
+from helpers.cache import download_cache, PARTIAL_SUFFIXES
+from helpers.logger import get_logger
+
+logger = get_logger("terabox_bot")
+
+
+class Reservation:
+    """Disk space held for one download"""
+
+    def __init__(self, size: int, name: str):
+        self.size = size
+        self.name = name
+        self.released = False
+
+
+class DiskQuota:
+    """
+    Disk budget for the downloads volume
+
+    A download reserves its full size before it starts writing: the
+    resolver's size when known, otherwise the size its source reports (or
+    SIZE_LIMIT_CHANNEL_MB when the source doesn't say). Space counts as
+    available when in-flight reservations plus the download cache stay within
+    DISK_BUDGET_BYTES and the volume keeps DISK_MIN_FREE_BYTES free.
+    Unreferenced cache entries are evicted to make room. If there is still no
+    room, the job waits in FIFO order until space is released or
+    DISK_RESERVE_TIMEOUT passes.
+    """
+
+    def __init__(
+        self,
+        root: Path = config.DOWNLOAD_DIR,
+        budget: int = config.DISK_BUDGET_BYTES,
+        min_free: int = config.DISK_MIN_FREE_BYTES,
+    ):
+        self.root = root
+        self.budget = budget
+        self.min_free = min_free
+        self.reserved = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    async def reserve(
+        self,
+        size: int,
+        name: str,
+        timeout: float = config.DISK_RESERVE_TIMEOUT,
+    ) -> Optional[Reservation]:
+        """
+        Reserve space for a download, waiting while the budget is full
+
+        Args:
+            size: Bytes needed
+            name: File name (for logging)
+            timeout: Seconds to wait for space
+
+        Returns:
+            Reservation, or None if the file can never fit or the wait timed out
+        """
+        if size > self.budget:
+            logger.error(f"{name} ({size} bytes) exceeds the disk budget of {self.budget} bytes")
+            return None
+
+        if not self._waiters and self._try_take(size):
+            return Reservation(size, name)
+
+        logger.info(f"Disk budget full, queueing {name} ({size} bytes, {len(self._waiters)} ahead)")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((size, waiter))
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out waiting {timeout}s for disk space for {name}")
+            return None
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._give_back(size)
+            raise
+        finally:
+            self._waiters = deque(w for w in self._waiters if w[1] is not waiter)
+
+        return Reservation(size, name)
+
+    def release(self, reservation: Optional[Reservation]):
+        """Return a reservation's space and admit queued jobs"""
+        if reservation is None or reservation.released:
+            return
+        reservation.released = True
+        self._give_back(reservation.size)
+
+    def wake(self):
+        """Admit queued jobs that fit now (e.g. after cache entries became evictable)"""
+        while self._waiters:
+            size, waiter = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            if not self._try_take(size):
+                break
+            self._waiters.popleft()
+            waiter.set_result(None)
+
+    def stats(self) -> dict:
+        """Get quota usage for logging and diagnostics"""
+        return {
+            "budget": self.budget,
+            "reserved": self.reserved,
+            "cached": download_cache.total_bytes,
+            "queued": len(self._waiters),
+        }
+
+    def _give_back(self, size: int):
+        """Return bytes to the budget"""
+        self.reserved = max(0, self.reserved - size)
+        self.wake()
+
+    def _try_take(self, size: int) -> bool:
+        """Take size bytes from the budget, evicting cached files if needed"""
+        shortfall = self.reserved + download_cache.total_bytes + size - self.budget
+        if shortfall > 0:
+            download_cache.evict_for(shortfall)
+            if self.reserved + download_cache.total_bytes + size > self.budget:
+                return False
+
+        try:
+            free = shutil.disk_usage(self.root).free
+        except OSError:
+            free = None
+        if free is not None and free - self.min_free < size:
+            freed = download_cache.evict_for(size - (free - self.min_free))
+            if free + freed - self.min_free < size:
+                return False
+
+        self.reserved += size
+        return True
+
+
+class DiskJanitor:
+    """
+    Reclaims orphaned and stale files in the downloads directory
+
+    The bot serves webhooks from short-lived event loop runs, so a
+    long-running background task isn't reliable. Instead every download calls
+    maybe_sweep(), which runs a sweep at most once per JANITOR_INTERVAL.
+    """
+
+    def __init__(
+        self,
+        root: Path = config.DOWNLOAD_DIR,
+        interval: float = config.JANITOR_INTERVAL,
+        partial_max_age: float = config.PARTIAL_MAX_AGE,
+        file_max_age: float = config.DOWNLOAD_MAX_AGE,
+    ):
+        self.root = root
+        self.interval = interval
+        self.partial_max_age = partial_max_age
+        self.file_max_age = file_max_age
+        self.active: Set[Path] = set()
+        self.last_sweep = 0.0
+
+    def maybe_sweep(self):
+        """Sweep if the last sweep is older than the interval"""
+        if time.monotonic() - self.last_sweep >= self.interval:
+            self.sweep()
+
+    def sweep(self, max_age: Optional[float] = None) -> int:
+        """
+        Delete stale files
+
+        Removes .part files and sidecars that no running download owns and
+        that are older than PARTIAL_MAX_AGE, uncached files and unreferenced
+        cache entries older than DOWNLOAD_MAX_AGE, and empty directories.
+
+        Args:
+            max_age: Override both age limits (0 reclaims everything not in use)
+
+        Returns:
+            Bytes reclaimed
+        """
+        self.last_sweep = time.monotonic()
+        partial_age = self.partial_max_age if max_age is None else max_age
+        file_age = self.file_max_age if max_age is None else max_age
+        now = time.time()
+        reclaimed = download_cache.evict_older_than(file_age)
+        active_dirs = {path.parent for path in self.active}
+
+        try:
+            for entry in list(self.root.iterdir()):
+                if entry.is_dir():
+                    for path in list(entry.iterdir()):
+                        if path.name.endswith(PARTIAL_SUFFIXES):
+                            reclaimed += self._remove_partial(path, now, partial_age)
+                        elif entry not in active_dirs and not download_cache.owns(path):
+                            # Uncached job download that was never released
+                            reclaimed += self._remove_if_older(path, now, file_age)
+                    if entry in active_dirs:
+                        continue
+                    try:
+                        entry.rmdir()
+                    except OSError:
+                        pass
+                elif entry.name.endswith(PARTIAL_SUFFIXES):
+                    reclaimed += self._remove_partial(entry, now, partial_age)
+                else:
+                    reclaimed += self._remove_if_older(entry, now, file_age)
+        except OSError as e:
+            logger.error(f"Janitor sweep failed: {e}")
+
+        if reclaimed:
+            logger.info(f"Janitor reclaimed {reclaimed} bytes")
+            disk_quota.wake()
+        return reclaimed
+
+    def _remove_partial(self, path: Path, now: float, max_age: float) -> int:
+        """Remove an in-progress file unless a running download owns it"""
+        # "x.part.json.tmp" -> "x.part.json" -> "x.part"
+        part_path = path
+        for suffix in (".tmp", ".json"):
+            if part_path.name.endswith(suffix):
+                part_path = part_path.with_name(part_path.name[: -len(suffix)])
+        if part_path in self.active:
+            return 0
+        return self._remove_if_older(path, now, max_age)
+
+    @staticmethod
+    def _remove_if_older(path: Path, now: float, max_age: float) -> int:
+        """Remove a file older than max_age seconds"""
+        try:
+            stat = path.stat()
+            if now - stat.st_mtime < max_age:
+                return 0
+            path.unlink()
+            logger.debug(f"Janitor removed: {path}")
+            return stat.st_size
+        except OSError:
+            return 0
+
+
+# Global disk quota and janitor instances
+disk_quota = DiskQuota()
+disk_janitor = DiskJanitor()
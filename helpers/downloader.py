@@ -5,16 +5,242 @@ Handles file downloads with progress tracking
 
 import aiohttp
 import asyncio
+import hashlib
+from collections import deque
 from pathlib import Path
-from typing import Optional, Callable
+from typing import Optional, Callable, Awaitable, Deque, Dict, List, Tuple, Any, Union, BinaryIO
+import json
 import mimetypes
+import os
+import re
+import shutil
+import time
+import uuid
 
 import config
+from helpers.bandwidth import Flow, bandwidth
+from helpers.cache import download_cache, JOB_DIR_PREFIX
+from helpers.checksum import StreamHasher, verify_hashes
+from helpers.disk_quota import disk_quota, disk_janitor, Reservation
+from helpers.file_writer import FileWriter
 from helpers.logger import get_logger
+from helpers.memory_pool import MemoryFile, memory_pool
+from helpers.sources import source_selector, source_host
 
 logger = get_logger("terabox_bot")
 
 
+# Statuses CDNs answer with once a download link has expired
+LINK_EXPIRED_STATUSES = (403, 410)
+
+# "Content-Range: bytes 1048576-2097151/1048576000" (total may be "*")
+CONTENT_RANGE_PATTERN = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)", re.IGNORECASE)
+
+
+class RangeNotSupportedError(Exception):
+    """Raised when a server ignores Range requests during a segmented download"""
+
+
+class LinkExpiredError(Exception):
+    """Raised when a download URL answers with an expiry status"""
+
+    def __init__(self, url: str, status: int):
+        super().__init__(f"Download link expired ({status}) on {source_host(url)}")
+        self.url = url
+        self.status = status
+
+
+class DownloadAbortedError(Exception):
+    """Raised to a DownloadWatcher's waiters when the download fails or restarts"""
+
+
+class DownloadWatcher:
+    """
+    Follows a download's progress on disk while it runs
+
+    The downloader publishes the byte ranges it has written (each time it
+    saves resume state), the file's path (the .part, then the final file once
+    renamed) and the outcome, so a consumer such as the file splitter can read
+    finished parts of the file before the whole download is done.
+    """
+
+    def __init__(self):
+        self.path: Optional[Path] = None
+        self.total = 0
+        self.ranges: List[List[int]] = []
+        self.finished = False
+        self.failed = False
+        self._waiters: List[asyncio.Future] = []
+
+    def update(self, path: Path, ranges: List, total: int):
+        """Record the file's location and the ranges written so far"""
+        if self.total and total and total != self.total:
+            # A different version of the remote file; bytes already read are stale
+            self.reset()
+            return
+        self.path = path
+        self.total = total or self.total
+        self.ranges = [list(r) for r in ranges]
+        self._wake()
+
+    def reset(self):
+        """The partial download was discarded; parts already read are invalid"""
+        self.failed = True
+        self._wake()
+
+    def finish(self, result: Any):
+        """Record the outcome of the download (a Path, or anything else on failure)"""
+        if isinstance(result, Path) and not self.failed:
+            self.path = result
+            try:
+                self.total = result.stat().st_size
+            except OSError:
+                self.failed = True
+            else:
+                self.ranges = [[0, self.total]]
+        else:
+            self.failed = True
+        self.finished = True
+        self._wake()
+
+    def covers(self, start: int, end: int) -> bool:
+        """Whether bytes [start, end) are on disk"""
+        return any(s <= start and end <= e for s, e in self.ranges)
+
+    def available_from(self, start: int) -> int:
+        """End of the bytes on disk starting at start (start itself if none)"""
+        for s, e in self.ranges:
+            if s <= start < e:
+                return e
+        return start
+
+    async def wait_for(self, start: int, end: int) -> Path:
+        """
+        Wait until bytes [start, end) are on disk
+
+        Returns:
+            Path to read them from (it changes once the download completes)
+
+        Raises:
+            DownloadAbortedError: If the download fails or is discarded first
+        """
+        while True:
+            if self.failed:
+                raise DownloadAbortedError("Download failed or was discarded")
+            if self.path is not None and self.covers(start, end):
+                return self.path
+            if self.finished:
+                raise DownloadAbortedError(f"Download ended without bytes {start}-{end}")
+            await self.changed()
+
+    async def wait_size(self) -> int:
+        """
+        Wait until the file's size is known
+
+        Raises:
+            DownloadAbortedError: If the download fails or is discarded first
+        """
+        while not self.total and not self.finished and not self.failed:
+            await self.changed()
+        if self.failed:
+            raise DownloadAbortedError("Download failed or was discarded")
+        return self.total
+
+    async def wait_finished(self) -> Path:
+        """Wait for the download to complete and return the final file"""
+        while not self.finished and not self.failed:
+            await self.changed()
+        if self.failed:
+            raise DownloadAbortedError("Download failed or was discarded")
+        return self.path
+
+    async def changed(self):
+        """Wait for the next update"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _wake(self):
+        """Resolve everyone waiting for an update"""
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class Segment:
+    """Byte range [pos, end) of a file fetched over one connection"""
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.pos = start
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.end - self.pos)
+
+
+class BodyReader:
+    """
+    Reads a response body into caller-supplied buffers
+
+    StreamReader.read(n), which iter_chunked() uses, joins the buffered
+    network chunks into a new bytes object on every call. Here the chunks
+    from readany() are copied straight into a reused buffer, and any bytes
+    that don't fit are kept for the next call.
+    """
+
+    def __init__(self, content: aiohttp.StreamReader):
+        self.content = content
+        self._leftover = memoryview(b"")
+
+    async def readinto(self, buffer: bytearray) -> int:
+        """
+        Fill buffer from the body
+
+        Returns:
+            Bytes read; less than len(buffer) only at the end of the body
+        """
+        view = memoryview(buffer)
+        size = len(view)
+        filled = 0
+        while filled < size:
+            if not self._leftover:
+                data = await self.content.readany()
+                if not data:
+                    break
+                self._leftover = memoryview(data)
+            count = min(len(self._leftover), size - filled)
+            view[filled:filled + count] = self._leftover[:count]
+            self._leftover = self._leftover[count:]
+            filled += count
+        return filled
+
+
+class ProgressThrottle:
+    """Calls a progress callback at most once per PROGRESS_INTERVAL seconds"""
+
+    def __init__(self, callback: Optional[Callable], total: int):
+        self.callback = callback
+        self.total = total
+        self.last = 0.0
+
+    async def update(self, downloaded: int):
+        """Report progress if the interval has passed or the download is complete"""
+        if not self.callback or self.total <= 0:
+            return
+        now = time.monotonic()
+        if downloaded < self.total and now - self.last < config.PROGRESS_INTERVAL:
+            return
+        self.last = now
+        await self.callback((downloaded / self.total) * 100, downloaded, self.total)
+
+
 class FileDownloader:
     """Async file downloader with progress tracking"""
 
@@ -23,6 +249,10 @@ class FileDownloader:
         self.timeout = aiohttp.ClientTimeout(total=config.DOWNLOAD_TIMEOUT)
         self.downloads_dir = config.DOWNLOAD_DIR
         self.downloads_dir.mkdir(exist_ok=True)
+        self._flights: Dict[Tuple[str, str], List[asyncio.Future]] = {}
+        self._job_hashes: Dict[Path, Dict[str, str]] = {}
+        self._watchers: Dict[Path, DownloadWatcher] = {}
+        self._reservations: Dict[Path, Reservation] = {}
 
     async def init_session(self):
         """Initialize aiohttp session"""
@@ -34,78 +264,1316 @@ class FileDownloader:
         if self.session:
             await self.session.close()
 
+    async def fetch(
+        self,
+        url: str,
+        file_name: str,
+        progress_callback: Optional[Callable] = None,
+        share_id: Optional[str] = None,
+        size_hint: int = 0,
+        user_id: Optional[int] = None,
+        priority: float = 1.0,
+        checksums: Optional[Dict[str, str]] = None,
+        mirrors: Optional[List[str]] = None,
+        relink: Optional[Callable[[], Awaitable[List[str]]]] = None,
+        watcher: Optional[DownloadWatcher] = None,
+    ) -> Optional[Union[MemoryFile, Path]]:
+        """
+        Download a file into memory when small enough, otherwise to disk
+
+        Files up to MEMORY_FAST_PATH_SIZE are buffered in the shared memory
+        pool and never touch the disk. Larger files, files whose real size
+        exceeds the hint, and files that don't fit the memory budget go
+        through download(). Concurrent fetches of the same share share one
+        transfer; each caller gets its own reference to release(). A cached
+        file with a matching checksum is reused even under another share id.
+        In-memory downloads use the source with the best host history.
+
+        Args:
+            url: Download URL
+            file_name: Filename used for the upload
+            progress_callback: Async callback for progress updates
+            share_id: Canonical share id
+            size_hint: Expected size in bytes (e.g. the resolver's size_bytes)
+            user_id: Requesting user, for bandwidth sharing
+            priority: Bandwidth weight relative to other downloads
+            checksums: Expected digests by algorithm (e.g. the resolver's md5)
+            mirrors: Other URLs serving the same file (e.g. the resolver's proxy_url)
+            relink: Coroutine function returning fresh URLs once the current
+                ones expire (e.g. api_client.refresh_link)
+            watcher: Follows the download on disk (e.g. for splitting it
+                while it runs); always finished with the outcome
+
+        Returns:
+            MemoryFile or Path (call release() when done), or None on failure
+        """
+        result = None
+        try:
+            if not share_id:
+                result = await self._fetch(
+                    url, file_name, progress_callback, None, size_hint, user_id, priority, checksums, mirrors, relink,
+                    watcher,
+                )
+                return result
+
+            cache_key = download_cache.make_key(share_id, size_hint)
+            result = await self._single_flight(
+                ("fetch", cache_key),
+                cache_key,
+                lambda: self._fetch(
+                    url, file_name, progress_callback, share_id, size_hint, user_id, priority, checksums, mirrors,
+                    relink, watcher,
+                ),
+            )
+            return result
+        finally:
+            if watcher:
+                # Joined and cached fetches only report the outcome
+                watcher.finish(result)
+
+    async def _fetch(
+        self,
+        url: str,
+        file_name: str,
+        progress_callback: Optional[Callable],
+        share_id: Optional[str],
+        size_hint: int,
+        user_id: Optional[int],
+        priority: float,
+        checksums: Optional[Dict[str, str]],
+        mirrors: Optional[List[str]],
+        relink: Optional[Callable[[], Awaitable[List[str]]]],
+        watcher: Optional[DownloadWatcher] = None,
+    ) -> Optional[Union[MemoryFile, Path]]:
+        """Run one fetch (see fetch())"""
+        if share_id:
+            cached = download_cache.acquire(download_cache.make_key(share_id, size_hint), size_hint)
+            if cached:
+                logger.info(f"Serving from cache: {cached}")
+                return cached
+
+        for algorithm, digest in (checksums or {}).items():
+            cached = download_cache.acquire_by_hash(algorithm, digest, size_hint)
+            if cached:
+                logger.info(f"Serving identical content from cache ({algorithm} match): {cached}")
+                return cached
+
+        if 0 < size_hint <= config.MEMORY_FAST_PATH_SIZE:
+            memory_file = memory_pool.try_acquire(size_hint, file_name)
+            if memory_file is None:
+                logger.debug(f"Memory budget full, downloading {file_name} to disk")
+            else:
+                source = source_selector.rank(self._sources(url, mirrors))[0]
+                with bandwidth.flow(file_name, user_id, size_hint, priority) as flow:
+                    in_memory = await self._download_to_memory(
+                        source, memory_file, flow, checksums, progress_callback
+                    )
+                if in_memory:
+                    logger.info(f"Download completed in memory: {file_name} ({memory_file.size} bytes)")
+                    return memory_file
+                memory_file.release()
+
+        return await self.download(
+            url, file_name, progress_callback, share_id, size_hint, user_id, priority, checksums, mirrors, relink,
+            watcher,
+        )
+
+    async def _download_to_memory(
+        self,
+        url: str,
+        memory_file: MemoryFile,
+        flow: Flow,
+        checksums: Optional[Dict[str, str]] = None,
+        progress_callback: Optional[Callable] = None,
+    ) -> bool:
+        """
+        Download into a pooled buffer
+
+        Returns:
+            True on success, False if the file should be fetched to disk instead
+        """
+        if not self.session:
+            await self.init_session()
+
+        try:
+            async with self.session.get(url, allow_redirects=True) as response:
+                if response.status != 200:
+                    if response.status not in LINK_EXPIRED_STATUSES:
+                        source_selector.record_failure(url)
+                    return False
+
+                total_size = int(response.headers.get("content-length", 0))
+                if total_size > memory_file.capacity:
+                    logger.debug(f"{memory_file.name} larger than expected, spooling to disk")
+                    return False
+
+                progress = ProgressThrottle(progress_callback, total_size)
+                hasher = StreamHasher(self._hash_algorithms(checksums))
+                while True:
+                    # readany() hands over buffered chunks without joining them
+                    chunk = await response.content.readany()
+                    if not chunk:
+                        break
+                    offset = memory_file.size
+                    if not memory_file.write(chunk):
+                        logger.debug(f"{memory_file.name} overflowed its buffer, spooling to disk")
+                        return False
+                    hasher.feed(offset, chunk)
+                    await bandwidth.consume(flow, len(chunk))
+                    await progress.update(memory_file.size)
+
+                if total_size and memory_file.size != total_size:
+                    logger.warning(
+                        f"{memory_file.name} truncated at {memory_file.size}/{total_size} bytes, retrying on disk"
+                    )
+                    source_selector.record_failure(url)
+                    return False
+
+                if memory_file.size >= config.SOURCE_RACE_BYTES:
+                    source_selector.record(url, memory_file.size, time.monotonic() - flow.started)
+                memory_file.hashes = await hasher.hexdigests()
+                return verify_hashes(memory_file.hashes, checksums, memory_file.name)
+
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            logger.warning(f"In-memory download failed, retrying on disk: {e}")
+            source_selector.record_failure(url)
+            return False
+
+    async def fetch_sample(
+        self,
+        url: str,
+        file_name: str,
+        mirrors: Optional[List[str]] = None,
+        share_id: Optional[str] = None,
+        size_hint: int = 0,
+        head_bytes: int = config.MEDIA_SAMPLE_HEAD_BYTES,
+        tail_bytes: int = config.MEDIA_SAMPLE_TAIL_BYTES,
+    ) -> Optional[Tuple[Path, int]]:
+        """
+        Fetch the start and end of a remote file for probing before downloading it
+
+        The first head_bytes and last tail_bytes (where an MP4 without
+        faststart keeps its index) are fetched with Range requests and written
+        at their offsets in a sparse file of the full size, so ffmpeg can seek
+        in it as if it were the whole file. The caller deletes the sample.
+        Shares already in the download cache aren't sampled.
+
+        Args:
+            url: Download URL
+            file_name: Filename (for logging)
+            mirrors: Other URLs serving the same file
+            share_id: Canonical share id
+            size_hint: Expected size in bytes
+            head_bytes: Bytes to fetch from the start
+            tail_bytes: Bytes to fetch from the end
+
+        Returns:
+            (sample path, full size), or None if the source doesn't support
+            ranges, the file isn't bigger than the sample, or a request failed
+        """
+        if share_id and download_cache.make_key(share_id, size_hint) in download_cache.entries:
+            return None
+        if not self.session:
+            await self.init_session()
+
+        source = source_selector.rank(self._sources(url, mirrors))[0]
+        try:
+            probe = await self._probe(source)
+        except LinkExpiredError:
+            return None
+        total_size = probe["size"]
+        if not probe["supports_ranges"] or total_size <= head_bytes + tail_bytes:
+            return None
+
+        sample_path = self.downloads_dir / f"sample-{uuid.uuid4().hex}.tmp"
+        validators = self._validators(probe)
+        ranges = [(0, head_bytes)]
+        if tail_bytes:
+            ranges.append((total_size - tail_bytes, total_size))
+
+        writer = None
+        tasks: List[asyncio.Future] = []
+        sampled = False
+        try:
+            writer = await FileWriter.open(sample_path, truncate=True)
+            tasks = [
+                asyncio.ensure_future(self._fetch_range(probe["url"], start, end, writer, validators))
+                for start, end in ranges
+            ]
+            await asyncio.gather(*tasks)
+            await writer.close()
+            # Extend to the full size without allocating the gap
+            os.truncate(sample_path, total_size)
+            sampled = True
+        except (aiohttp.ClientError, asyncio.TimeoutError, LinkExpiredError, RangeNotSupportedError, OSError) as e:
+            logger.debug(f"Could not sample {file_name}: {e!r}")
+        finally:
+            if not sampled:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                if writer:
+                    try:
+                        await writer.close()
+                    except OSError:
+                        pass
+                sample_path.unlink(missing_ok=True)
+
+        if not sampled:
+            return None
+
+        logger.debug(f"Sampled {sum(end - start for start, end in ranges)} of {total_size} bytes: {file_name}")
+        return sample_path, total_size
+
+    async def _fetch_range(self, url: str, start: int, end: int, writer: FileWriter, validators: Dict[str, Any]):
+        """Fetch bytes [start, end) of a file and queue them at their offset"""
+        headers = self._range_headers(start, end, validators)
+        timeout = aiohttp.ClientTimeout(total=config.API_TIMEOUT)
+        async with self.session.get(url, headers=headers, allow_redirects=True, timeout=timeout) as response:
+            if response.status in LINK_EXPIRED_STATUSES:
+                raise LinkExpiredError(url, response.status)
+            if response.status != 206:
+                raise RangeNotSupportedError(url)
+
+            position = start
+            while position < end:
+                chunk = await response.content.readany()
+                if not chunk:
+                    break
+                chunk = chunk[: end - position]
+                await writer.write(chunk, position)
+                position += len(chunk)
+
+        if position < end:
+            raise aiohttp.ClientPayloadError(f"Range {start}-{end} ended at {position}")
+
+    def open_file(self, downloaded: Union[MemoryFile, Path]) -> BinaryIO:
+        """Open a fetch() result for reading/uploading"""
+        if isinstance(downloaded, MemoryFile):
+            return downloaded.open()
+        return open(downloaded, "rb")
+
+    def release(self, downloaded: Union[MemoryFile, Path]):
+        """Release a fetch()/download() result once the job is done with it"""
+        if isinstance(downloaded, MemoryFile):
+            downloaded.release()
+        elif not download_cache.release(downloaded):
+            # Uncached downloads live in a job directory of their own
+            disk_janitor.active.discard(downloaded)
+            self._job_hashes.pop(downloaded, None)
+            self._cleanup_file(downloaded)
+            if downloaded.parent != self.downloads_dir:
+                try:
+                    downloaded.parent.rmdir()
+                except OSError:
+                    pass
+        disk_quota.wake()
+
+    def content_hashes(self, downloaded: Union[MemoryFile, Path]) -> Dict[str, str]:
+        """
+        Digests of a fetch()/download() result, usable as a content/dedup key
+
+        Returns:
+            {algorithm: hex digest}, empty if unknown (e.g. cache entries
+            reloaded from disk after a restart)
+        """
+        if isinstance(downloaded, MemoryFile):
+            return downloaded.hashes
+        return download_cache.hashes_for(downloaded) or self._job_hashes.get(downloaded, {})
+
+    async def _single_flight(
+        self,
+        flight_key: Tuple[str, str],
+        cache_key: str,
+        start: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        Coalesce concurrent requests for the same file into one transfer
+
+        The first caller runs start(); callers arriving while it runs wait for
+        its result and each get their own reference to it.
+
+        Args:
+            flight_key: Identifies the transfer (kind of request and cache key)
+            cache_key: Download cache key, used to reference a shared file
+            start: Coroutine factory that performs the transfer
+
+        Returns:
+            The transfer's result (a separate reference per caller)
+        """
+        waiters = self._flights.get(flight_key)
+        if waiters is not None:
+            logger.info(f"Joining in-flight download: {cache_key} ({len(waiters) + 1} waiting)")
+            waiter = asyncio.get_running_loop().create_future()
+            waiters.append(waiter)
+            try:
+                return await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled() and waiter.result():
+                    self.release(waiter.result())
+                raise
+
+        self._flights[flight_key] = waiters = []
+        result = None
+        try:
+            result = await start()
+            return result
+        finally:
+            del self._flights[flight_key]
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(self._share(result, cache_key))
+
+    @staticmethod
+    def _hash_algorithms(checksums: Optional[Dict[str, str]]) -> List[str]:
+        """CHECKSUM_ALGORITHMS plus any algorithm we have an expected digest for"""
+        algorithms = list(config.CHECKSUM_ALGORITHMS)
+        for algorithm, digest in (checksums or {}).items():
+            if digest and algorithm not in algorithms and algorithm in hashlib.algorithms_available:
+                algorithms.append(algorithm)
+        return algorithms
+
+    @staticmethod
+    def _share(result: Any, cache_key: str) -> Any:
+        """Take another reference to a transfer's result for a joined caller"""
+        if isinstance(result, MemoryFile):
+            return result.retain()
+        if isinstance(result, Path):
+            return download_cache.acquire(cache_key)
+        return None
+
     async def download(
         self,
         url: str,
         file_name: str,
         progress_callback: Optional[Callable] = None,
+        share_id: Optional[str] = None,
+        size_hint: int = 0,
+        user_id: Optional[int] = None,
+        priority: float = 1.0,
+        checksums: Optional[Dict[str, str]] = None,
+        mirrors: Optional[List[str]] = None,
+        relink: Optional[Callable[[], Awaitable[List[str]]]] = None,
+        watcher: Optional[DownloadWatcher] = None,
     ) -> Optional[Path]:
         """
         Download file from URL
 
+        Data is written to "<file_name>.part" with a JSON sidecar recording the
+        byte ranges received and the server validators, so retries and process
+        restarts resume with Range requests. The file is renamed into place
+        only once complete.
+
+        The expected size is reserved against the disk budget first; when the
+        budget is full the download waits for space. Reads are paced by the
+        bandwidth scheduler under the user's share.
+
+        Every download is hashed as it is written (CHECKSUM_ALGORITHMS) and
+        checked against content-length and the expected checksums; a corrupt
+        download is discarded and retried. content_hashes() returns the
+        digests.
+
+        With mirrors, the sources are raced over their first
+        SOURCE_RACE_BYTES and the download continues on the faster one, unless
+        recent per-host speed history already says which is faster. When an
+        attempt fails the next one switches to another source and resumes the
+        .part from there. When every source answers 403/410 the link has
+        expired: relink() is asked for fresh URLs (up to LINK_REFRESH_ATTEMPTS
+        times) and the download continues from the bytes already received.
+
+        With a share id the file goes into the download cache, keyed by share
+        id and size; a cached copy is returned without refetching, and
+        concurrent downloads of the same share share one transfer. Without a
+        share id the file goes into a directory of its own for this job.
+        Either way the caller must release() the result when done.
+
         Args:
             url: Download URL
             file_name: Local filename to save as
             progress_callback: Async callback for progress updates
+            share_id: Canonical share id
+            size_hint: Expected size in bytes (0 if unknown)
+            user_id: Requesting user, for bandwidth sharing
+            priority: Bandwidth weight relative to other downloads
+            checksums: Expected digests by algorithm (e.g. the resolver's md5)
+            mirrors: Other URLs serving the same file (e.g. the resolver's proxy_url)
+            relink: Coroutine function returning fresh URLs once the current
+                ones expire (e.g. api_client.refresh_link)
+            watcher: Follows the download on disk (e.g. for splitting it
+                while it runs); always finished with the outcome
 
         Returns:
             Path to downloaded file or None on failure
         """
+        result = None
+        try:
+            if not share_id:
+                result = await self._download(
+                    url, file_name, progress_callback, None, size_hint, user_id, priority, checksums, mirrors, relink,
+                    watcher,
+                )
+                return result
+
+            cache_key = download_cache.make_key(share_id, size_hint)
+            result = await self._single_flight(
+                ("download", cache_key),
+                cache_key,
+                lambda: self._download(
+                    url, file_name, progress_callback, share_id, size_hint, user_id, priority, checksums, mirrors,
+                    relink, watcher,
+                ),
+            )
+            return result
+        finally:
+            if watcher:
+                watcher.finish(result)
+
+    async def _download(
+        self,
+        url: str,
+        file_name: str,
+        progress_callback: Optional[Callable],
+        share_id: Optional[str],
+        size_hint: int,
+        user_id: Optional[int],
+        priority: float,
+        checksums: Optional[Dict[str, str]],
+        mirrors: Optional[List[str]],
+        relink: Optional[Callable[[], Awaitable[List[str]]]],
+        watcher: Optional[DownloadWatcher] = None,
+    ) -> Optional[Path]:
+        """Run one download (see download())"""
         if not self.session:
             await self.init_session()
 
-        file_path = self.downloads_dir / file_name
+        disk_janitor.maybe_sweep()
 
+        cache_key = download_cache.make_key(share_id, size_hint) if share_id else None
+        if cache_key:
+            cached = download_cache.acquire(cache_key, size_hint)
+            if cached:
+                logger.info(f"Serving from cache: {cached}")
+                return cached
+            file_path = download_cache.path_for(cache_key, file_name)
+        else:
+            job_dir = self.downloads_dir / f"{JOB_DIR_PREFIX}{uuid.uuid4().hex[:12]}"
+            job_dir.mkdir()
+            file_path = job_dir / file_name
+        part_path = self._part_path(file_path)
+
+        disk_janitor.active.add(part_path)
+        if watcher:
+            self._watchers[part_path] = watcher
         try:
-            # Check if file already exists
-            if file_path.exists():
-                logger.warning(f"File already exists: {file_path}")
-                return file_path
+            # Without a size hint, space is reserved once a source reports the size
+            if size_hint and not await self._reserve_space(part_path, size_hint):
+                return None
+            with bandwidth.flow(file_name, user_id, size_hint, priority) as flow:
+                result = await self._download_with_relinks(
+                    self._sources(url, mirrors),
+                    relink,
+                    file_name,
+                    file_path,
+                    part_path,
+                    cache_key,
+                    flow,
+                    checksums,
+                    progress_callback,
+                )
+            if result and not cache_key:
+                # Keep the janitor away until the job releases it
+                disk_janitor.active.add(result)
+            elif not result and not cache_key:
+                # A job directory can't be resumed by a later job, whatever CLEANUP_DOWNLOADS says
+                self._discard_partial(part_path)
+                shutil.rmtree(part_path.parent, ignore_errors=True)
+            return result
+        finally:
+            disk_janitor.active.discard(part_path)
+            self._watchers.pop(part_path, None)
+            disk_quota.release(self._reservations.pop(part_path, None))
 
-            logger.info(f"Starting download: {file_name}")
+    async def _download_with_relinks(
+        self,
+        sources: List[str],
+        relink: Optional[Callable[[], Awaitable[List[str]]]],
+        file_name: str,
+        file_path: Path,
+        part_path: Path,
+        cache_key: Optional[str],
+        flow: Flow,
+        checksums: Optional[Dict[str, str]] = None,
+        progress_callback: Optional[Callable] = None,
+    ) -> Optional[Path]:
+        """Run download attempts, re-resolving the link whenever every source has expired"""
+        logger.info(f"Starting download: {file_name}")
+        for refresh in range(config.LINK_REFRESH_ATTEMPTS + 1):
+            try:
+                return await self._download_with_retries(
+                    sources, file_name, file_path, part_path, cache_key, flow, checksums, progress_callback
+                )
+            except LinkExpiredError:
+                if relink is None or refresh == config.LINK_REFRESH_ATTEMPTS:
+                    break
+                sources = await relink()
+                if not sources:
+                    break
+                # The .part and its sidecar are kept, so this resumes where the old link stopped
+                logger.info(f"Continuing {file_name} on a re-resolved link")
 
-            async with self.session.get(url, allow_redirects=True) as response:
-                if response.status != 200:
-                    logger.error(f"Download failed with status {response.status}: {url}")
-                    return None
+        logger.error(f"Download link expired and could not be refreshed: {file_name}")
+        return None
 
-                total_size = int(response.headers.get("content-length", 0))
+    async def _download_with_retries(
+        self,
+        sources: List[str],
+        file_name: str,
+        file_path: Path,
+        part_path: Path,
+        cache_key: Optional[str],
+        flow: Flow,
+        checksums: Optional[Dict[str, str]] = None,
+        progress_callback: Optional[Callable] = None,
+    ) -> Optional[Path]:
+        """
+        Run download attempts, keeping the .part between them
 
-                # Check file size limits
-                if total_size > config.SIZE_LIMIT_CHANNEL_MB * 1024 * 1024:
-                    logger.error(f"File too large ({total_size} bytes): {file_name}")
-                    return None
+        After a failed attempt the next one switches to a source that hasn't
+        failed yet, without backing off, and resumes the .part from it.
 
-                downloaded_size = 0
+        Raises:
+            LinkExpiredError: Once every source has answered with an expiry status
+        """
+        previous_hashes = None
+        algorithms = self._hash_algorithms(checksums)
+        failed: List[str] = []
 
-                with open(file_path, "wb") as f:
-                    async for chunk in response.content.iter_chunked(config.CHUNK_SIZE):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded_size += len(chunk)
+        for attempt in range(config.MAX_RETRIES):
+            url = None
+            try:
+                url, probe = await self._choose_source([s for s in sources if s not in failed] or sources)
+                started, received = time.monotonic(), flow.received
+                result = await self._download_part(url, probe, part_path, flow, algorithms, progress_callback)
+                if result is None:
+                    if self._fall_back(url, sources, failed, file_name):
+                        continue
+                    self._discard_partial(part_path)
+                    return None
 
-                            # Report progress
-                            if progress_callback and total_size > 0:
-                                percentage = (downloaded_size / total_size) * 100
-                                await progress_callback(percentage, downloaded_size, total_size)
+                if flow.received - received >= config.SOURCE_RACE_BYTES:
+                    source_selector.record(url, flow.received - received, time.monotonic() - started)
 
-                logger.info(f"Download completed: {file_name} ({downloaded_size} bytes)")
+                hashes = result["hashes"]
+                if not verify_hashes(hashes, checksums, file_name):
+                    if hashes != previous_hashes:
+                        # Corrupt: start over rather than resume from bad data
+                        logger.warning(
+                            f"Checksum mismatch, discarding download: {file_name} "
+                            f"(attempt {attempt + 1}/{config.MAX_RETRIES})"
+                        )
+                        previous_hashes = hashes
+                        self._discard_partial(part_path)
+                        if attempt < config.MAX_RETRIES - 1:
+                            await asyncio.sleep(2 ** attempt)
+                        continue
+                    # Two downloads agree with each other but not with the resolver
+                    logger.warning(f"Resolver checksum looks wrong, keeping identical re-download: {file_name}")
+
+                os.replace(part_path, file_path)
+                self._state_path(part_path).unlink(missing_ok=True)
+                watcher = self._watchers.get(part_path)
+                if watcher:
+                    watcher.update(file_path, [[0, result["size"]]], result["size"])
+                logger.info(f"Download completed: {file_name} ({result['size']} bytes, {hashes})")
+                if cache_key:
+                    download_cache.add(cache_key, file_path, hashes)
+                else:
+                    self._job_hashes[file_path] = hashes
                 return file_path
 
-        except asyncio.TimeoutError:
-            logger.error(f"Download timeout: {file_name}")
-            self._cleanup_file(file_path)
+            except LinkExpiredError as e:
+                # Expiry says nothing about the host's health; try another source
+                logger.warning(f"{e}: {file_name} (attempt {attempt + 1}/{config.MAX_RETRIES})")
+                # e.url may be where the source redirected to
+                expired = url or e.url
+                if expired not in failed:
+                    failed.append(expired)
+                if len(failed) >= len(sources):
+                    raise
+                continue
+
+            except asyncio.TimeoutError:
+                logger.warning(f"Download timeout: {file_name} (attempt {attempt + 1}/{config.MAX_RETRIES})")
+
+            except aiohttp.ClientError as e:
+                logger.warning(f"Download client error: {e} (attempt {attempt + 1}/{config.MAX_RETRIES})")
+
+            except Exception as e:
+                logger.error(f"Download error: {e}", exc_info=True)
+                self._discard_partial(part_path)
+                return None
+
+            if self._fall_back(url, sources, failed, file_name):
+                continue
+            if attempt < config.MAX_RETRIES - 1:
+                await asyncio.sleep(2 ** attempt)
+
+        # Partial data and its sidecar stay on disk so the next attempt resumes
+        logger.error(f"Download failed after {config.MAX_RETRIES} attempts, kept partial: {part_path}")
+        return None
+
+    @staticmethod
+    def _sources(url: str, mirrors: Optional[List[str]]) -> List[str]:
+        """The download URL followed by distinct, non-empty mirrors"""
+        sources = [url] if url else []
+        for mirror in mirrors or []:
+            if mirror and mirror not in sources:
+                sources.append(mirror)
+        return sources
+
+    @staticmethod
+    def _fall_back(url: str, sources: List[str], failed: List[str], file_name: str) -> bool:
+        """
+        Record a failed attempt on a source
+
+        Returns:
+            True if another source is left to try
+        """
+        source_selector.record_failure(url)
+        if url not in failed:
+            failed.append(url)
+        if len(failed) >= len(sources):
+            return False
+        logger.warning(f"Switching source after {source_host(url)} failed: {file_name}")
+        return True
+
+    async def _choose_source(self, urls: List[str]) -> Tuple[str, Dict[str, Any]]:
+        """
+        Pick the source for the next attempt and probe it
+
+        Returns:
+            (url, probe) from a race when host history can't decide, otherwise
+            the best ranked source and its HEAD probe
+        """
+        if source_selector.needs_race(urls):
+            winner = await self._race_sources(urls)
+            if winner:
+                return winner
+        url = source_selector.rank(urls)[0]
+        return url, await self._probe(url)
+
+    async def _race_sources(self, urls: List[str]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Race sources over their first SOURCE_RACE_BYTES and pick the fastest
+
+        Each source gets a Range request for the start of the file. The first
+        to deliver SOURCE_RACE_BYTES (or its whole body) wins and the others
+        are cancelled. Every source's throughput so far goes into the host
+        history, and the winner's response headers stand in for a HEAD probe.
+        A ranged winner's bytes come back as probe["head"], so the download
+        continues after them instead of fetching them again.
+
+        Returns:
+            (url, probe) of the winner, or None if every source failed
+        """
+        started = time.monotonic()
+        received = {url: 0 for url in urls}
+        headers = {"Range": f"bytes=0-{config.SOURCE_RACE_BYTES - 1}"}
+        timeout = aiohttp.ClientTimeout(total=config.API_TIMEOUT)
+
+        async def run(url: str) -> Dict[str, Any]:
+            chunks = []
+            async with self.session.get(url, headers=headers, allow_redirects=True, timeout=timeout) as response:
+                if response.status in LINK_EXPIRED_STATUSES:
+                    raise LinkExpiredError(url, response.status)
+                if response.status not in (200, 206):
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status
+                    )
+                while received[url] < config.SOURCE_RACE_BYTES:
+                    chunk = await response.content.readany()
+                    if not chunk:
+                        break
+                    received[url] += len(chunk)
+                    chunks.append(chunk)
+                probe = self._race_probe(response)
+                content_range = self._content_range(response) if response.status == 206 else None
+                if content_range and content_range[0] == 0:
+                    probe["head"] = b"".join(chunks)
+                # Leaving the block closes a 200 response rather than reading it all
+                return probe
+
+        tasks = {asyncio.ensure_future(run(url)): url for url in urls}
+        winner = None
+        failed = set()
+        try:
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    url = tasks[task]
+                    if task.exception():
+                        logger.debug(f"Source {source_host(url)} failed in race: {task.exception()!r}")
+                        if not isinstance(task.exception(), LinkExpiredError):
+                            source_selector.record_failure(url)
+                        failed.add(url)
+                    elif winner is None:
+                        winner = (url, task.result())
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        elapsed = time.monotonic() - started
+        for url in urls:
+            if url not in failed:
+                source_selector.record(url, received[url], elapsed)
+        if winner:
+            logger.info(
+                f"Source race won by {source_host(winner[0])}: "
+                + ", ".join(f"{source_host(url)} {received[url]} bytes" for url in urls)
+                + f" in {elapsed:.2f}s"
+            )
+        return winner
+
+    @staticmethod
+    def _content_range(response: aiohttp.ClientResponse) -> Optional[Tuple[int, int]]:
+        """
+        Parse "Content-Range: bytes start-end/total" of a 206 response
+
+        Returns:
+            (start, total), total 0 when the server gives "*", or None if
+            the header is missing or malformed
+        """
+        match = CONTENT_RANGE_PATTERN.match(response.headers.get("Content-Range", "").strip())
+        if not match:
             return None
+        total = match.group(3)
+        return int(match.group(1)), int(total) if total.isdigit() else 0
+
+    def _race_probe(self, response: aiohttp.ClientResponse) -> Dict[str, Any]:
+        """Build probe information from a race response"""
+        size = None
+        if response.status == 206:
+            content_range = self._content_range(response)
+            size = content_range[1] if content_range else 0
+        probe = self._response_probe(response, size)
+        probe["supports_ranges"] = response.status == 206
+        return probe
+
+    async def _reserve_space(self, part_path: Path, size: int) -> bool:
+        """
+        Reserve disk space for a download once, waiting while the budget is full
+
+        Returns:
+            False if the space could not be reserved
+        """
+        if part_path in self._reservations:
+            return True
+        reservation = await disk_quota.reserve(size, part_path.name)
+        if reservation is None:
+            return False
+        self._reservations[part_path] = reservation
+        return True
+
+    async def _download_part(
+        self,
+        url: str,
+        probe: Dict[str, Any],
+        part_path: Path,
+        flow: Flow,
+        algorithms: List[str],
+        progress_callback: Optional[Callable] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Bring a .part file up to date with the remote file
+
+        Args:
+            url: Source to download from
+            probe: The source's probe (_probe() or a race)
+
+        Returns:
+            Dictionary with size and hashes of the completed .part file, or
+            None on a non-retryable failure
+        """
+        if probe["size"] > config.SIZE_LIMIT_CHANNEL_MB * 1024 * 1024:
+            logger.error(f"File too large ({probe['size']} bytes): {part_path.name}")
+            return None
+        # An unknown size may be anything up to the largest file we download
+        if not await self._reserve_space(part_path, probe["size"] or config.SIZE_LIMIT_CHANNEL_MB * 1024 * 1024):
+            return None
+
+        state = self._load_state(part_path)
+        if state and not self._validators_match(state["validators"], probe):
+            logger.info(f"Remote file changed, restarting download: {part_path.name}")
+            state = None
+            watcher = self._watchers.get(part_path)
+            if watcher:
+                watcher.reset()
+        elif state and state["validators"].get("host") != self._validators(probe)["host"]:
+            # Same file from another source: keep the received ranges, but
+            # If-Range must carry this host's validators. Checksums catch a
+            # source that serves different bytes of the same size.
+            state["validators"] = self._validators(probe)
+        if state is None or not part_path.exists():
+            state = {"validators": self._validators(probe), "ranges": []}
+        head = probe.get("head")
+        if head and not state["ranges"] and len(head) < probe["size"]:
+            # Keep what the source sent while winning the race
+            writer = await FileWriter.open(part_path, truncate=True, size=probe["size"])
+            try:
+                await writer.write(head, 0)
+            finally:
+                await writer.close()
+            state["ranges"] = [[0, len(head)]]
+            self._save_state(part_path, state)
+            flow.resumed = len(head)
+        elif state["ranges"]:
+            received = sum(end - start for start, end in state["ranges"])
+            flow.resumed = received
+            logger.info(f"Resuming {part_path.name} with {received} bytes already received")
+
+        total_size = probe["size"]
+        if total_size:
+            flow.total = total_size
+        if (
+            config.SEGMENTED_DOWNLOADS
+            and config.DOWNLOAD_CONNECTIONS > 1
+            and probe["supports_ranges"]
+            and total_size >= 2 * config.SEGMENT_MIN_SIZE
+        ):
+            try:
+                return await self._download_segmented(
+                    probe["url"], part_path, total_size, state, flow, algorithms, progress_callback
+                )
+            except RangeNotSupportedError:
+                logger.warning(f"Server ignored Range requests, falling back to single stream: {part_path.name}")
 
-        except aiohttp.ClientError as e:
-            logger.error(f"Download client error: {e}")
-            self._cleanup_file(file_path)
+        return await self._download_stream(
+            url, part_path, state, probe["supports_ranges"], flow, algorithms, progress_callback
+        )
+
+    async def _download_stream(
+        self,
+        url: str,
+        part_path: Path,
+        state: Dict[str, Any],
+        supports_ranges: bool,
+        flow: Flow,
+        algorithms: List[str],
+        progress_callback: Optional[Callable] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Download over a single connection, continuing after the received prefix"""
+        offset = self._prefix_length(state) if supports_ranges and part_path.exists() else 0
+        headers = self._range_headers(offset, None, state["validators"]) if offset else {}
+
+        async with self.session.get(url, headers=headers, allow_redirects=True) as response:
+            if response.status in LINK_EXPIRED_STATUSES:
+                raise LinkExpiredError(url, response.status)
+            if response.status == 200:
+                offset = 0
+            elif response.status != 206 or not offset:
+                logger.error(f"Download failed with status {response.status}: {url}")
+                return None
+
+            length = response.headers.get("content-length", "")
+            total_size = offset + int(length) if length.isdigit() else 0
+            if response.status == 206:
+                content_range = self._content_range(response)
+                if content_range is None or content_range[0] != offset:
+                    # Appending it would misplace the data; the next attempt starts over
+                    state["ranges"] = []
+                    self._save_state(part_path, state)
+                    raise aiohttp.ClientPayloadError(
+                        f"Resume from {offset} answered with Content-Range "
+                        f"{response.headers.get('Content-Range')!r}: {part_path.name}"
+                    )
+                # Without a total or length, the size recorded when the .part was started
+                total_size = content_range[1] or total_size or state["validators"].get("size", 0)
+
+            # Check file size limits
+            if total_size > config.SIZE_LIMIT_CHANNEL_MB * 1024 * 1024:
+                logger.error(f"File too large ({total_size} bytes): {part_path.name}")
+                return None
+
+            if offset == 0:
+                state["validators"] = self._validators(self._response_probe(response, total_size))
+            state["ranges"] = [[0, offset]] if offset else []
+
+            downloaded_size = offset
+            unsaved = 0
+
+            writer = await FileWriter.open(
+                part_path, truncate=not offset, size=None if offset or not total_size else total_size
+            )
+            reader = BodyReader(response.content)
+            progress = ProgressThrottle(progress_callback, total_size)
+            hasher = StreamHasher(algorithms)
+            # A resumed prefix is already on disk; hash it while the rest streams in
+            hasher.catch_up(part_path, offset)
+            try:
+                while True:
+                    buffer = await writer.buffer()
+                    length = await reader.readinto(buffer)
+                    if not length:
+                        writer.recycle(buffer)
+                        break
+                    hashed = hasher.feed(downloaded_size, memoryview(buffer)[:length])
+                    await writer.write_buffer(buffer, length, downloaded_size, hashed)
+                    downloaded_size += length
+                    await bandwidth.consume(flow, length)
+
+                    unsaved += length
+                    if unsaved >= config.RESUME_STATE_INTERVAL:
+                        # Only record ranges once their writes have reached the OS
+                        await writer.drain()
+                        state["ranges"] = [[0, downloaded_size]]
+                        self._save_state(part_path, state)
+                        unsaved = 0
+
+                    await progress.update(downloaded_size)
+            finally:
+                try:
+                    await writer.close()
+                    state["ranges"] = [[0, downloaded_size]] if downloaded_size else []
+                finally:
+                    self._save_state(part_path, state)
+
+            # A connection closed early ends the body without an error
+            if total_size and downloaded_size != total_size:
+                raise aiohttp.ClientPayloadError(
+                    f"Body ended at {downloaded_size} of {total_size} bytes: {part_path.name}"
+                )
+
+            return {"size": downloaded_size, "hashes": await hasher.hexdigests()}
+
+    async def _probe(self, url: str) -> Dict[str, Any]:
+        """
+        Probe the remote file with a HEAD request
+
+        Returns:
+            Dictionary with supports_ranges, size, url (after redirects),
+            etag and last_modified
+
+        Raises:
+            LinkExpiredError: If the URL has expired
+        """
+        try:
+            timeout = aiohttp.ClientTimeout(total=config.API_TIMEOUT)
+            async with self.session.head(url, allow_redirects=True, timeout=timeout) as response:
+                if response.status in LINK_EXPIRED_STATUSES:
+                    raise LinkExpiredError(url, response.status)
+                if response.status == 200:
+                    return self._response_probe(response)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.debug(f"Probe failed for {url}: {e}")
+        return {"supports_ranges": False, "size": 0, "url": url, "etag": "", "last_modified": ""}
+
+    @staticmethod
+    def _response_probe(response: aiohttp.ClientResponse, size: Optional[int] = None) -> Dict[str, Any]:
+        """Build probe information from response headers"""
+        return {
+            "supports_ranges": response.headers.get("Accept-Ranges", "").lower() == "bytes",
+            "size": size if size is not None else int(response.headers.get("content-length", 0)),
+            "url": str(response.url),
+            "etag": response.headers.get("ETag", ""),
+            "last_modified": response.headers.get("Last-Modified", ""),
+        }
+
+    async def _download_segmented(
+        self,
+        url: str,
+        part_path: Path,
+        total_size: int,
+        state: Dict[str, Any],
+        flow: Flow,
+        algorithms: List[str],
+        progress_callback: Optional[Callable] = None,
+    ) -> Dict[str, Any]:
+        """
+        Download a file over several connections into a preallocated file
+
+        The missing ranges are split over DOWNLOAD_CONNECTIONS connections. A
+        connection that finishes early takes over the second half of whichever
+        segment has the most bytes left, so one throttled connection can't hold
+        up the file. The file is hashed in order as the contiguous prefix
+        grows, reading back ranges that arrived ahead of it.
+
+        Returns:
+            Dictionary with size and hashes
+        """
+        received = [tuple(r) for r in state["ranges"]] if part_path.exists() else []
+        segments: List[Segment] = [
+            Segment(start, end) for start, end in self._missing_ranges(received, total_size)
+        ]
+        pending: Deque[Segment] = deque(segments)
+        active: List[Segment] = []
+
+        # Split the missing ranges until every connection has work
+        while len(pending) < config.DOWNLOAD_CONNECTIONS:
+            extra = self._next_segment(deque(), list(pending))
+            if extra is None:
+                break
+            pending.append(extra)
+            segments.append(extra)
+
+        connections = min(config.DOWNLOAD_CONNECTIONS, len(pending))
+        progress = {
+            "downloaded": sum(end - start for start, end in received),
+            "unsaved": 0,
+        }
+        reporter = ProgressThrottle(progress_callback, total_size)
+        hasher = StreamHasher(algorithms)
+        hasher.catch_up(part_path, self._prefix_length({"ranges": received}))
+
+        writer = await FileWriter.open(
+            part_path, size=None if part_path.exists() else total_size
+        )
+
+        def snapshot_ranges() -> List[List[int]]:
+            done = received + [(s.start, s.pos) for s in segments if s.pos > s.start]
+            return self._merge_ranges(done)
+
+        async def persist_state():
+            # Snapshot before draining so only writes that reached the OS are recorded
+            ranges = snapshot_ranges()
+            await writer.drain()
+            state["ranges"] = ranges
+            self._save_state(part_path, state)
+            hasher.catch_up(part_path, self._prefix_length(state))
+
+        async def on_chunk(size: int):
+            await bandwidth.consume(flow, size)
+            progress["downloaded"] += size
+            progress["unsaved"] += size
+            if progress["unsaved"] >= config.RESUME_STATE_INTERVAL:
+                progress["unsaved"] = 0
+                await persist_state()
+            await reporter.update(progress["downloaded"])
+
+        async def worker():
+            while True:
+                segment = self._next_segment(pending, active)
+                if segment is None:
+                    return
+                if segment not in segments:
+                    segments.append(segment)
+                active.append(segment)
+                try:
+                    await self._fetch_segment(url, segment, writer, hasher, on_chunk, state["validators"])
+                finally:
+                    active.remove(segment)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(connections)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            ranges = snapshot_ranges()
+            try:
+                await writer.close()
+                state["ranges"] = ranges
+            finally:
+                self._save_state(part_path, state)
+
+        if self._missing_ranges(state["ranges"], total_size):
+            raise aiohttp.ClientPayloadError(
+                f"Segmented download incomplete: {progress['downloaded']}/{total_size} bytes"
+            )
+        hasher.catch_up(part_path, total_size)
+        return {"size": total_size, "hashes": await hasher.hexdigests()}
+
+    @staticmethod
+    def _next_segment(pending: Deque[Segment], active: List[Segment]) -> Optional[Segment]:
+        """Take the next pending segment, or split the largest active one"""
+        if pending:
+            return pending.popleft()
+
+        if not active:
+            return None
+        largest = max(active, key=lambda segment: segment.remaining)
+        if largest.remaining < 2 * config.SEGMENT_MIN_SIZE:
             return None
 
-        except Exception as e:
-            logger.error(f"Download error: {e}", exc_info=True)
-            self._cleanup_file(file_path)
+        middle = largest.pos + largest.remaining // 2
+        stolen = Segment(middle, largest.end)
+        largest.end = middle
+        return stolen
+
+    async def _fetch_segment(
+        self,
+        url: str,
+        segment: Segment,
+        writer: FileWriter,
+        hasher: StreamHasher,
+        on_chunk: Callable,
+        validators: Dict[str, Any],
+    ):
+        """Fetch one segment, resuming from its current position on errors"""
+        for attempt in range(config.MAX_RETRIES):
+            try:
+                headers = self._range_headers(segment.pos, segment.end, validators)
+                async with self.session.get(url, headers=headers, allow_redirects=True) as response:
+                    if response.status in LINK_EXPIRED_STATUSES:
+                        raise LinkExpiredError(url, response.status)
+                    if response.status == 200:
+                        raise RangeNotSupportedError(url)
+                    if response.status != 206:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status
+                        )
+
+                    reader = BodyReader(response.content)
+                    while segment.remaining > 0:
+                        buffer = await writer.buffer()
+                        length = await reader.readinto(buffer)
+                        # The segment may have been shortened by another connection
+                        length = min(length, segment.remaining)
+                        if not length:
+                            writer.recycle(buffer)
+                            break
+                        hashed = hasher.feed(segment.pos, memoryview(buffer)[:length])
+                        await writer.write_buffer(buffer, length, segment.pos, hashed)
+                        segment.pos += length
+                        await on_chunk(length)
+
+                if segment.remaining == 0:
+                    return
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(
+                    f"Segment {segment.pos}-{segment.end} failed "
+                    f"(attempt {attempt + 1}/{config.MAX_RETRIES}): {e}"
+                )
+
+            if attempt < config.MAX_RETRIES - 1:
+                await asyncio.sleep(2 ** attempt)
+
+        raise aiohttp.ClientPayloadError(f"Segment {segment.start}-{segment.end} failed")
+
+    @staticmethod
+    def _range_headers(start: int, end: Optional[int], validators: Dict[str, Any]) -> Dict[str, str]:
+        """Range request headers; If-Range makes a changed file come back as a full 200"""
+        headers = {"Range": f"bytes={start}-{end - 1 if end else ''}"}
+        etag = validators.get("etag", "")
+        if etag and not etag.startswith("W/"):
+            headers["If-Range"] = etag
+        elif validators.get("last_modified"):
+            headers["If-Range"] = validators["last_modified"]
+        return headers
+
+    @staticmethod
+    def _validators(probe: Dict[str, Any]) -> Dict[str, Any]:
+        """Extract the fields that identify a remote file version"""
+        return {
+            "size": probe.get("size", 0),
+            "etag": probe.get("etag", ""),
+            "last_modified": probe.get("last_modified", ""),
+            "host": source_host(probe.get("url", "")),
+        }
+
+    @staticmethod
+    def _validators_match(saved: Dict[str, Any], probe: Dict[str, Any]) -> bool:
+        """
+        Check that saved validators still describe the remote file
+
+        ETags and Last-Modified differ between hosts, so another source is
+        only held to the size.
+        """
+        same_host = saved.get("host", source_host(probe.get("url", ""))) == source_host(probe.get("url", ""))
+        for key in ("size", "etag", "last_modified") if same_host else ("size",):
+            if saved.get(key) and probe.get(key) and saved[key] != probe[key]:
+                return False
+        return True
+
+    @staticmethod
+    def _merge_ranges(ranges: List) -> List[List[int]]:
+        """Merge overlapping or adjacent [start, end) ranges"""
+        merged: List[List[int]] = []
+        for start, end in sorted(ranges):
+            if end <= start:
+                continue
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    def _missing_ranges(self, received: List, total_size: int) -> List[List[int]]:
+        """Gaps in [0, total_size) not covered by received ranges"""
+        missing = []
+        position = 0
+        for start, end in self._merge_ranges(received):
+            if start > position:
+                missing.append([position, min(start, total_size)])
+            position = max(position, end)
+        if position < total_size:
+            missing.append([position, total_size])
+        return missing
+
+    def _prefix_length(self, state: Dict[str, Any]) -> int:
+        """Bytes received contiguously from the start of the file"""
+        ranges = self._merge_ranges(state.get("ranges", []))
+        if ranges and ranges[0][0] == 0:
+            return ranges[0][1]
+        return 0
+
+    @staticmethod
+    def _part_path(file_path: Path) -> Path:
+        """Path of the in-progress download for a file"""
+        return file_path.with_name(file_path.name + ".part")
+
+    @staticmethod
+    def _state_path(part_path: Path) -> Path:
+        """Path of the resume sidecar for a .part file"""
+        return part_path.with_name(part_path.name + ".json")
+
+    def _load_state(self, part_path: Path) -> Optional[Dict[str, Any]]:
+        """Load resume state for a .part file"""
+        state_path = self._state_path(part_path)
+        try:
+            with open(state_path, "r") as f:
+                state = json.load(f)
+            if isinstance(state.get("validators"), dict) and isinstance(state.get("ranges"), list):
+                return state
+        except FileNotFoundError:
             return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable resume state {state_path}: {e}")
+        return None
+
+    def _save_state(self, part_path: Path, state: Dict[str, Any]):
+        """Atomically write resume state for a .part file"""
+        state_path = self._state_path(part_path)
+        tmp_path = state_path.with_name(state_path.name + ".tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, state_path)
+        except OSError as e:
+            logger.warning(f"Failed to save resume state {state_path}: {e}")
+
+        watcher = self._watchers.get(part_path)
+        if watcher:
+            watcher.update(part_path, state["ranges"], state["validators"].get("size", 0))
+
+    def _discard_partial(self, part_path: Path):
+        """
+        Remove a .part file and its resume state
+
+        Unlike _cleanup_file() this ignores CLEANUP_DOWNLOADS: a kept .part
+        would be resumed by the next attempt, ranges and corrupt data included.
+        """
+        watcher = self._watchers.get(part_path)
+        if watcher:
+            watcher.reset()
+        for path in (part_path, self._state_path(part_path)):
+            try:
+                path.unlink(missing_ok=True)
+            except OSError as e:
+                logger.error(f"Failed to discard {path}: {e}")
 
     def _cleanup_file(self, file_path: Path):
         """Remove downloaded file if cleanup is enabled"""
@@ -117,17 +1585,11 @@ class FileDownloader:
                 logger.error(f"Failed to cleanup {file_path}: {e}")
 
     async def cleanup_all(self):
-        """Clean up all downloaded files"""
+        """Clean up all downloaded and partial files not in use by a job"""
         if not config.CLEANUP_DOWNLOADS:
             return
 
-        try:
-            for file in self.downloads_dir.iterdir():
-                if file.is_file():
-                    file.unlink()
-                    logger.debug(f"Cleaned up: {file}")
-        except Exception as e:
-            logger.error(f"Error during cleanup: {e}")
+        disk_janitor.sweep(max_age=0)
 
     def get_file_size_mb(self, file_path: Path) -> float:
         """Get file size in MB"""
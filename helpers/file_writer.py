@@ -0,0 +1,195 @@
+"""
+File writer module for TeraBox Downloader Bot
+Performs download disk writes on background threads with backpressure
+"""
+
+import asyncio
+import errno
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Dict, List, Set
+
+import config
+from helpers.logger import get_logger
+
+logger = get_logger("terabox_bot")
+
+# Dedicated pool so slow disks never tie up the default executor
+_disk_executor = ThreadPoolExecutor(
+    max_workers=config.DISK_WRITER_THREADS,
+    thread_name_prefix="disk-writer",
+)
+
+
+def _preallocate(fd: int, size: int):
+    """Allocate size bytes for a file, falling back to a sparse extend"""
+    if size and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+                raise
+    os.ftruncate(fd, size)
+
+
+class FileWriter:
+    """
+    Write-behind file writer
+
+    Chunks are written with pwrite on the disk thread pool while the caller
+    keeps reading from the network. At most WRITE_QUEUE_CHUNKS writes are
+    queued per file; beyond that write() waits, which slows the network
+    reader down to disk speed instead of buffering without bound.
+
+    Readers can fill CHUNK_SIZE buffers from buffer() and queue them with
+    write_buffer(). Each buffer goes back to the writer's free list once its
+    write (and hashing, if any) finishes, so a download keeps reusing the
+    same few buffers.
+    """
+
+    def __init__(self, fd: int, path: Path, max_pending: int = config.WRITE_QUEUE_CHUNKS):
+        self.fd = fd
+        self.path = path
+        self.error: Optional[BaseException] = None
+        self._slots = asyncio.Semaphore(max(1, max_pending))
+        self._pending: Set[asyncio.Future] = set()
+        self._buffers: List[bytearray] = []
+        self._buffer_slots = asyncio.Semaphore(2 * max(1, max_pending))
+        self._hashing: Dict[int, asyncio.Future] = {}
+        self._closed = False
+
+    @classmethod
+    async def open(cls, path: Path, truncate: bool = False, size: Optional[int] = None) -> "FileWriter":
+        """
+        Open a file for positional writes
+
+        Args:
+            path: File to open (created if missing)
+            truncate: Discard existing content
+            size: Preallocate the file to this many bytes (reserves the
+                blocks up front where the filesystem supports it, so a full
+                disk fails the download at the start instead of mid-transfer)
+
+        Returns:
+            FileWriter for the file
+        """
+        def _open() -> int:
+            flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if truncate else 0)
+            fd = os.open(path, flags, 0o644)
+            if size is not None:
+                try:
+                    _preallocate(fd, size)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            return fd
+
+        loop = asyncio.get_running_loop()
+        fd = await loop.run_in_executor(_disk_executor, _open)
+        return cls(fd, path)
+
+    async def write(self, data: bytes, offset: int):
+        """
+        Queue a chunk to be written at offset
+
+        Raises:
+            OSError: If an earlier queued write failed
+        """
+        await self._queue(data, offset, None)
+
+    async def buffer(self) -> bytearray:
+        """
+        Take a CHUNK_SIZE buffer from the free list (allocated on first use)
+
+        Waits while 2 x WRITE_QUEUE_CHUNKS buffers are still being written or
+        hashed, so slow disks or hashing slow the reader down.
+        """
+        await self._buffer_slots.acquire()
+        return self._buffers.pop() if self._buffers else bytearray(config.CHUNK_SIZE)
+
+    def recycle(self, buffer: bytearray):
+        """Return a buffer() buffer to the free list"""
+        self._buffers.append(buffer)
+        self._buffer_slots.release()
+
+    async def write_buffer(
+        self,
+        buffer: bytearray,
+        length: int,
+        offset: int,
+        hashed: Optional[asyncio.Future] = None,
+    ):
+        """
+        Queue the first length bytes of a buffer() buffer to be written at offset
+
+        The caller must not touch the buffer afterwards; it returns to the
+        free list when the write finishes (and hashed, if given, is done).
+
+        Raises:
+            OSError: If an earlier queued write failed
+        """
+        if hashed is not None and not hashed.done():
+            self._hashing[id(buffer)] = hashed
+        await self._queue(memoryview(buffer)[:length], offset, buffer)
+
+    async def _queue(self, data, offset: int, buffer: Optional[bytearray]):
+        """Wait for a queue slot and submit a pwrite"""
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            if buffer is not None:
+                self.recycle(buffer)
+            raise
+        if self.error:
+            self._slots.release()
+            if buffer is not None:
+                self.recycle(buffer)
+            raise self.error
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_disk_executor, self._pwrite, data, offset)
+        self._pending.add(future)
+        future.add_done_callback(functools.partial(self._on_written, buffer))
+
+    async def drain(self):
+        """Wait until every queued write has reached the OS"""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+        if self.error:
+            raise self.error
+
+    async def close(self):
+        """Drain queued writes and close the file"""
+        if self._closed:
+            return
+        try:
+            await self.drain()
+        finally:
+            self._closed = True
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(_disk_executor, os.close, self.fd)
+
+    def _pwrite(self, data: bytes, offset: int):
+        """Write all of data at offset (runs on a disk thread)"""
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    def _on_written(self, buffer: Optional[bytearray], future: asyncio.Future):
+        """Release the queue slot and buffer, and remember the first write error"""
+        self._pending.discard(future)
+        self._slots.release()
+        if buffer is not None:
+            hashed = self._hashing.pop(id(buffer), None)
+            if hashed is not None and not hashed.done():
+                hashed.add_done_callback(lambda _: self.recycle(buffer))
+            else:
+                self.recycle(buffer)
+        if not future.cancelled() and future.exception() and not self.error:
+            self.error = future.exception()
+            logger.error(f"Disk write failed for {self.path}: {self.error}")
@@ -0,0 +1,83 @@
+"""
+Link canonicalization module for TeraBox Downloader Bot
+Maps every TeraBox mirror link form to one canonical share id
+"""
+
+import re
+from typing import Optional, Dict
+
+import config
+
+_MIRRORS = "|".join(re.escape(domain) for domain in config.TERABOX_MIRRORS)
+
+# Short links: https://www.1024terabox.com/s/1AbCdEf (the path id is the share id)
+SHARE_PATH_PATTERN = re.compile(
+    rf"https?://(?:www\.)?(?:{_MIRRORS})/s/([\w-]+)",
+    re.IGNORECASE,
+)
+
+# Query links: https://teraboxapp.com/sharing/link?surl=AbCdEf (also wap/share/filelist etc.),
+# the same share as /s/1AbCdEf
+SHARE_QUERY_PATTERN = re.compile(
+    rf"https?://(?:www\.)?(?:{_MIRRORS})/[\w/.-]*\?(?:[^\s#]*&)?surl=([\w-]+)",
+    re.IGNORECASE,
+)
+
+
+def _share_id_from_match(match: re.Match) -> str:
+    """Get the share id from a pattern match, in its /s/ path form"""
+    share_id = match.group(1)
+    # surl drops the "1" that /s/ ids carry; /s/ ids without one are kept as they are
+    if match.re is SHARE_QUERY_PATTERN:
+        share_id = f"1{share_id}"
+    return share_id
+
+
+def canonical_share_id(link: str) -> Optional[str]:
+    """
+    Get the canonical share id of a TeraBox link
+
+    Args:
+        link: TeraBox link on any mirror domain, with or without www/https/query params
+
+    Returns:
+        Share id (case-sensitive) or None if the link is not a TeraBox share link
+    """
+    if not link:
+        return None
+
+    link = link.strip()
+    for pattern in (SHARE_QUERY_PATTERN, SHARE_PATH_PATTERN):
+        match = pattern.match(link)
+        if match:
+            return _share_id_from_match(match)
+    return None
+
+
+def canonical_link(share_id: str) -> str:
+    """Build the canonical TeraBox link for a share id"""
+    return config.TERABOX_CANONICAL_URL.format(share_id=share_id)
+
+
+def extract_share_ids(text: str) -> Dict[str, str]:
+    """
+    Extract TeraBox share ids from text
+
+    Args:
+        text: Text to extract links from
+
+    Returns:
+        Mapping of share id to canonical link, in order of first appearance
+    """
+    if not text:
+        return {}
+
+    found = []
+    for pattern in (SHARE_QUERY_PATTERN, SHARE_PATH_PATTERN):
+        for match in pattern.finditer(text):
+            found.append((match.start(), _share_id_from_match(match)))
+
+    shares: Dict[str, str] = {}
+    for _, share_id in sorted(found):
+        shares.setdefault(share_id, canonical_link(share_id))
+    return shares
@@ -0,0 +1,181 @@
+"""
+Media pool module for TeraBox Downloader Bot
+Bounded, prioritized slots for ffmpeg and other CPU-heavy media jobs
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import List, Tuple
+
+import config
+from helpers.logger import get_logger
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = get_logger("terabox_bot")
+
+# Niceness added to media processes so webhook handling keeps the CPU
+MEDIA_NICENESS = 10
+
+
+class MediaPoolFullError(Exception):
+    """Raised when the media job queue is full"""
+
+
+def available_cpus() -> int:
+    """CPU cores this process may run on (respects container CPU affinity)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def limit_process(pid: int, cpu_seconds: int = config.MEDIA_CPU_LIMIT):
+    """
+    Lower a child process's priority and cap its CPU time
+
+    Applied from the parent right after the process starts rather than in a
+    preexec_fn, which can deadlock the forked child before exec while the
+    disk writer, hasher and thumbnail threads are running. The kernel sends
+    SIGXCPU (which terminates ffmpeg) once the process has used cpu_seconds
+    of CPU, however long it has been running. Limits that can't be applied
+    on this platform are skipped.
+
+    Args:
+        pid: Child process id
+        cpu_seconds: CPU seconds the process may use (0 for no limit)
+    """
+    try:
+        niceness = min(19, os.getpriority(os.PRIO_PROCESS, 0) + MEDIA_NICENESS)
+        os.setpriority(os.PRIO_PROCESS, pid, niceness)
+    except (AttributeError, OSError) as e:
+        logger.debug(f"Could not lower priority of process {pid}: {e}")
+
+    if cpu_seconds > 0 and hasattr(resource, "prlimit"):
+        try:
+            resource.prlimit(pid, resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+        except OSError as e:
+            # The process may already have exited
+            logger.debug(f"Could not limit CPU time of process {pid}: {e}")
+
+
+class MediaPool:
+    """
+    Limits how many media jobs run at once
+
+    Jobs take one of a fixed number of slots (one per CPU core by default)
+    and wait in priority order when all are busy; callers use file size as
+    the priority, so thumbnails for small files are made first. Once
+    MEDIA_QUEUE_LIMIT jobs are waiting, new jobs are refused with
+    MediaPoolFullError so the pipeline sends without media extras instead of
+    stacking up ffmpeg work. The bot serves webhooks from short-lived event
+    loop runs, so there are no long-lived worker tasks; each caller runs its
+    own job once it holds a slot.
+    """
+
+    def __init__(self, workers: int = config.MEDIA_WORKERS, max_queue: int = config.MEDIA_QUEUE_LIMIT):
+        self.workers = workers if workers > 0 else available_cpus()
+        self.max_queue = max_queue
+        self.running = 0
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.peak_queue = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+
+    @asynccontextmanager
+    async def slot(self, priority: float, name: str):
+        """
+        Hold a worker slot for the duration of a media job
+
+        Args:
+            priority: Lower runs first (file size in bytes)
+            name: File name (for logging)
+
+        Raises:
+            MediaPoolFullError: If MEDIA_QUEUE_LIMIT jobs are already waiting
+        """
+        queued_at = time.monotonic()
+        await self._acquire(priority, name)
+        started = time.monotonic()
+        self.wait_time += started - queued_at
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            elapsed = time.monotonic() - started
+            self.run_time += elapsed
+            logger.debug(
+                f"Media job {name}: waited {started - queued_at:.2f}s, "
+                f"ran {elapsed:.2f}s ({len(self._waiters)} queued)"
+            )
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+            self._release()
+
+    def stats(self) -> dict:
+        """Get queue depth and processing times for logging and diagnostics"""
+        finished = self.completed + self.failed
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": len(self._waiters),
+            "peak_queued": self.peak_queue,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait": round(self.wait_time / finished, 3) if finished else 0.0,
+            "avg_run": round(self.run_time / finished, 3) if finished else 0.0,
+        }
+
+    async def _acquire(self, priority: float, name: str):
+        """Take a slot, waiting in priority order when all are busy"""
+        if not self._waiters and self.running < self.workers:
+            self.running += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise MediaPoolFullError(f"Media queue full ({len(self._waiters)} waiting), skipping {name}")
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), waiter))
+        self.peak_queue = max(self.peak_queue, len(self._waiters))
+        logger.debug(f"Media pool busy, queueing {name} ({len(self._waiters)} waiting)")
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed over just as we were cancelled
+                self._release()
+            else:
+                self._waiters = [w for w in self._waiters if w[2] is not waiter]
+                heapq.heapify(self._waiters)
+            raise
+
+    def _release(self):
+        """Hand the slot to the highest-priority waiter, or free it"""
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running = max(0, self.running - 1)
+
+
+# Global media pool instance
+media_pool = MediaPool()
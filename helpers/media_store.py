@@ -0,0 +1,123 @@
+"""
+Media store module for TeraBox Downloader Bot
+Video metadata recorded by share id and content hash, so files aren't probed twice
+"""
+
+from collections import OrderedDict
+from typing import Optional, Dict, List, Any
+
+import config
+from helpers.db import db
+from helpers.logger import get_logger
+
+logger = get_logger("terabox_bot")
+
+# Probe result fields sendVideo needs; the thumbnail is cached by the thumbnail service
+MEDIA_FIELDS = ("duration", "width", "height", "codec")
+
+
+class MediaStore:
+    """
+    Metadata of probed videos
+
+    A record is found by the canonical share id or by any content digest
+    (the downloader's hashes, or the resolver's md5 before downloading), so
+    the same file under another share link reuses it too. Records are kept
+    in MongoDB; the most recently used MEDIA_STORE_ENTRIES stay in memory in
+    front of it, under each of their keys.
+    """
+
+    def __init__(self, max_entries: int = config.MEDIA_STORE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def keys(share_id: Optional[str] = None, hashes: Optional[Dict[str, str]] = None) -> List[str]:
+        """Lookup keys for a share id and content digests ({algorithm: hex})"""
+        keys = [f"share:{share_id}"] if share_id else []
+        keys += [f"{algorithm}:{digest.lower()}" for algorithm, digest in (hashes or {}).items() if digest]
+        return keys
+
+    async def get(
+        self,
+        share_id: Optional[str] = None,
+        hashes: Optional[Dict[str, str]] = None,
+        verified: bool = False,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Look up a video's metadata
+
+        Args:
+            share_id: Canonical share id
+            hashes: Content digests by algorithm
+            verified: The digests were computed from the file, not taken from
+                the resolver; only then is the record also stored under them
+
+        Returns:
+            Dictionary with duration, width, height, codec and thumbnail
+            (always None), like MetadataExtractor.probe(), or None if the
+            file hasn't been probed before
+        """
+        keys = self.keys(share_id, hashes)
+        if not keys:
+            return None
+
+        for key in keys:
+            record = self.entries.get(key)
+            if record is not None:
+                self.hits += 1
+                break
+        else:
+            stored = await db.get_media(keys)
+            if not stored or not stored.get("duration"):
+                self.misses += 1
+                return None
+            self.db_hits += 1
+            record = {field: stored.get(field) for field in MEDIA_FIELDS}
+            self._remember(stored.get("keys", []), record)
+
+        # Found by content under a new share id (or the reverse): record the new keys too
+        await self.put(share_id, hashes if verified else None, record)
+        return {**record, "thumbnail": None}
+
+    async def put(
+        self,
+        share_id: Optional[str],
+        hashes: Optional[Dict[str, str]],
+        media: Dict[str, Any],
+    ):
+        """Record a probe result under the share id and content digests"""
+        keys = self.keys(share_id, hashes)
+        if not keys or not media.get("duration"):
+            return
+        record = {field: media.get(field) for field in MEDIA_FIELDS}
+        known = [key for key in keys if self.entries.get(key) == record]
+        self._remember(keys, record)
+        if len(known) == len(keys):
+            return
+        await db.save_media(keys, record)
+        logger.debug(f"Stored media metadata under {keys}")
+
+    def stats(self) -> dict:
+        """Get cache usage for logging and diagnostics"""
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+        }
+
+    def _remember(self, keys: List[str], record: Dict[str, Any]):
+        """Cache a record under each key, evicting the least recently used"""
+        for key in keys:
+            self.entries[key] = record
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+# Global media store instance
+media_store = MediaStore()
@@ -0,0 +1,170 @@
+"""
+Memory pool module for TeraBox Downloader Bot
+Pooled in-memory buffers for small downloads under a global byte budget
+"""
+
+import io
+from typing import Optional, Dict, List
+
+import config
+from helpers.logger import get_logger
+
+logger = get_logger("terabox_bot")
+
+
+class MemoryReader(io.RawIOBase):
+    """Seekable raw reader over a memoryview (io.BytesIO would copy it)"""
+
+    def __init__(self, view: memoryview, name: str):
+        self._view = view
+        self._position = 0
+        self.name = name
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = max(0, min(len(buffer), len(self._view) - self._position))
+        buffer[:count] = self._view[self._position:self._position + count]
+        self._position += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+class MemoryFile:
+    """A downloaded file held in a pooled buffer instead of on disk"""
+
+    def __init__(self, pool: "BufferPool", buffer: bytearray, capacity: int, cost: int, name: str):
+        self.pool = pool
+        self.buffer = buffer
+        self.capacity = capacity
+        self.cost = cost
+        self.name = name
+        self.size = 0
+        self.refs = 1
+        self.hashes: Dict[str, str] = {}
+        self.released = False
+
+    @property
+    def view(self) -> memoryview:
+        """Received bytes without copying"""
+        return memoryview(self.buffer)[: self.size]
+
+    def write(self, chunk: bytes) -> bool:
+        """
+        Append a chunk to the buffer
+
+        Returns:
+            False if the chunk does not fit and the file must go to disk
+        """
+        end = self.size + len(chunk)
+        if end > self.capacity:
+            return False
+        self.buffer[self.size:end] = chunk
+        self.size = end
+        return True
+
+    def open(self) -> io.BufferedReader:
+        """Open the content as a named, read-only file object without copying the buffer"""
+        return io.BufferedReader(MemoryReader(self.view, self.name))
+
+    def retain(self) -> "MemoryFile":
+        """Take another reference for a job sharing this download"""
+        self.refs += 1
+        return self
+
+    def release(self):
+        """Drop a reference, returning the buffer to the pool after the last one"""
+        if self.released:
+            return
+        self.refs -= 1
+        if self.refs <= 0:
+            self.released = True
+            self.pool.release(self)
+
+
+class BufferPool:
+    """
+    Reusable download buffers under a global memory budget
+
+    Each file reserves its receive buffer; it is uploaded straight from that
+    buffer (uploader.MemoryPayload), so no other copy is made. Idle buffers
+    kept for reuse count against the budget too and are dropped first when
+    space is needed. A file that still doesn't fit gets no buffer and goes
+    to disk.
+    """
+
+    def __init__(self, budget: int = config.MEMORY_BUFFER_BUDGET):
+        self.budget = budget
+        self.reserved = 0
+        self._free: List[bytearray] = []
+
+    def try_acquire(self, size: int, name: str) -> Optional[MemoryFile]:
+        """
+        Reserve a buffer for a file of the given size
+
+        Returns:
+            MemoryFile, or None if the memory budget is exhausted
+        """
+        if size <= 0 or size > self.budget:
+            return None
+
+        buffer = self._take_buffer(size)
+        if buffer is None:
+            buffer = bytearray()
+        cost = max(len(buffer), size)
+
+        while self._free and self.reserved + cost + self._idle_bytes() > self.budget:
+            self._free.pop(0)
+
+        if self.reserved + cost + self._idle_bytes() > self.budget:
+            if buffer:
+                self._free.append(buffer)
+            return None
+
+        self.reserved += cost
+        return MemoryFile(self, buffer or bytearray(size), size, cost, name)
+
+    def release(self, memory_file: MemoryFile):
+        """Return a buffer and its reservation"""
+        self.reserved = max(0, self.reserved - memory_file.cost)
+
+        # Keep the buffer for reuse while it fits in the budget
+        if self.reserved + self._idle_bytes() + len(memory_file.buffer) <= self.budget:
+            self._free.append(memory_file.buffer)
+        memory_file.buffer = bytearray()
+
+    def stats(self) -> dict:
+        """Get pool usage for logging and diagnostics"""
+        return {
+            "budget": self.budget,
+            "reserved": self.reserved,
+            "idle_bytes": self._idle_bytes(),
+        }
+
+    def _idle_bytes(self) -> int:
+        """Memory held by idle buffers"""
+        return sum(len(buffer) for buffer in self._free)
+
+    def _take_buffer(self, size: int) -> Optional[bytearray]:
+        """Take the smallest idle buffer that fits"""
+        fitting = [buffer for buffer in self._free if len(buffer) >= size]
+        if not fitting:
+            return None
+        buffer = min(fitting, key=len)
+        self._free.remove(buffer)
+        return buffer
+
+
+# Global buffer pool instance
+memory_pool = BufferPool()
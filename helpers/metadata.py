@@ -4,25 +4,129 @@ Handles video metadata and thumbnail generation
 """
 
 import asyncio
+import re
 import subprocess
+import shutil
+import time
+import uuid
 from pathlib import Path
-from typing import Optional, Dict, Any
-import json
+from typing import Optional, Dict, Any, List, Tuple, Union
 from PIL import Image
 import io
 
 import config
+from helpers.cache import JOB_DIR_PREFIX
+from helpers.disk_quota import disk_quota, disk_janitor
 from helpers.logger import get_logger
+from helpers.media_pool import media_pool, limit_process, MediaPoolFullError
+from helpers.memory_pool import MemoryFile
 
 logger = get_logger("terabox_bot")
 
+# Seconds into the video the thumbnail frame is taken from
+THUMBNAIL_OFFSET = 1.0
+
+_DURATION_RE = re.compile(r"Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+_VIDEO_STREAM_RE = re.compile(r"Stream #\d+:\d+.*?: Video: (\w+)(.*)")
+_DIMENSIONS_RE = re.compile(r"[ ,](\d{2,5})x(\d{2,5})\b")
+_ROTATION_RE = re.compile(r"rotation of (-?\d+(?:\.\d+)?) degrees|rotate\s*:\s*(-?\d+)")
+
+# Containers that can carry their index (moov) after the media data
+MP4_EXTENSIONS = (".mp4", ".m4v", ".mov")
+
+# Top-level MP4 boxes read looking for the index before giving up
+MP4_MAX_BOXES = 16
+
+
+def needs_faststart(file_path: Path) -> bool:
+    """
+    Whether an MP4's index (moov) comes after its media data (mdat)
+
+    Players need the index before they can play anything, so such a file
+    only starts playing once it has loaded completely. Only the top-level
+    box headers are read.
+    """
+    if file_path.suffix.lower() not in MP4_EXTENSIONS:
+        return False
+    try:
+        size = file_path.stat().st_size
+        with open(file_path, "rb") as f:
+            offset = 0
+            for _ in range(MP4_MAX_BOXES):
+                if offset + 8 > size:
+                    return False
+                f.seek(offset)
+                header = f.read(16)
+                box_size = int.from_bytes(header[:4], "big")
+                box_type = header[4:8]
+                if box_size == 1:
+                    box_size = int.from_bytes(header[8:16], "big")
+                elif box_size == 0:
+                    # Box runs to the end of the file
+                    box_size = size - offset
+                if box_type == b"moov":
+                    return False
+                if box_type == b"mdat":
+                    return True
+                if box_size < 8:
+                    return False
+                offset += box_size
+    except OSError as e:
+        logger.debug(f"Could not read MP4 layout of {file_path.name}: {e}")
+    return False
+
+
+async def run_process(
+    cmd: List[str],
+    timeout: float = config.FFMPEG_TIMEOUT,
+    stdin: Optional[Union[bytes, memoryview]] = None,
+    cpu_limit: int = config.MEDIA_CPU_LIMIT,
+) -> Tuple[int, bytes, bytes]:
+    """
+    Run a command without blocking the event loop
+
+    The process is killed if it runs longer than timeout or the caller is
+    cancelled, so no ffmpeg outlives the job that started it. The process
+    also runs at lower priority and is stopped by the kernel after cpu_limit
+    seconds of CPU time.
+
+    Args:
+        cmd: Command and arguments
+        timeout: Seconds before the process is killed
+        stdin: Data to feed to the process (None for no input)
+        cpu_limit: CPU seconds the process may use (0 for no limit)
+
+    Returns:
+        (return code, stdout, stderr)
+
+    Raises:
+        asyncio.TimeoutError: If the process ran longer than timeout
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    limit_process(process.pid, cpu_limit)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(stdin), timeout)
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    return process.returncode, stdout, stderr
+
 
 class MetadataExtractor:
     """Extract metadata from media files"""
 
     def __init__(self):
         self.ffmpeg_available = self._check_ffmpeg()
-        self.ffprobe_available = self._check_ffprobe()
+        self.remuxed = 0
+        self.remux_failed = 0
+        self.remux_time = 0.0
 
     def _check_ffmpeg(self) -> bool:
         """Check if ffmpeg is available"""
@@ -34,19 +138,291 @@ class MetadataExtractor:
             logger.warning("ffmpeg not found")
             return False
 
-    def _check_ffprobe(self) -> bool:
-        """Check if ffprobe is available"""
+    async def probe(
+        self,
+        source: Union[Path, MemoryFile],
+        size: tuple = config.THUMBNAIL_SIZE,
+        thumbnail: bool = True,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Read video metadata and a thumbnail frame with a single ffmpeg run
+
+        ffmpeg describes the input on stderr while it decodes one frame
+        THUMBNAIL_OFFSET seconds in (seeking, not decoding up to it) and
+        writes it as a JPEG to stdout. In-memory files are piped to stdin,
+        which works for streamable containers; an MP4 with its index at the
+        end yields no metadata.
+
+        Args:
+            source: Downloaded file on disk or in memory
+            size: Largest thumbnail size (width, height)
+            thumbnail: Extract a frame (False only reads the container's
+                description, without decoding)
+
+        Returns:
+            Dictionary with duration (seconds), width, height (as displayed),
+            codec and thumbnail (JPEG bytes or None), or None if the file
+            has no video stream or ffmpeg is unavailable
+        """
+        if not self.ffmpeg_available:
+            return None
+
+        media = await self._probe_once(source, size if thumbnail else None, THUMBNAIL_OFFSET)
+        if thumbnail and media and not media["thumbnail"] and 0 < media["duration"] <= THUMBNAIL_OFFSET:
+            # Too short to seek to the offset; take a frame from the middle instead
+            retry = await self._probe_once(source, size, media["duration"] / 2)
+            media["thumbnail"] = retry["thumbnail"] if retry else None
+        return media
+
+    async def probe_sample(
+        self,
+        sample: Path,
+        head_bytes: int,
+        size: tuple = config.THUMBNAIL_SIZE,
+        thumbnail: bool = True,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Probe a partial download from FileDownloader.fetch_sample()
+
+        The sample has the real file's size, but only its first head_bytes
+        (and its tail) hold data. The thumbnail is kept only when the frame
+        at THUMBNAIL_OFFSET falls well inside the sampled start, judging by
+        the average bitrate.
+
+        Args:
+            sample: Sparse sample file
+            head_bytes: Bytes sampled from the start of the file
+            size: Largest thumbnail size (width, height)
+            thumbnail: Extract a frame as well
+
+        Returns:
+            Dictionary with kind "video" (plus the fields probe() returns),
+            "other" (readable media without a video stream) or "invalid" (not
+            media ffmpeg can read), or None if the sample can't tell (e.g. an
+            MP4 index bigger than the sampled tail) or ffmpeg is unavailable
+        """
+        if not self.ffmpeg_available:
+            return None
+
+        result = await self._run_ffmpeg(sample, size if thumbnail else None, THUMBNAIL_OFFSET)
+        if result is None:
+            return None
+        returncode, stdout, stderr = result
+
+        media = self._parse_ffmpeg_output(stderr)
+        if media is None:
+            if "Input #0" in stderr:
+                return {"kind": "other"}
+            if "Invalid data found when processing input" in stderr and "moov atom not found" not in stderr:
+                return {"kind": "invalid"}
+            return None
+
+        media["kind"] = "video"
+        media["thumbnail"] = stdout if returncode == 0 and stdout else None
+        if media["duration"] > 0:
+            sampled_seconds = head_bytes / (sample.stat().st_size / media["duration"])
+            if sampled_seconds < 2 * THUMBNAIL_OFFSET:
+                # The frame may have been decoded from the unsampled (zeroed) gap
+                media["thumbnail"] = None
+        return media
+
+    async def _probe_once(
+        self,
+        source: Union[Path, MemoryFile],
+        size: Optional[tuple],
+        offset: float,
+    ) -> Optional[Dict[str, Any]]:
+        """Run ffmpeg once and parse its output (see probe())"""
+        result = await self._run_ffmpeg(source, size, offset)
+        if result is None:
+            return None
+        returncode, stdout, stderr = result
+
+        media = self._parse_ffmpeg_output(stderr)
+        if media is None:
+            logger.debug(f"No video stream found in {source.name}")
+            return None
+        # A non-zero exit with a parsed input usually means no frame at the offset
+        media["thumbnail"] = stdout if returncode == 0 and stdout else None
+        return media
+
+    async def _run_ffmpeg(
+        self,
+        source: Union[Path, MemoryFile],
+        size: Optional[tuple],
+        offset: float,
+    ) -> Optional[Tuple[int, bytes, str]]:
+        """
+        Describe the input and grab one scaled JPEG frame at offset
+
+        Without a size no frame is decoded; ffmpeg stops after describing the
+        input (exiting with an error for the missing output).
+
+        Returns:
+            (return code, JPEG bytes, stderr text), or None if ffmpeg
+            couldn't run (queue full, timeout, not executable)
+        """
+        in_memory = isinstance(source, MemoryFile)
+        # mjpeg quality runs from 2 (best) to 31
+        quality = max(2, min(31, round(2 + (100 - config.THUMBNAIL_QUALITY) * 29 / 100)))
+        cmd = ["ffmpeg", "-hide_banner"]
+        if size is None:
+            cmd += ["-i", "pipe:0" if in_memory else str(source)]
+        else:
+            cmd += [
+                "-ss", f"{offset:.3f}",
+                "-i", "pipe:0" if in_memory else str(source),
+                "-map", "0:v:0?",
+                "-frames:v", "1",
+                "-vf", f"scale={size[0]}:{size[1]}:force_original_aspect_ratio=decrease",
+                "-f", "image2pipe",
+                "-c:v", "mjpeg",
+                "-q:v", str(quality),
+                "pipe:1",
+            ]
+
+        name = source.name
+        file_size = source.size if in_memory else source.stat().st_size
         try:
-            subprocess.run(["ffprobe", "-version"], capture_output=True, timeout=5)
-            logger.info("ffprobe is available")
-            return True
-        except (subprocess.TimeoutExpired, FileNotFoundError):
-            logger.warning("ffprobe not found")
-            return False
+            # Smaller files first, so short clips aren't stuck behind long videos
+            async with media_pool.slot(file_size, name):
+                returncode, stdout, stderr = await run_process(
+                    cmd,
+                    timeout=config.FFMPEG_TIMEOUT,
+                    stdin=source.view if in_memory else None,
+                )
+        except MediaPoolFullError as e:
+            logger.warning(f"{e}: sending {name} without video metadata or thumbnail")
+            return None
+        except asyncio.TimeoutError:
+            logger.warning(f"ffmpeg timed out after {config.FFMPEG_TIMEOUT}s probing {name}")
+            return None
+        except OSError as e:
+            logger.error(f"ffmpeg execution error: {e}")
+            return None
+
+        if returncode < 0:
+            logger.warning(f"ffmpeg was killed (signal {-returncode}) probing {name}")
+        return returncode, stdout, stderr.decode(errors="replace")
+
+    @staticmethod
+    def _parse_ffmpeg_output(stderr: str) -> Optional[Dict[str, Any]]:
+        """Parse the input description ffmpeg prints to stderr"""
+        described = stderr.split("Output #0", 1)[0]
+        stream = _VIDEO_STREAM_RE.search(described)
+        if not stream:
+            return None
+
+        media = {"duration": 0.0, "width": 0, "height": 0, "codec": stream.group(1)}
+
+        duration = _DURATION_RE.search(described)
+        if duration:
+            hours, minutes, seconds = duration.groups()
+            media["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+        dimensions = _DIMENSIONS_RE.search(stream.group(2))
+        if dimensions:
+            media["width"], media["height"] = int(dimensions.group(1)), int(dimensions.group(2))
+
+        # Phone videos are often stored sideways with a rotation to apply on playback
+        rotation = _ROTATION_RE.search(described[stream.start():])
+        if rotation:
+            degrees = abs(round(float(rotation.group(1) or rotation.group(2)))) % 180
+            if degrees == 90:
+                media["width"], media["height"] = media["height"], media["width"]
+
+        return media
+
+    async def faststart(self, file_path: Path) -> Optional[Path]:
+        """
+        Copy an MP4 with its index moved to the front, if it's at the end
+
+        The streams are copied as they are (no re-encoding), so this costs
+        roughly one read and two writes of the file. It runs in the media
+        pool behind smaller jobs, needs disk budget for the copy, and is
+        skipped (returning None) when the queue is full, space is short, or
+        it takes longer than FASTSTART_TIMEOUT.
+
+        Args:
+            file_path: Downloaded video
+
+        Returns:
+            Path of the remuxed copy in a job directory of its own (remove
+            the directory when done), or None if the file is already
+            streamable or couldn't be remuxed
+        """
+        if not config.FASTSTART_ENABLED or not self.ffmpeg_available:
+            return None
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, needs_faststart, file_path):
+            return None
+
+        size = file_path.stat().st_size
+        if size > config.FASTSTART_MAX_SIZE:
+            logger.info(f"Not remuxing {file_path.name} for streaming ({size} bytes)")
+            return None
+        reservation = await disk_quota.reserve(size, f"{file_path.name} (faststart)", timeout=0)
+        if reservation is None:
+            return None
+
+        job_dir = config.DOWNLOAD_DIR / f"{JOB_DIR_PREFIX}{uuid.uuid4().hex[:12]}"
+        job_dir.mkdir()
+        output = job_dir / file_path.name
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-i", str(file_path),
+            "-map", "0", "-dn", "-ignore_unknown",
+            "-c", "copy",
+            "-movflags", "+faststart",
+            # Explicit muxer, so the extension of the output name doesn't matter
+            "-f", "mp4" if file_path.suffix.lower() != ".mov" else "mov",
+            str(output),
+        ]
+        disk_janitor.active.add(output)
+        started = time.monotonic()
+        result = None
+        try:
+            async with media_pool.slot(size, file_path.name):
+                returncode, _, stderr = await run_process(cmd, timeout=config.FASTSTART_TIMEOUT)
+            if returncode == 0 and output.exists():
+                result = output
+            else:
+                logger.warning(
+                    f"Faststart remux of {file_path.name} failed ({returncode}): "
+                    f"{stderr.decode(errors='replace').strip()[-300:]}"
+                )
+        except MediaPoolFullError as e:
+            logger.warning(f"{e}: sending {file_path.name} without moving its index to the front")
+        except asyncio.TimeoutError:
+            logger.warning(f"Faststart remux of {file_path.name} timed out after {config.FASTSTART_TIMEOUT}s")
+        except OSError as e:
+            logger.error(f"ffmpeg execution error: {e}")
+        finally:
+            disk_janitor.active.discard(output)
+            disk_quota.release(reservation)
+            if result is None:
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+        elapsed = time.monotonic() - started
+        if result is None:
+            self.remux_failed += 1
+            return None
+        self.remuxed += 1
+        self.remux_time += elapsed
+        logger.info(f"Moved the index of {file_path.name} to the front in {elapsed:.2f}s ({size} bytes)")
+        return result
+
+    def stats(self) -> dict:
+        """Get remux counts and time for logging and diagnostics"""
+        return {
+            "remuxed": self.remuxed,
+            "remux_failed": self.remux_failed,
+            "avg_remux_time": round(self.remux_time / self.remuxed, 3) if self.remuxed else 0.0,
+        }
 
     async def extract_metadata(self, file_path: Path) -> Optional[Dict[str, Any]]:
         """
-        Extract metadata from file using ffprobe
+        Extract metadata from file using ffmpeg
 
         Args:
             file_path: Path to media file
@@ -54,71 +430,27 @@ class MetadataExtractor:
         Returns:
             Dictionary with metadata or None on failure
         """
-        if not self.ffprobe_available or not config.ENABLE_METADATA_EXTRACTION:
+        if not config.ENABLE_METADATA_EXTRACTION:
             return self._get_basic_metadata(file_path)
 
         try:
-            loop = asyncio.get_event_loop()
-            metadata = await loop.run_in_executor(None, self._run_ffprobe, file_path)
-            return metadata or self._get_basic_metadata(file_path)
+            media = await self.probe(file_path)
         except Exception as e:
             logger.error(f"Metadata extraction failed: {e}")
+            media = None
+        if not media:
             return self._get_basic_metadata(file_path)
 
-    def _run_ffprobe(self, file_path: Path) -> Optional[Dict[str, Any]]:
-        """Run ffprobe and extract metadata"""
-        try:
-            cmd = [
-                "ffprobe",
-                "-v", "error",
-                "-select_streams", "v:0",
-                "-show_entries", "format=duration:stream=width,height,codec_name",
-                "-of", "json",
-                str(file_path),
-            ]
-
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=config.FFMPEG_TIMEOUT)
-
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                return self._parse_ffprobe_output(data, file_path)
-            return None
-        except Exception as e:
-            logger.error(f"ffprobe execution error: {e}")
-            return None
-
-    def _parse_ffprobe_output(self, data: Dict, file_path: Path) -> Dict[str, Any]:
-        """Parse ffprobe output"""
-        metadata = {
+        return {
             "file_name": file_path.name,
             "file_size": self._format_size(file_path.stat().st_size),
-            "duration": 0,
-            "resolution": "Unknown",
-            "codec": "Unknown",
+            "duration": self._format_duration(media["duration"]),
+            "resolution": f"{media['width']}x{media['height']}" if media["width"] else "Unknown",
+            "codec": media["codec"].upper(),
         }
 
-        # Extract format info
-        if "format" in data and "duration" in data["format"]:
-            try:
-                duration = float(data["format"]["duration"])
-                metadata["duration"] = self._format_duration(duration)
-            except (ValueError, TypeError):
-                pass
-
-        # Extract stream info
-        if "streams" in data and data["streams"]:
-            stream = data["streams"][0]
-            width = stream.get("width", 0)
-            height = stream.get("height", 0)
-            if width and height:
-                metadata["resolution"] = f"{width}x{height}"
-            codec = stream.get("codec_name", "Unknown")
-            metadata["codec"] = codec.upper()
-
-        return metadata
-
     def _get_basic_metadata(self, file_path: Path) -> Dict[str, Any]:
-        """Get basic metadata without ffprobe"""
+        """Get basic metadata without ffmpeg"""
         return {
             "file_name": file_path.name,
             "file_size": self._format_size(file_path.stat().st_size),
@@ -163,42 +495,20 @@ class MetadataExtractor:
         Returns:
             Path to generated thumbnail or None on failure
         """
-        if not self.ffmpeg_available or not config.ENABLE_THUMBNAIL_GENERATION:
+        if not config.ENABLE_THUMBNAIL_GENERATION:
             return None
 
         try:
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None, self._run_ffmpeg_thumbnail, file_path, output_path, size
-            )
-            return result
+            media = await self.probe(file_path, size)
+            if not media or not media["thumbnail"]:
+                return None
+            output_path.write_bytes(media["thumbnail"])
+            logger.info(f"Generated thumbnail: {output_path}")
+            return output_path
         except Exception as e:
             logger.error(f"Thumbnail generation failed: {e}")
             return None
 
-    def _run_ffmpeg_thumbnail(self, file_path: Path, output_path: Path, size: tuple) -> Optional[Path]:
-        """Run ffmpeg to generate thumbnail"""
-        try:
-            cmd = [
-                "ffmpeg",
-                "-i", str(file_path),
-                "-ss", "00:00:01",
-                "-vf", f"scale={size[0]}:{size[1]}:force_original_aspect_ratio=decrease",
-                "-vframes", "1",
-                "-y",
-                str(output_path),
-            ]
-
-            result = subprocess.run(cmd, capture_output=True, timeout=config.FFMPEG_TIMEOUT)
-
-            if result.returncode == 0 and output_path.exists():
-                logger.info(f"Generated thumbnail: {output_path}")
-                return output_path
-            return None
-        except Exception as e:
-            logger.error(f"ffmpeg thumbnail execution error: {e}")
-            return None
-
 
 # Global metadata extractor instance
 metadata_extractor = MetadataExtractor()
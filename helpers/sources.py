@@ -0,0 +1,131 @@
+"""
+Sources module for TeraBox Downloader Bot
+Tracks per-host download speed to choose between a file's alternative URLs
+"""
+
+import time
+from typing import Optional, Dict, Any, List
+from urllib.parse import urlparse
+
+import config
+from helpers.logger import get_logger
+
+logger = get_logger("terabox_bot")
+
+
+def source_host(url: str) -> str:
+    """Host a download URL is served from"""
+    return urlparse(url).netloc.lower()
+
+
+class HostStats:
+    """Throughput and failure history for one download host"""
+
+    def __init__(self, host: str, alpha: float = config.SOURCE_EWMA_ALPHA):
+        self.host = host
+        self.alpha = alpha
+        self.speed_ewma: Optional[float] = None
+        self.success_ewma = 1.0
+        self.samples = 0
+        self.updated = 0.0
+        self.failures = 0
+        self.failed_at = 0.0
+
+    def record(self, received: int, elapsed: float):
+        """Fold one successful transfer's throughput into the averages"""
+        speed = received / max(elapsed, 1e-3)
+        if self.speed_ewma is None:
+            self.speed_ewma = speed
+        else:
+            self.speed_ewma = self.alpha * speed + (1 - self.alpha) * self.speed_ewma
+        self.success_ewma = self.alpha + (1 - self.alpha) * self.success_ewma
+        self.samples += 1
+        self.updated = time.monotonic()
+        self.failed_at = 0.0
+
+    def record_failure(self):
+        self.success_ewma = (1 - self.alpha) * self.success_ewma
+        self.failures += 1
+        self.failed_at = time.monotonic()
+
+    def is_fresh(self) -> bool:
+        """Whether the measured speed is recent enough to choose by"""
+        return self.speed_ewma is not None and time.monotonic() - self.updated < config.SOURCE_HISTORY_TTL
+
+    def recently_failed(self) -> bool:
+        """Whether the last transfer failed within SOURCE_HISTORY_TTL"""
+        return bool(self.failed_at) and time.monotonic() - self.failed_at < config.SOURCE_HISTORY_TTL
+
+    def score(self) -> Optional[float]:
+        """Expected bytes per second discounted by failures, or None if unmeasured"""
+        if not self.is_fresh():
+            return None
+        return self.speed_ewma * self.success_ewma
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get host history for logging and diagnostics"""
+        return {
+            "host": self.host,
+            "speed_ewma": round(self.speed_ewma) if self.speed_ewma is not None else None,
+            "success_ewma": round(self.success_ewma, 3),
+            "samples": self.samples,
+            "failures": self.failures,
+            "fresh": self.is_fresh(),
+        }
+
+
+class SourceSelector:
+    """
+    Chooses which of a file's URLs (download_link, proxy_url) to download from
+
+    Sources are ranked by their host's measured speed discounted by its
+    success rate, so one dropped connection doesn't demote an otherwise fast
+    host. While a candidate host has no recent measurement (and hasn't just
+    failed) the downloader races the sources instead; the race and every
+    finished attempt feed their throughput back here.
+    """
+
+    def __init__(self):
+        self.hosts: Dict[str, HostStats] = {}
+
+    def stats_for(self, url: str) -> HostStats:
+        host = source_host(url)
+        stats = self.hosts.get(host)
+        if stats is None:
+            stats = HostStats(host)
+            self.hosts[host] = stats
+        return stats
+
+    def record(self, url: str, received: int, elapsed: float):
+        """Record a successful transfer of received bytes over elapsed seconds"""
+        self.stats_for(url).record(received, elapsed)
+
+    def record_failure(self, url: str):
+        self.stats_for(url).record_failure()
+
+    def rank(self, urls: List[str]) -> List[str]:
+        """Sources ordered best first (unmeasured hosts after measured ones)"""
+
+        def key(url: str):
+            stats = self.stats_for(url)
+            score = stats.score()
+            return (score is None, -(score or 0.0), stats.recently_failed())
+
+        return sorted(urls, key=key)
+
+    def needs_race(self, urls: List[str]) -> bool:
+        """Whether some source has no recent speed (and hasn't just failed) to rank it by"""
+        if len(urls) < 2:
+            return False
+        return any(
+            not stats.is_fresh() and not stats.recently_failed()
+            for stats in (self.stats_for(url) for url in urls)
+        )
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Get per-host speed history"""
+        return [stats.snapshot() for stats in self.hosts.values()]
+
+
+# Global source selector instance
+source_selector = SourceSelector()
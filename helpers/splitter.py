@@ -0,0 +1,518 @@
+"""
+Splitter module for TeraBox Downloader Bot
+Sends files over the Bot API upload limit as parts, uploaded while the file downloads
+"""
+
+import asyncio
+import math
+import shutil
+import uuid
+from pathlib import Path
+from typing import Optional, Callable, Awaitable, Dict, List, Any
+
+import aiohttp
+
+import config
+from helpers.cache import JOB_DIR_PREFIX
+from helpers.disk_quota import disk_quota, disk_janitor
+from helpers.downloader import DownloadWatcher
+from helpers.logger import get_logger
+from helpers.media_pool import limit_process, media_pool, MediaPoolFullError
+from helpers.metadata import metadata_extractor, MP4_EXTENSIONS, MP4_MAX_BOXES
+from helpers.uploader import uploader, TelegramUploadError
+
+logger = get_logger("terabox_bot")
+
+# Containers ffmpeg can demux from a pipe, i.e. while the file is still downloading
+# (MP4 only when its index precedes the media data)
+STREAMABLE_EXTENSIONS = (".mkv", ".webm", ".ts", ".m2ts", ".flv", ".mpg", ".mpeg")
+
+# Segment length relative to the average bitrate, leaving room for busier scenes
+SEGMENT_MARGIN = 0.9
+
+
+class SplitError(Exception):
+    """Raised when a file can't be cut into parts after some were already sent"""
+
+
+class Piece:
+    """One part to upload: bytes [start, end) of a segment file, or of the download itself"""
+
+    def __init__(self, name: str, start: int, end: int, path: Optional[Path] = None, video: bool = False):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.path = path
+        self.video = video
+
+
+class SplitUpload:
+    """
+    Parts of one file being uploaded
+
+    Parts are uploaded as soon as their bytes are on disk, up to
+    SPLIT_UPLOAD_CONCURRENCY at a time, so they may finish out of order;
+    delivered() hands the sent messages back in part order.
+    """
+
+    def __init__(
+        self,
+        chat_id: int,
+        watcher: DownloadWatcher,
+        caption: str,
+        video_params: Optional[Dict[str, Any]],
+    ):
+        self.chat_id = chat_id
+        self.watcher = watcher
+        self.caption = caption
+        # Each part's own duration is left for Telegram to read
+        self.video_params = {k: v for k, v in (video_params or {}).items() if k != "duration"}
+        self.work_dir: Optional[Path] = None
+        self.count = 0
+        self._semaphore = asyncio.Semaphore(max(1, config.SPLIT_UPLOAD_CONCURRENCY))
+        self.tasks: List[asyncio.Task] = []
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def add(self, piece: Piece, label: str):
+        """Start uploading a part"""
+        self.count += 1
+        task = asyncio.ensure_future(self._upload(piece, label))
+        self.tasks.append(task)
+        self._queue.put_nowait((task, label))
+
+    def close(self):
+        """No more parts will be added"""
+        self._queue.put_nowait(None)
+
+    def cancel(self):
+        """Stop every upload still running"""
+        for task in self.tasks:
+            task.cancel()
+
+    async def delivered(
+        self,
+        deliver: Optional[Callable[[Dict[str, Any], str], Awaitable[None]]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Wait for the parts in order, passing each sent message to deliver
+
+        Returns:
+            Sent messages in part order
+        """
+        messages = []
+        while True:
+            entry = await self._queue.get()
+            if entry is None:
+                return messages
+            task, label = entry
+            message = await task
+            if deliver:
+                await deliver(message, label)
+            messages.append(message)
+
+    async def _upload(self, piece: Piece, label: str) -> Dict[str, Any]:
+        """Upload one part once its bytes are on disk, retrying transient failures"""
+        if piece.path is None:
+            await self.watcher.wait_for(piece.start, piece.end)
+
+        caption = f"{self.caption}\n{label}"
+        async with self._semaphore:
+            for attempt in range(config.MAX_RETRIES):
+                # The download is renamed into place when it completes
+                path = piece.path or self.watcher.path
+                try:
+                    if piece.video:
+                        message = await uploader.send_video(
+                            self.chat_id,
+                            path,
+                            file_name=piece.name,
+                            byte_range=(piece.start, piece.end),
+                            caption=caption,
+                            parse_mode="Markdown",
+                            supports_streaming=True,
+                            **self.video_params
+                        )
+                    else:
+                        message = await uploader.send_document(
+                            self.chat_id,
+                            path,
+                            file_name=piece.name,
+                            byte_range=(piece.start, piece.end),
+                            caption=caption,
+                            parse_mode="Markdown",
+                        )
+                    break
+                except FileNotFoundError:
+                    if piece.path is not None or self.watcher.path == path:
+                        raise
+                    continue
+                except (aiohttp.ClientError, asyncio.TimeoutError, TelegramUploadError) as e:
+                    if attempt == config.MAX_RETRIES - 1:
+                        raise
+                    logger.warning(
+                        f"Upload of {piece.name} failed: {e} (attempt {attempt + 1}/{config.MAX_RETRIES})"
+                    )
+                    await asyncio.sleep(2 ** attempt)
+            else:
+                raise SplitError(f"{piece.name} moved while uploading")
+
+        if piece.path is not None and piece.end == piece.path.stat().st_size and piece.start == 0:
+            # A whole segment is done with once sent
+            piece.path.unlink(missing_ok=True)
+        return message
+
+
+class FileSplitter:
+    """
+    Sends files larger than UPLOAD_LIMIT_BYTES as several uploads
+
+    Work starts as soon as the download does. Other files are cut into raw
+    byte ranges of SPLIT_PART_SIZE named "<name>.001", "<name>.002", ...
+    (rejoined with cat or 7-Zip), and each part is uploaded straight from
+    the .part file as soon as its range has arrived. Videos are cut on
+    keyframes by ffmpeg's segment muxer without re-encoding, so every part
+    plays on its own; segments go up as ffmpeg finishes them. Streamable
+    containers (MKV, TS, or MP4 with its index first) are piped to ffmpeg
+    as they download; other MP4s are cut once complete, since ffmpeg needs
+    to seek to the index. A video that can't be segmented falls back to
+    raw parts.
+    """
+
+    def __init__(self):
+        self.jobs = 0
+        self.parts = 0
+        self.fallbacks = 0
+        self.failures = 0
+
+    @property
+    def part_size(self) -> int:
+        """Bytes per part"""
+        return config.SPLIT_PART_SIZE or config.UPLOAD_LIMIT_BYTES - 1024 * 1024
+
+    @staticmethod
+    def needs_split(size: int) -> bool:
+        """Whether a file is too large to upload in one piece"""
+        return size > config.UPLOAD_LIMIT_BYTES
+
+    async def upload(
+        self,
+        chat_id: int,
+        watcher: DownloadWatcher,
+        file_name: str,
+        caption: str,
+        deliver: Optional[Callable[[Dict[str, Any], str], Awaitable[None]]] = None,
+        video_params: Optional[Dict[str, Any]] = None,
+        duration: float = 0.0,
+    ) -> List[Dict[str, Any]]:
+        """
+        Upload a file in parts while it downloads
+
+        Args:
+            chat_id: Chat to upload the parts to
+            watcher: Watcher passed to downloader.fetch() (or finished with
+                a completed file)
+            file_name: Name of the whole file
+            caption: Caption for every part (the part number is appended)
+            deliver: Coroutine called with each sent message and its part
+                label, in part order (e.g. to copy the parts on to a user)
+            video_params: sendVideo parameters (thumbnail, width, height) to
+                cut on keyframes and send the parts as videos; None sends raw
+                parts as documents
+            duration: Video length in seconds if already known (e.g. from an
+                early probe); lets streamable videos be cut while downloading
+
+        Returns:
+            Sent messages in part order
+
+        Raises:
+            DownloadAbortedError: If the download fails or is discarded
+                (parts already sent stay sent)
+            SplitError: If ffmpeg fails after parts were already sent
+        """
+        self.jobs += 1
+        job = SplitUpload(chat_id, watcher, caption, video_params)
+        splitting = asyncio.ensure_future(self._split(job, file_name, video_params, duration))
+        delivering = asyncio.ensure_future(job.delivered(deliver))
+        try:
+            await asyncio.wait({splitting, delivering}, return_when=asyncio.FIRST_EXCEPTION)
+            if splitting.done():
+                splitting.result()
+            messages = await delivering
+            # Parts can all be sent before the download's checksums are verified
+            await watcher.wait_finished()
+        except BaseException:
+            self.failures += 1
+            splitting.cancel()
+            delivering.cancel()
+            job.cancel()
+            await asyncio.gather(splitting, delivering, *job.tasks, return_exceptions=True)
+            raise
+        finally:
+            if job.work_dir:
+                shutil.rmtree(job.work_dir, ignore_errors=True)
+        self.parts += len(messages)
+        logger.info(f"Sent {file_name} in {len(messages)} parts")
+        return messages
+
+    def stats(self) -> dict:
+        """Get split counts for logging and diagnostics"""
+        return {
+            "jobs": self.jobs,
+            "parts": self.parts,
+            "fallbacks": self.fallbacks,
+            "failures": self.failures,
+        }
+
+    async def _split(
+        self,
+        job: SplitUpload,
+        file_name: str,
+        video_params: Optional[Dict[str, Any]],
+        duration: float,
+    ):
+        """Queue the file's parts on job, then close it"""
+        try:
+            if video_params is None or not metadata_extractor.ffmpeg_available:
+                await self._split_raw(job, file_name)
+            elif not await self._split_video(job, file_name, duration):
+                self.fallbacks += 1
+                logger.warning(f"Could not cut {file_name} on keyframes, sending raw parts")
+                await self._split_raw(job, file_name)
+        finally:
+            job.close()
+
+    async def _split_raw(self, job: SplitUpload, file_name: str):
+        """Queue byte ranges of the download itself"""
+        size = await job.watcher.wait_size()
+        if not size:
+            # Unknown until complete (no content-length)
+            await job.watcher.wait_finished()
+            size = job.watcher.total
+        count = math.ceil(size / self.part_size)
+        for index in range(count):
+            start = index * self.part_size
+            job.add(
+                Piece(f"{file_name}.{index + 1:03d}", start, min(size, start + self.part_size)),
+                f"🧩 Part {index + 1}/{count}",
+            )
+
+    async def _split_video(self, job: SplitUpload, file_name: str, duration: float) -> bool:
+        """
+        Queue keyframe-aligned segments as ffmpeg writes them
+
+        Returns:
+            False if nothing was queued and raw parts should be sent instead
+
+        Raises:
+            SplitError: If ffmpeg failed after segments were queued
+        """
+        watcher = job.watcher
+        size = await watcher.wait_size()
+        streamed = bool(size and duration) and await self._streamable(watcher, file_name, size)
+        if not streamed:
+            source = await watcher.wait_finished()
+            size = watcher.total
+            if not duration:
+                media = await metadata_extractor.probe(source, thumbnail=False)
+                duration = media["duration"] if media else 0.0
+        if duration <= 0 or not size:
+            return False
+
+        # Segments can pile up to the whole file if uploads fall behind
+        reservation = await disk_quota.reserve(size, f"{file_name} segments", timeout=0)
+        if reservation is None:
+            return False
+
+        segment_time = max(1.0, duration * self.part_size / size * SEGMENT_MARGIN)
+        job_dir = config.DOWNLOAD_DIR / f"{JOB_DIR_PREFIX}{uuid.uuid4().hex[:12]}"
+        job_dir.mkdir()
+        job.work_dir = job_dir
+        stem, suffix = Path(file_name).stem, Path(file_name).suffix.lower() or ".mp4"
+        output = job_dir / f"{stem}.part%03d{suffix}"
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-i", "pipe:0" if streamed else str(watcher.path),
+            "-map", "0:v:0", "-map", "0:a?",
+            "-c", "copy",
+            "-f", "segment",
+            "-segment_time", f"{segment_time:.3f}",
+            "-reset_timestamps", "1",
+            # Completed segment names are listed on stdout as each one closes
+            "-segment_list", "pipe:1",
+            "-segment_list_type", "flat",
+        ]
+        if suffix in MP4_EXTENSIONS:
+            cmd += ["-segment_format_options", "movflags=+faststart"]
+        cmd.append(str(output))
+
+        disk_janitor.active.add(output)
+        queued = 0
+        try:
+            if streamed:
+                # Paced by the download rather than the CPU, so it doesn't hold a media slot
+                returncode, stderr = await self._segment(cmd, job, job_dir, watcher, size)
+            else:
+                async with media_pool.slot(size, file_name):
+                    returncode, stderr = await self._segment(cmd, job, job_dir, None, size)
+            queued = job.count
+        except MediaPoolFullError as e:
+            logger.warning(f"{e}: sending {file_name} as raw parts")
+            returncode, stderr = -1, ""
+        except (asyncio.TimeoutError, OSError) as e:
+            returncode, stderr = -1, str(e)
+            queued = job.count
+        finally:
+            disk_janitor.active.discard(output)
+            disk_quota.release(reservation)
+
+        if returncode != 0:
+            logger.warning(f"ffmpeg failed segmenting {file_name} ({returncode}): {stderr.strip()[-300:]}")
+            if queued:
+                raise SplitError(f"Segmenting {file_name} failed after {queued} parts")
+            return False
+        logger.info(f"Cut {file_name} into {queued} segments of ~{segment_time:.0f}s")
+        return True
+
+    async def _segment(
+        self,
+        cmd: List[str],
+        job: SplitUpload,
+        job_dir: Path,
+        feed: Optional[DownloadWatcher],
+        size: int,
+    ):
+        """
+        Run the segment muxer, queueing each segment as it is completed
+
+        Args:
+            feed: Download to pipe to ffmpeg as it arrives (None when ffmpeg
+                reads the completed file itself)
+
+        Returns:
+            (return code, stderr text)
+        """
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if feed else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        limit_process(process.pid)
+
+        async def collect():
+            index = 0
+            async for line in process.stdout:
+                name = line.decode(errors="replace").strip()
+                if name:
+                    index += 1
+                    self._add_segment(job, job_dir / Path(name).name, index)
+
+        tasks = [asyncio.ensure_future(collect()), asyncio.ensure_future(process.stderr.read())]
+        if feed:
+            tasks.append(asyncio.ensure_future(self._feed(process, feed, size)))
+        try:
+            done, pending = await asyncio.wait(
+                tasks,
+                timeout=config.DOWNLOAD_TIMEOUT if feed else config.UPLOAD_TIMEOUT,
+                return_when=asyncio.FIRST_EXCEPTION,
+            )
+            for task in done:
+                task.result()
+            if pending:
+                raise asyncio.TimeoutError()
+            return await process.wait(), tasks[1].result().decode(errors="replace")
+        finally:
+            for task in tasks:
+                task.cancel()
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+    def _add_segment(self, job: SplitUpload, segment: Path, index: int):
+        """Queue a completed segment, in raw pieces if it came out over the part size"""
+        size = segment.stat().st_size
+        if size <= self.part_size:
+            job.add(Piece(segment.name, 0, size, segment, video=True), f"🧩 Part {index}")
+            return
+        # A long gap between keyframes; this segment can only be sent as raw pieces
+        count = math.ceil(size / self.part_size)
+        for piece in range(count):
+            start = piece * self.part_size
+            job.add(
+                Piece(f"{segment.name}.{piece + 1:03d}", start, min(size, start + self.part_size), segment),
+                f"🧩 Part {index} ({piece + 1}/{count})",
+            )
+
+    @staticmethod
+    async def _feed(process: asyncio.subprocess.Process, watcher: DownloadWatcher, size: int):
+        """Pipe the download to ffmpeg as its bytes arrive, in order"""
+        loop = asyncio.get_running_loop()
+        position = 0
+        try:
+            while position < size:
+                path = await watcher.wait_for(position, position + 1)
+                end = min(size, watcher.available_from(position))
+                try:
+                    f = open(path, "rb")
+                except FileNotFoundError:
+                    # Renamed into place since; the watcher has the new path
+                    if watcher.path == path:
+                        raise
+                    continue
+                with f:
+                    f.seek(position)
+                    while position < end:
+                        chunk = await loop.run_in_executor(None, f.read, min(config.CHUNK_SIZE, end - position))
+                        if not chunk:
+                            raise OSError(f"{path} ended at {position} of {end} bytes")
+                        process.stdin.write(chunk)
+                        await process.stdin.drain()
+                        position += len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg stopped reading; its exit code says why
+            return
+        finally:
+            process.stdin.close()
+
+    @staticmethod
+    async def _streamable(watcher: DownloadWatcher, file_name: str, size: int) -> bool:
+        """Whether ffmpeg can read the video front to back from a pipe"""
+        suffix = Path(file_name).suffix.lower()
+        if suffix in STREAMABLE_EXTENSIONS:
+            return True
+        if suffix not in MP4_EXTENSIONS:
+            return False
+
+        # Walk the top-level boxes until the index or the media data
+        offset = 0
+        for _ in range(MP4_MAX_BOXES):
+            if offset + 16 > size:
+                return False
+            header = await FileSplitter._read_at(watcher, offset, 16)
+            box_size = int.from_bytes(header[:4], "big")
+            box_type = header[4:8]
+            if box_size == 1:
+                box_size = int.from_bytes(header[8:16], "big")
+            if box_type == b"moov":
+                return True
+            if box_type == b"mdat" or box_size < 8:
+                return False
+            offset += box_size
+        return False
+
+    @staticmethod
+    async def _read_at(watcher: DownloadWatcher, offset: int, length: int) -> bytes:
+        """Read a few bytes of the download once they have arrived"""
+        while True:
+            path = await watcher.wait_for(offset, offset + length)
+            try:
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    return f.read(length)
+            except FileNotFoundError:
+                if watcher.path == path:
+                    raise
+
+
+# Global file splitter instance
+file_splitter = FileSplitter()
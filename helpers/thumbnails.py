@@ -0,0 +1,170 @@
+"""
+Thumbnails module for TeraBox Downloader Bot
+Resolver thumbnails resized for Telegram and cached by share id
+"""
+
+import asyncio
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict
+
+import aiohttp
+from PIL import Image
+
+import config
+from helpers.logger import get_logger
+
+logger = get_logger("terabox_bot")
+
+# Pillow releases the GIL while decoding and resampling, so resizing runs beside the event loop
+_thumbnail_executor = ThreadPoolExecutor(
+    max_workers=config.THUMBNAIL_THREADS,
+    thread_name_prefix="thumbnail",
+)
+
+
+def resize_thumbnail(
+    data: bytes,
+    size: tuple = config.THUMBNAIL_SIZE,
+    quality: int = config.THUMBNAIL_QUALITY,
+) -> bytes:
+    """
+    Scale an image to fit within size and encode it as JPEG
+
+    Runs on a thumbnail thread.
+
+    Raises:
+        OSError: If the image can't be decoded
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEGs are decoded straight at a reduced scale close to the target
+        image.draft("RGB", size)
+        thumbnail = image.convert("RGB")
+    thumbnail.thumbnail(size, Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    thumbnail.save(output, "JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+
+class ThumbnailService:
+    """
+    Upload thumbnails, cached by canonical share id
+
+    The resolver's thumbnail image is preferred over extracting a frame
+    with ffmpeg: prefetch() starts downloading it while the file itself
+    downloads, and it is resized on the thumbnail threads to THUMBNAIL_SIZE.
+    Results, including frames ffmpeg extracted as a fallback (put()), are
+    kept for the most recently used THUMBNAIL_CACHE_ENTRIES shares, so
+    repeat requests and the store channel copy reuse them.
+    """
+
+    def __init__(self, max_entries: int = config.THUMBNAIL_CACHE_ENTRIES):
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.timeout = aiohttp.ClientTimeout(total=config.API_TIMEOUT)
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    async def init_session(self):
+        """Initialize aiohttp session"""
+        if not self.session:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+
+    async def close_session(self):
+        """Close aiohttp session"""
+        for task in list(self._pending.values()):
+            task.cancel()
+        if self.session:
+            await self.session.close()
+
+    def prefetch(self, share_id: str, url: str):
+        """Start fetching a share's thumbnail in the background (no-op if cached or running)"""
+        if not url or share_id in self.entries or share_id in self._pending:
+            return
+        task = asyncio.ensure_future(self._fetch(share_id, url))
+        self._pending[share_id] = task
+        task.add_done_callback(lambda _: self._pending.pop(share_id, None))
+
+    async def get(self, share_id: str, url: str = "") -> Optional[bytes]:
+        """
+        Get a share's thumbnail
+
+        Args:
+            share_id: Canonical share id
+            url: Resolver thumbnail URL (fetched if not cached or prefetching)
+
+        Returns:
+            JPEG bytes, or None if there is no usable resolver thumbnail
+        """
+        thumbnail = self.entries.get(share_id)
+        if thumbnail is not None:
+            self.entries.move_to_end(share_id)
+            self.hits += 1
+            return thumbnail
+
+        self.prefetch(share_id, url)
+        task = self._pending.get(share_id)
+        if task is None:
+            return None
+        # Shielded so one caller giving up doesn't cancel the fetch for others
+        return await asyncio.shield(task)
+
+    def put(self, share_id: str, thumbnail: bytes):
+        """Cache a thumbnail made another way (e.g. an ffmpeg frame)"""
+        self.entries[share_id] = thumbnail
+        self.entries.move_to_end(share_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Get cache usage for logging and diagnostics"""
+        return {
+            "entries": len(self.entries),
+            "bytes": sum(len(thumbnail) for thumbnail in self.entries.values()),
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures,
+        }
+
+    async def _fetch(self, share_id: str, url: str) -> Optional[bytes]:
+        """Download and resize a resolver thumbnail, caching the result"""
+        self.misses += 1
+        if not self.session:
+            await self.init_session()
+
+        try:
+            async with self.session.get(url, allow_redirects=True) as response:
+                if response.status != 200:
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status
+                    )
+                if response.content_length and response.content_length > config.THUMBNAIL_SOURCE_MAX_BYTES:
+                    raise ValueError(f"image is {response.content_length} bytes")
+                chunks = []
+                received = 0
+                async for chunk in response.content.iter_any():
+                    received += len(chunk)
+                    if received > config.THUMBNAIL_SOURCE_MAX_BYTES:
+                        raise ValueError(f"image over {config.THUMBNAIL_SOURCE_MAX_BYTES} bytes")
+                    chunks.append(chunk)
+                data = b"".join(chunks)
+
+            loop = asyncio.get_running_loop()
+            thumbnail = await loop.run_in_executor(_thumbnail_executor, resize_thumbnail, data)
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError, Image.DecompressionBombError) as e:
+            self.failures += 1
+            logger.debug(f"Resolver thumbnail unusable for {share_id}: {e!r}")
+            return None
+
+        self.put(share_id, thumbnail)
+        logger.debug(f"Thumbnail for {share_id}: {len(data)} -> {len(thumbnail)} bytes")
+        return thumbnail
+
+
+# Global thumbnail service instance
+thumbnail_service = ThumbnailService()
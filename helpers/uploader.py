@@ -0,0 +1,190 @@
+"""
+Uploader module for TeraBox Downloader Bot
+Streams large files to the Telegram Bot API with bounded memory
+"""
+
+import aiohttp
+import asyncio
+import json
+import mimetypes
+from pathlib import Path
+from typing import Optional, Dict, Any, Tuple, Union
+
+import config
+from helpers.logger import get_logger
+
+logger = get_logger("terabox_bot")
+
+
+class TelegramUploadError(Exception):
+    """Raised when the Bot API rejects an upload"""
+
+
+class FileRangePayload(aiohttp.payload.Payload):
+    """Multipart body part that streams bytes [start, end) of a file"""
+
+    def __init__(self, path: Path, start: int, end: int, **kwargs):
+        super().__init__(path, **kwargs)
+        self._start = start
+        self._size = end - start
+
+    async def write(self, writer):
+        loop = asyncio.get_running_loop()
+        with open(self._value, "rb") as f:
+            f.seek(self._start)
+            remaining = self._size
+            while remaining:
+                chunk = await loop.run_in_executor(None, f.read, min(config.CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise OSError(f"{self._value} ended {remaining} bytes early")
+                await writer.write(chunk)
+                remaining -= len(chunk)
+
+    def decode(self, encoding: str = "utf-8", errors: str = "strict") -> str:
+        raise TypeError("File ranges are binary")
+
+
+class MemoryPayload(aiohttp.payload.Payload):
+    """
+    Multipart body part that streams an in-memory buffer without copying it
+
+    Written in CHUNK_SIZE slices so the transport drains between them
+    instead of buffering the whole file.
+    """
+
+    def __init__(self, view: memoryview, **kwargs):
+        super().__init__(view, **kwargs)
+        self._size = len(view)
+
+    async def write(self, writer):
+        for offset in range(0, self._size, config.CHUNK_SIZE):
+            await writer.write(self._value[offset:offset + config.CHUNK_SIZE])
+
+    def decode(self, encoding: str = "utf-8", errors: str = "strict") -> str:
+        raise TypeError("In-memory files are binary")
+
+
+class TelegramUploader:
+    """
+    Multipart uploader that streams files from disk
+
+    python-telegram-bot reads a whole file into memory to build its multipart
+    body. Here aiohttp sends the file part straight from the open file in
+    fixed-size reads, so memory per upload stays the same whatever the file
+    size. Files already in memory are sent from their buffer, uncopied.
+    """
+
+    def __init__(self):
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.timeout = aiohttp.ClientTimeout(total=config.UPLOAD_TIMEOUT)
+        self.base_url = f"{config.TELEGRAM_API_URL}/bot{config.BOT_TOKEN}"
+
+    async def init_session(self):
+        """Initialize aiohttp session"""
+        if not self.session:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+
+    async def close_session(self):
+        """Close aiohttp session"""
+        if self.session:
+            await self.session.close()
+
+    async def send_video(
+        self,
+        chat_id: int,
+        file_path: Union[Path, memoryview],
+        file_name: Optional[str] = None,
+        byte_range: Optional[Tuple[int, int]] = None,
+        **params,
+    ) -> Dict[str, Any]:
+        """Upload a video with sendVideo"""
+        return await self._send("sendVideo", "video", chat_id, file_path, params, file_name, byte_range)
+
+    async def send_document(
+        self,
+        chat_id: int,
+        file_path: Union[Path, memoryview],
+        file_name: Optional[str] = None,
+        byte_range: Optional[Tuple[int, int]] = None,
+        **params,
+    ) -> Dict[str, Any]:
+        """Upload a file with sendDocument"""
+        return await self._send("sendDocument", "document", chat_id, file_path, params, file_name, byte_range)
+
+    async def _send(
+        self,
+        method: str,
+        field: str,
+        chat_id: int,
+        file_path: Union[Path, memoryview],
+        params: Dict[str, Any],
+        file_name: Optional[str] = None,
+        byte_range: Optional[Tuple[int, int]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Upload a file with a Bot API send method
+
+        Args:
+            method: Bot API method name
+            field: Multipart field name for the file
+            chat_id: Target chat
+            file_path: File to upload, or the content of an in-memory file
+                (file_name is then required)
+            params: Extra method parameters (caption, parse_mode, ...); bytes
+                values such as a thumbnail are attached as files
+            file_name: Name to upload as (defaults to the file's name)
+            byte_range: Upload only bytes [start, end) of the file (e.g. one
+                part of a split file)
+
+        Returns:
+            The sent Message as a dictionary
+
+        Raises:
+            TelegramUploadError: If the Bot API returns ok=false
+        """
+        if not self.session:
+            await self.init_session()
+
+        form = aiohttp.FormData()
+        form.add_field("chat_id", str(chat_id))
+        for key, value in params.items():
+            if value is None:
+                continue
+            if isinstance(value, bytes):
+                # Sent as its own part and referenced with attach://
+                form.add_field(f"{key}_file", value, filename=f"{key}.jpg", content_type="image/jpeg")
+                value = f"attach://{key}_file"
+            elif isinstance(value, bool):
+                value = "true" if value else "false"
+            elif isinstance(value, (dict, list)):
+                value = json.dumps(value)
+            form.add_field(key, str(value))
+
+        file_name = file_name or file_path.name
+        content_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+
+        if isinstance(file_path, memoryview) or byte_range:
+            if isinstance(file_path, memoryview):
+                part = MemoryPayload(file_path, content_type=content_type)
+            else:
+                part = FileRangePayload(file_path, *byte_range, content_type=content_type)
+            form.add_field(field, part, filename=file_name)
+            async with self.session.post(f"{self.base_url}/{method}", data=form) as response:
+                result = await response.json(content_type=None)
+        else:
+            with open(file_path, "rb") as f:
+                form.add_field(field, f, filename=file_name, content_type=content_type)
+                async with self.session.post(f"{self.base_url}/{method}", data=form) as response:
+                    result = await response.json(content_type=None)
+
+        if not result.get("ok"):
+            raise TelegramUploadError(
+                f"{method} failed ({response.status}): {result.get('description', 'unknown error')}"
+            )
+
+        logger.info(f"Uploaded {file_name} via {method} (streamed)")
+        return result["result"]
+
+
+# Global uploader instance
+uploader = TelegramUploader()
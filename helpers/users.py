@@ -0,0 +1,80 @@
+"""
+Users module for TeraBox Downloader Bot
+Records user activity with one upsert, skipping users seen moments ago
+"""
+
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import config
+from helpers.db import db
+from helpers.logger import get_logger
+
+logger = get_logger("terabox_bot")
+
+
+class UserCache:
+    """
+    Recently recorded users
+
+    touch() writes a user's record (db.upsert_user) at most once per
+    USER_CACHE_TTL seconds, or sooner if their name changed, so a burst of
+    messages costs one round trip instead of three per message. The most
+    recently seen USER_CACHE_ENTRIES users are remembered.
+    """
+
+    def __init__(self, ttl: float = config.USER_CACHE_TTL, max_entries: int = config.USER_CACHE_ENTRIES):
+        self.ttl = float(ttl)
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[int, Tuple[str, str, float]]" = OrderedDict()
+        self.hits = 0
+        self.writes = 0
+        self.failures = 0
+
+    async def touch(self, user_id: int, first_name: str, last_name: Optional[str] = None) -> bool:
+        """
+        Record that a user is active
+
+        Args:
+            user_id: Telegram user id
+            first_name: User's first name
+            last_name: User's last name
+
+        Returns:
+            True if the user's record is known to be current
+        """
+        last_name = last_name or ""
+        entry = self.entries.get(user_id)
+        if entry is not None:
+            cached_first, cached_last, written_at = entry
+            if (
+                (cached_first, cached_last) == (first_name, last_name)
+                and time.monotonic() - written_at < self.ttl
+            ):
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return True
+
+        if not await db.upsert_user(user_id, first_name, last_name):
+            self.failures += 1
+            return False
+        self.writes += 1
+        self.entries[user_id] = (first_name, last_name, time.monotonic())
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return True
+
+    def stats(self) -> dict:
+        """Get cache usage for logging and diagnostics"""
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "writes": self.writes,
+            "failures": self.failures,
+        }
+
+
+# Global user cache instance
+user_cache = UserCache()
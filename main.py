@@ -5,7 +5,9 @@ Uses Flask to receive webhook updates from Telegram
 """
 
 import asyncio
+import atexit
 import os
+import signal
 import sys
 from pathlib import Path
 from functools import wraps
@@ -18,9 +20,13 @@ from helpers.logger import get_logger
 from helpers.db import db
 from helpers.api_client import api_client
 from helpers.downloader import downloader
+from helpers.uploader import uploader
+from helpers.thumbnails import thumbnail_service
+from helpers.media_pool import media_pool
 from config import BOT_TOKEN, BASE_DIR, STORE_CHANNEL, ERROR_CHANNEL, LOG_CHANNEL
 from plugins.start import setup_start_handlers
 from plugins.handler import setup_message_handlers
+from plugins.admin import setup_admin_handlers
 
 logger = get_logger("terabox_bot")
 
@@ -78,6 +84,11 @@ class TeraBoxBot:
             await downloader.init_session()
             logger.info("✅ Downloader initialized")
 
+            # Initialize uploader
+            logger.info("⬆️ Initializing uploader...")
+            await uploader.init_session()
+            logger.info("✅ Uploader initialized")
+
             # Create telegram bot application
             logger.info("🤖 Creating Telegram bot...")
             self.tg_app = Application.builder().token(BOT_TOKEN).build()
@@ -85,6 +96,7 @@ class TeraBoxBot:
             # Setup handlers
             logger.info("📝 Setting up handlers...")
             setup_start_handlers(self.tg_app)
+            setup_admin_handlers(self.tg_app)
             setup_message_handlers(self.tg_app)
 
             # Initialize application
@@ -122,6 +134,10 @@ class TeraBoxBot:
             logger.error(f"Error processing update: {e}", exc_info=True)
             return False
 
+        finally:
+            # The loop stops when this update is done, so queued writes can't wait for later
+            await db.writes.flush()
+
     async def shutdown(self):
         """Shutdown bot gracefully"""
         logger.info("🛑 Shutting down bot...")
@@ -142,6 +158,14 @@ class TeraBoxBot:
             await downloader.close_session()
             logger.info("✅ Downloader cleaned up")
 
+            # Close uploader
+            await uploader.close_session()
+            logger.info("✅ Uploader closed")
+
+            # Close thumbnail service
+            await thumbnail_service.close_session()
+            logger.info(f"Media pool: {media_pool.stats()}")
+
             # Disconnect from database
             await db.disconnect()
             logger.info("✅ Database disconnected")
@@ -234,6 +258,21 @@ def server_error(e):
     return jsonify({"error": "Internal server error"}), 500
 
 
+def shutdown_bot():
+    """Shut the bot down at interpreter exit, flushing queued database writes"""
+    if bot_instance is None or not bot_instance.running:
+        return
+    shutdown_loop = loop if loop is not None and not loop.is_closed() else asyncio.new_event_loop()
+    try:
+        shutdown_loop.run_until_complete(bot_instance.shutdown())
+    except Exception as e:
+        logger.error(f"Error shutting down bot at exit: {e}")
+
+
+# Gunicorn workers exit through sys.exit, so this also runs on redeploys
+atexit.register(shutdown_bot)
+
+
 async def init_bot():
     """Initialize bot on startup"""
     try:
@@ -250,6 +289,9 @@ if __name__ == "__main__":
         host = os.getenv("HOST", "0.0.0.0")
         debug = os.getenv("FLASK_DEBUG", "False").lower() == "true"
 
+        # Let SIGTERM exit normally so shutdown_bot runs
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
         # Initialize bot before starting Flask
         asyncio.run(init_bot())
 
@@ -0,0 +1,110 @@
+"""
+Admin command plugin for TeraBox Downloader Bot
+"""
+
+from typing import List, Optional
+
+from telegram import Update
+from telegram.ext import Application, CommandHandler, ContextTypes
+
+import config
+from helpers.bandwidth import bandwidth
+from helpers.logger import get_logger
+
+logger = get_logger("terabox_bot")
+
+BANDWIDTH_USAGE = (
+    "Usage:\n"
+    "/bandwidth - Show limits and active downloads\n"
+    "/bandwidth global <MB/s> - Cap all downloads (0 = unlimited)\n"
+    "/bandwidth user <MB/s> - Default cap per user (0 = unlimited)\n"
+    "/bandwidth user <user_id> <MB/s|default> - Cap one user"
+)
+
+
+def _parse_rate(value: str) -> int:
+    """Convert a MB/s argument to bytes per second"""
+    rate = float(value)
+    if rate < 0:
+        raise ValueError(f"negative rate: {value}")
+    return int(rate * 1024 * 1024)
+
+
+def _format_rate(rate: float) -> str:
+    return f"{rate / (1024 * 1024):.2f} MB/s" if rate > 0 else "unlimited"
+
+
+def _bandwidth_report() -> str:
+    """Current limits and per-download throughput"""
+    stats = bandwidth.stats()
+    lines = [
+        "📶 Bandwidth",
+        f"Global: {_format_rate(stats['global_rate'])}",
+        f"Per user: {_format_rate(stats['user_rate'])}",
+    ]
+    for user_id, rate in bandwidth.user_overrides.items():
+        lines.append(f"User {user_id}: {_format_rate(rate)}")
+    lines.append(f"Waiting chunks: {stats['waiting']}")
+    for flow in stats["flows"]:
+        progress = f"{flow['received'] / (1024 * 1024):.1f} MB"
+        if flow["total"]:
+            progress += f" / {flow['total'] / (1024 * 1024):.1f} MB"
+        lines.append(
+            f"• {flow['name']} (user {flow['user_id']}): {progress}, "
+            f"now {_format_rate(flow['rate'])}, avg {_format_rate(flow['average_rate'])}"
+        )
+    if not stats["flows"]:
+        lines.append("No active downloads")
+    return "\n".join(lines)
+
+
+def _apply_bandwidth(args: List[str]) -> Optional[str]:
+    """Apply a /bandwidth change; returns None if the arguments are invalid"""
+    if len(args) == 2 and args[0] == "global":
+        bandwidth.set_limits(global_rate=_parse_rate(args[1]))
+    elif len(args) == 2 and args[0] == "user":
+        bandwidth.set_limits(user_rate=_parse_rate(args[1]))
+    elif len(args) == 3 and args[0] == "user":
+        rate = None if args[2] == "default" else _parse_rate(args[2])
+        bandwidth.set_user_limit(int(args[1]), rate)
+    else:
+        return None
+    return _bandwidth_report()
+
+
+async def bandwidth_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Handle /bandwidth command (admins only)
+
+    Changes apply to the worker process that handles the command; with
+    several gunicorn workers, set BANDWIDTH_LIMIT/USER_BANDWIDTH_LIMIT for
+    lasting limits.
+    """
+    try:
+        user_id = update.effective_user.id
+        if user_id not in config.ADMIN_IDS:
+            logger.warning(f"User {user_id} tried /bandwidth without being an admin")
+            return
+
+        args = context.args or []
+        try:
+            report = _apply_bandwidth(args) if args else _bandwidth_report()
+        except ValueError:
+            report = None
+        if report is None:
+            await update.message.reply_text(BANDWIDTH_USAGE)
+            return
+
+        if args:
+            logger.info(f"Admin {user_id} changed bandwidth limits: {' '.join(args)}")
+        await update.message.reply_text(report)
+
+    except Exception as e:
+        logger.error(f"Error in bandwidth_command: {e}", exc_info=True)
+        await update.message.reply_text("❌ An error occurred. Please try again.")
+
+
+def setup_admin_handlers(app: Application):
+    """Setup admin command handlers"""
+    app.add_handler(CommandHandler("bandwidth", bandwidth_command))
+    logger.info("✅ Admin handlers registered")
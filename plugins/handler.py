@@ -3,70 +3,325 @@ Unified handler plugin for TeraBox Downloader Bot
 Handles single/multiple links, captions, forwarded messages, and text files
 """
 
-import re
+import asyncio
+import mimetypes
+import shutil
+from functools import partial
 from pathlib import Path
-from typing import Set
+from typing import Any, Dict, List, Optional, Union
 from datetime import datetime
 
 from telegram import Update
 from telegram.ext import Application, MessageHandler, filters, ContextTypes
 
+import config
 from helpers.logger import get_logger
-from helpers.db import db
+from helpers.links import extract_share_ids
+from helpers.media_store import media_store
+from helpers.memory_pool import MemoryFile
+from helpers.metadata import metadata_extractor
+from helpers.thumbnails import thumbnail_service
+from helpers.uploader import uploader
+from helpers.users import user_cache
 
 logger = get_logger("terabox_bot")
 
-# TeraBox link patterns - matches word chars, hyphens, and underscores in share IDs
-TERABOX_PATTERNS = [
-    r"https?://(?:www\.)?terabox\.com/s/[\w\-_]+",
-    r"https?://(?:www\.)?1024terabox\.com/s/[\w\-_]+",
-    r"https?://(?:www\.)?freeterabox\.com/s/[\w\-_]+",
-    r"https?://(?:www\.)?teraboxapp\.com/s/[\w\-_]+",
-    r"https?://(?:www\.)?terashare\.co/s/[\w\-_]+",
-]
 
-
-async def extract_terabox_links(text: str) -> Set[str]:
+async def extract_terabox_links(text: str) -> Dict[str, str]:
     """
     Extract TeraBox links from text
 
+    Links on every mirror domain are canonicalized, so the same share sent
+    as terabox.com, 1024terabox.com or a ?surl= link is processed once.
+
     Args:
         text: Text to extract links from
 
     Returns:
-        Set of unique TeraBox links
+        Mapping of canonical share id to canonical link
+    """
+    return extract_share_ids(text)
+
+
+def is_video(file_name: str) -> bool:
+    """Whether a file should be probed as a video"""
+    mime_type = mimetypes.guess_type(file_name)[0] or ""
+    return config.ENABLE_METADATA_EXTRACTION and mime_type.startswith("video/")
+
+
+async def resolver_thumbnail(share_id: str, thumbnail_url: str) -> Optional[bytes]:
+    """The resolver's thumbnail for a share, resized and cached (None if disabled or unusable)"""
+    if not config.ENABLE_THUMBNAIL_GENERATION:
+        return None
+    return await thumbnail_service.get(share_id, thumbnail_url)
+
+
+async def probe_video(
+    downloaded: Union[MemoryFile, Path],
+    file_name: str,
+    share_id: str,
+    thumbnail_url: str = "",
+    early_probe: Optional[Dict[str, Any]] = None,
+    hashes: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """
+    Get sendVideo parameters (duration, width, height, thumbnail) for a download
+
+    The thumbnail is the resolver's image when it has a usable one; ffmpeg
+    only extracts a frame as a fallback, and that frame is cached for the
+    share too. Metadata from an early sample probe, or recorded in the
+    media store for this share or identical content (hashes), is reused
+    rather than probing again; a stored record skips ffmpeg even without a
+    thumbnail. The result is reused for every chat the video is sent to,
+    so Telegram doesn't have to process the video itself.
+
+    Returns:
+        Parameters to pass to send_video (empty for non-videos or on failure)
+    """
+    if not is_video(file_name):
+        return {}
+
+    thumbnail = await resolver_thumbnail(share_id, thumbnail_url)
+    want_frame = config.ENABLE_THUMBNAIL_GENERATION and thumbnail is None
+
+    media = early_probe if early_probe and early_probe["kind"] == "video" else None
+    stored = None if media else await media_store.get(share_id, hashes, verified=True)
+    if stored:
+        media = stored
+    elif media is None or (want_frame and not media["thumbnail"]):
+        media = await metadata_extractor.probe(downloaded, thumbnail=want_frame) or media
+    if want_frame and media and media["thumbnail"]:
+        thumbnail = media["thumbnail"]
+        thumbnail_service.put(share_id, thumbnail)
+    if media and not stored:
+        # Also records an early probe under the content hashes
+        await media_store.put(share_id, hashes, media)
+
+    params = {}
+    if media:
+        params["duration"] = round(media["duration"]) or None
+        if media["width"] and media["height"]:
+            params["width"] = media["width"]
+            params["height"] = media["height"]
+    if thumbnail:
+        params["thumbnail"] = thumbnail
+    return params
+
+
+async def streamable_copy(downloaded: Union[MemoryFile, Path], file_name: str) -> Optional[Path]:
+    """
+    Faststart copy of a downloaded video whose MP4 index is at the end
+
+    With the index first, clients start playing a supports_streaming video
+    while it loads instead of after. In-memory files are small enough to
+    load quickly and are sent as they are.
+
+    Returns:
+        Path of the copy (remove its directory once sent), or None to send
+        the download itself
+    """
+    if not isinstance(downloaded, Path) or not is_video(file_name):
+        return None
+    return await metadata_extractor.faststart(downloaded)
+
+
+async def probe_remote_video(
+    url: str,
+    file_name: str,
+    mirrors: List[str],
+    share_id: str,
+    size_hint: int,
+    thumbnail_url: str = "",
+    checksums: Optional[Dict[str, str]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Probe a video from its first and last bytes before downloading it
+
+    Lets the pipeline reject files that aren't media and choose document
+    delivery for videos without a video stream before transferring the
+    whole file. The resolver thumbnail is awaited alongside the sample, so
+    ffmpeg only extracts a frame when there is none. A video already in the
+    media store (by share id or the resolver's checksums) isn't sampled.
+
+    Returns:
+        metadata_extractor.probe_sample() result, or None if the video should
+        be probed after downloading instead
+    """
+    from helpers.downloader import downloader
+
+    if not config.EARLY_PROBE_ENABLED or not is_video(file_name) or not metadata_extractor.ffmpeg_available:
+        return None
+    if size_hint < config.EARLY_PROBE_MIN_SIZE:
+        return None
+
+    stored = await media_store.get(share_id, checksums)
+    if stored:
+        return {**stored, "kind": "video"}
+
+    sample, thumbnail = await asyncio.gather(
+        downloader.fetch_sample(url, file_name, mirrors, share_id, size_hint),
+        resolver_thumbnail(share_id, thumbnail_url),
+    )
+    if not sample:
+        return None
+    sample_path, _ = sample
+    try:
+        media = await metadata_extractor.probe_sample(
+            sample_path,
+            config.MEDIA_SAMPLE_HEAD_BYTES,
+            thumbnail=config.ENABLE_THUMBNAIL_GENERATION and thumbnail is None,
+        )
+    finally:
+        sample_path.unlink(missing_ok=True)
+
+    if media and media["kind"] == "video":
+        # Not under the resolver's checksums yet; they are only trusted once the download matches
+        await media_store.put(share_id, None, media)
+    return media
+
+
+async def send_video(
+    bot,
+    chat_id: int,
+    downloaded: Union[MemoryFile, Path],
+    caption: str,
+    video_params: Optional[Dict[str, Any]] = None,
+):
+    """
+    Send a downloaded file as a video
+
+    The uploader streams files from disk, and in-memory files straight from
+    their pooled buffer, so memory use doesn't grow with file size.
+    video_params come from probe_video().
+    """
+    if isinstance(downloaded, MemoryFile):
+        await uploader.send_video(
+            chat_id,
+            downloaded.view,
+            file_name=downloaded.name,
+            caption=caption,
+            parse_mode="Markdown",
+            supports_streaming=True,
+            **(video_params or {})
+        )
+    else:
+        await uploader.send_video(
+            chat_id,
+            downloaded,
+            caption=caption,
+            parse_mode="Markdown",
+            supports_streaming=True,
+            **(video_params or {})
+        )
+
+
+async def send_document(bot, chat_id: int, downloaded: Union[MemoryFile, Path], caption: str):
+    """Send a downloaded file as a document (streamed from disk or its pooled buffer)"""
+    if isinstance(downloaded, MemoryFile):
+        await uploader.send_document(
+            chat_id, downloaded.view, file_name=downloaded.name, caption=caption, parse_mode="Markdown"
+        )
+    else:
+        await uploader.send_document(chat_id, downloaded, caption=caption, parse_mode="Markdown")
+
+
+async def split_video_params(
+    file_name: str,
+    share_id: str,
+    thumbnail_url: str = "",
+    early_probe: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Get sendVideo parameters for the parts of a video too large to send whole
+
+    The parts are sent before the download completes, so only the resolver
+    thumbnail and an early sample probe are used.
+
+    Returns:
+        Parameters for file_splitter.upload(), or None to send raw parts as
+        documents (not a video)
     """
-    if not text:
-        return set()
+    if not is_video(file_name) or (early_probe and early_probe["kind"] != "video"):
+        return None
 
-    links = set()
-    for pattern in TERABOX_PATTERNS:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        links.update(matches)
+    thumbnail = await resolver_thumbnail(share_id, thumbnail_url)
+    params = {}
+    if early_probe:
+        thumbnail = thumbnail or early_probe["thumbnail"]
+        if early_probe["width"] and early_probe["height"]:
+            params["width"] = early_probe["width"]
+            params["height"] = early_probe["height"]
+    if thumbnail:
+        params["thumbnail"] = thumbnail
+    return params
 
-    return links
 
+async def send_split(
+    bot,
+    chat_id: int,
+    watcher,
+    file_name: str,
+    caption: str,
+    user_name: str,
+    video_params: Optional[Dict[str, Any]] = None,
+    duration: float = 0.0,
+) -> int:
+    """
+    Send a file over the upload limit in parts (see FileSplitter)
+
+    With a storage channel the parts are uploaded there, which also stores
+    them, and copied on to the user in part order as each is ready. Without
+    one they are uploaded straight to the user and may arrive out of order
+    (each part is numbered).
+
+    Returns:
+        Number of parts sent
+    """
+    from config import STORE_CHANNEL
+    from helpers.splitter import file_splitter
+
+    if not STORE_CHANNEL:
+        messages = await file_splitter.upload(
+            chat_id, watcher, file_name, caption, video_params=video_params, duration=duration
+        )
+        return len(messages)
+
+    async def deliver(message: Dict[str, Any], label: str):
+        await bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=STORE_CHANNEL,
+            message_id=message["message_id"],
+            caption=f"{caption}\n{label}",
+            parse_mode="Markdown",
+        )
+
+    messages = await file_splitter.upload(
+        STORE_CHANNEL,
+        watcher,
+        file_name,
+        f"{caption}\n👤 User: {user_name}",
+        deliver,
+        video_params,
+        duration,
+    )
+    return len(messages)
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle incoming messages with TeraBox links"""
     from helpers.api_client import api_client
-    from helpers.downloader import downloader
+    from helpers.downloader import downloader, DownloadWatcher, DownloadAbortedError
+    from helpers.splitter import file_splitter
     
     try:
         user_id = update.effective_user.id
         
-        # Ensure user exists
-        user = await db.get_user(user_id)
-        if not user:
-            await db.create_user(
-                user_id,
-                update.effective_user.first_name or "User",
-                update.effective_user.last_name or ""
-            )
-        
-        # Update activity
-        await db.update_user(user_id, last_active_now=True)
+        # Ensure user exists and record activity
+        await user_cache.touch(
+            user_id,
+            update.effective_user.first_name or "User",
+            update.effective_user.last_name or ""
+        )
         
         # Extract links from message
         text = update.message.text or update.message.caption or ""
@@ -88,11 +343,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         # Log action
-        logger.info(f"User {user_id} processing {len(links)} links: {links}")
+        logger.info(f"User {user_id} processing {len(links)} links: {list(links.values())}")
         
         # Process each link
         successful = 0
-        for idx, link in enumerate(links, 1):
+        for idx, (share_id, link) in enumerate(links.items(), 1):
             try:
                 await status_msg.edit_text(
                     f"🔍 Step {idx}/{len(links)}: Resolving...\n`{link}`",
@@ -130,7 +385,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 
                 file_name = file_info.get("file_name", "file")
                 file_size = file_info.get("file_size", "Unknown")
-                download_url = file_info.get("download_link", "")
+                download_url = file_info.get("download_link", "") or file_info.get("proxy_url", "")
                 
                 logger.info(f"File info: {file_name} ({file_size}), URL: {download_url}")
                 
@@ -158,6 +413,27 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     )
                     continue
                 
+                mirrors = [file_info.get("proxy_url", "")]
+                size_hint = file_info.get("size_bytes", 0)
+                thumbnail_url = file_info.get("thumbnail", "")
+                checksums = {"md5": file_info.get("md5", ""), "sha256": file_info.get("sha256", "")}
+
+                # Fetch the resolver thumbnail while the file downloads
+                if config.ENABLE_THUMBNAIL_GENERATION and is_video(file_name):
+                    thumbnail_service.prefetch(share_id, thumbnail_url)
+
+                # Probe large videos from a sample before committing to the full download
+                early_probe = await probe_remote_video(
+                    download_url, file_name, mirrors, share_id, size_hint, thumbnail_url, checksums
+                )
+                if early_probe and early_probe["kind"] == "invalid":
+                    logger.warning(f"Rejected before download, not a readable video: {file_name}")
+                    await status_msg.edit_text(
+                        f"❌ Link {idx}/{len(links)}: {file_name} is not a playable video",
+                        parse_mode="Markdown"
+                    )
+                    continue
+
                 # Update status: Downloading
                 await status_msg.edit_text(
                     f"⬇️ Link {idx}/{len(links)}: Downloading {file_name}...",
@@ -166,10 +442,56 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 
                 logger.info(f"Starting download from: {download_url}")
                 
-                # Download file
-                file_path = await downloader.download(download_url, file_name)
+                caption = f"📥 **{file_name}**\n💾 Size: {file_size}"
+                user_name = update.effective_user.first_name
+
+                # Download file (small files stay in memory); files over the
+                # upload limit are sent in parts while they download
+                watcher = DownloadWatcher() if file_splitter.needs_split(size_hint) else None
+                fetching = asyncio.ensure_future(downloader.fetch(
+                    download_url,
+                    file_name,
+                    share_id=share_id,
+                    size_hint=size_hint,
+                    user_id=user_id,
+                    checksums=checksums,
+                    mirrors=mirrors,
+                    relink=partial(api_client.refresh_link, link),
+                    watcher=watcher,
+                ))
+                parts = 0
+                if watcher:
+                    await status_msg.edit_text(
+                        f"⬇️ Link {idx}/{len(links)}: Downloading and sending {file_name} in parts...",
+                        parse_mode="Markdown"
+                    )
+                    try:
+                        parts = await send_split(
+                            context.bot,
+                            update.effective_chat.id,
+                            watcher,
+                            file_name,
+                            caption,
+                            user_name,
+                            await split_video_params(file_name, share_id, thumbnail_url, early_probe),
+                            early_probe["duration"] if early_probe and early_probe["kind"] == "video" else 0.0,
+                        )
+                    except DownloadAbortedError:
+                        # Reported below if the download failed; split again if it recovered
+                        logger.warning(f"Download of {file_name} restarted while sending parts")
+                    except asyncio.CancelledError:
+                        fetching.cancel()
+                        raise
+                    except Exception:
+                        # Don't keep downloading a file whose parts can't be sent
+                        fetching.cancel()
+                        fetched, = await asyncio.gather(fetching, return_exceptions=True)
+                        if fetched and not isinstance(fetched, BaseException):
+                            downloader.release(fetched)
+                        raise
+                downloaded = await fetching
                 
-                if not file_path:
+                if not downloaded:
                     logger.error(f"Download failed: {file_name}")
                     
                     # Send error to ERROR_CHANNEL
@@ -193,40 +515,91 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     )
                     continue
                 
-                logger.info(f"Downloaded successfully: {file_path}")
+                logger.info(f"Downloaded successfully: {file_name}")
                 
-                # Send file to user as video
-                try:
-                    await update.message.reply_video(
-                        video=open(file_path, "rb"),
-                        caption=f"📥 **{file_name}**\n💾 Size: {file_size}",
-                        parse_mode="Markdown",
-                        supports_streaming=True
-                    )
-                except Exception as e:
-                    logger.warning(f"Failed to send as video, trying as document: {e}")
-                    # Fallback to document if video fails
-                    await update.message.reply_document(
-                        document=open(file_path, "rb"),
-                        caption=f"📥 **{file_name}**\n💾 Size: {file_size}",
+                if parts or (
+                    isinstance(downloaded, Path) and file_splitter.needs_split(downloaded.stat().st_size)
+                ):
+                    try:
+                        if not parts:
+                            # Bigger than the resolver said, or the split was interrupted
+                            watcher = DownloadWatcher()
+                            watcher.finish(downloaded)
+                            parts = await send_split(
+                                context.bot,
+                                update.effective_chat.id,
+                                watcher,
+                                file_name,
+                                caption,
+                                user_name,
+                                await split_video_params(file_name, share_id, thumbnail_url, early_probe),
+                            )
+                    finally:
+                        downloader.release(downloaded)
+
+                    await status_msg.edit_text(
+                        f"✅ Link {idx}/{len(links)}: {file_name} sent in {parts} parts!",
                         parse_mode="Markdown"
                     )
-                
-                # Send to storage channel
-                from config import STORE_CHANNEL
-                if STORE_CHANNEL and STORE_CHANNEL != 0:
+                    successful += 1
+                    logger.info(f"Successfully processed in {parts} parts: {file_name}")
+                    continue
+
+                remuxed = None
+                try:
+                    # Send file to user as video
+                    as_document = bool(early_probe) and early_probe["kind"] == "other"
+                    video_params = {}
+                    if not as_document:
+                        # The faststart remux runs alongside probing, in the same media pool;
+                        # both finish (or clean up) before either failure is handled
+                        probed, copied = await asyncio.gather(
+                            probe_video(
+                                downloaded,
+                                file_name,
+                                share_id,
+                                thumbnail_url,
+                                early_probe,
+                                downloader.content_hashes(downloaded),
+                            ),
+                            streamable_copy(downloaded, file_name),
+                            return_exceptions=True,
+                        )
+                        if isinstance(copied, BaseException):
+                            logger.warning(f"Faststart remux failed, sending {file_name} as is: {copied}")
+                        else:
+                            remuxed = copied
+                        if isinstance(probed, BaseException):
+                            raise probed
+                        video_params = probed
+                    send = send_document if as_document else partial(send_video, video_params=video_params)
+                    upload = remuxed or downloaded
                     try:
-                        with open(file_path, "rb") as video_file:
-                            await context.bot.send_video(
-                                chat_id=STORE_CHANNEL,
-                                video=video_file,
-                                caption=f"📥 **{file_name}**\n💾 Size: {file_size}\n👤 User: {update.effective_user.first_name}",
-                                parse_mode="Markdown",
-                                supports_streaming=True
-                            )
-                        logger.info(f"Sent to storage channel: {file_name}")
+                        await send(context.bot, update.effective_chat.id, upload, caption)
                     except Exception as e:
-                        logger.error(f"Failed to send to storage channel: {e}")
+                        if as_document:
+                            raise
+                        logger.warning(f"Failed to send as video, trying as document: {e}")
+                        # Fallback to document if video fails
+                        await send_document(context.bot, update.effective_chat.id, upload, caption)
+                    
+                    # Send to storage channel
+                    from config import STORE_CHANNEL
+                    if STORE_CHANNEL and STORE_CHANNEL != 0:
+                        try:
+                            await send(
+                                context.bot,
+                                STORE_CHANNEL,
+                                upload,
+                                f"{caption}\n👤 User: {user_name}",
+                            )
+                            logger.info(f"Sent to storage channel: {file_name}")
+                        except Exception as e:
+                            logger.error(f"Failed to send to storage channel: {e}")
+                finally:
+                    downloader.release(downloaded)
+                    if remuxed:
+                        shutil.rmtree(remuxed.parent, ignore_errors=True)
                 
                 # Update status
                 await status_msg.edit_text(
@@ -7,6 +7,7 @@ from telegram.ext import Application, CommandHandler, ContextTypes
 
 from helpers.logger import get_logger
 from helpers.db import db
+from helpers.users import user_cache
 
 logger = get_logger("terabox_bot")
 
@@ -18,12 +19,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         first_name = update.effective_user.first_name or "User"
         last_name = update.effective_user.last_name or ""
 
-        # Get or create user
-        user = await db.get_user(user_id)
-        if not user:
-            await db.create_user(user_id, first_name, last_name)
-        else:
-            await db.update_user(user_id, last_active_now=True)
+        # Create or refresh user
+        await user_cache.touch(user_id, first_name, last_name)
 
         logger.info(f"User {user_id} executed /start command")
 
@@ -0,0 +1,181 @@
+"""
+Benchmark helpers for TeraBox Downloader Bot
+Local stand-in servers and timing utilities shared by the bench_*.py scripts
+
+Each benchmark takes --root to measure another checkout of the bot, e.g. one
+made with `git worktree add /tmp/before <commit>`, so a change can be
+compared against the tree before it.
+"""
+
+import argparse
+import asyncio
+import re
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RANGE_PATTERN = re.compile(r"bytes=(\d+)-(\d*)")
+BLOCK_SIZE = 64 * 1024
+
+
+def parser(description: str) -> argparse.ArgumentParser:
+    """Argument parser with the --root option every benchmark takes"""
+    args = argparse.ArgumentParser(description=description)
+    args.add_argument(
+        "--root", type=Path, default=REPO_ROOT,
+        help="checkout of the bot to benchmark (default: this one)",
+    )
+    return args
+
+
+def use_root(root: Path):
+    """Import config and helpers from the given checkout"""
+    sys.path.insert(0, str(Path(root).resolve()))
+
+
+class RangeServer:
+    """
+    A CDN stand-in serving one blob over HTTP with Range support
+
+    Every connection is capped at rate bytes/s, like a throttled CDN edge.
+    With throttle_nth, that connection only gets a quarter of the rate.
+    """
+
+    def __init__(
+        self,
+        data: bytes,
+        rate: float = 1e12,
+        ranges: bool = True,
+        throttle_nth: Optional[int] = None,
+    ):
+        self.data = data
+        self.rate = rate
+        self.ranges = ranges
+        self.throttle_nth = throttle_nth
+        self.connections = 0
+        self.server: Optional[TestServer] = None
+
+        self.app = web.Application()
+        self.app.router.add_route("*", "/file", self.handle)
+
+    @property
+    def url(self) -> str:
+        return str(self.server.make_url("/file"))
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        self.connections += 1
+        rate = self.rate / 4 if self.connections == self.throttle_nth else self.rate
+
+        start, end = 0, len(self.data) - 1
+        status = 200
+        match = RANGE_PATTERN.match(request.headers.get("Range", ""))
+        if match and self.ranges:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else end
+            status = 206
+
+        headers = {"Content-Length": str(end - start + 1)}
+        if self.ranges:
+            headers["Accept-Ranges"] = "bytes"
+        if status == 206:
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(self.data)}"
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(self.data))
+            return web.Response(status=200, headers=headers)
+
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        view = memoryview(self.data)
+        position = start
+        while position <= end:
+            chunk = view[position:min(end + 1, position + BLOCK_SIZE)]
+            await response.write(chunk)
+            position += len(chunk)
+            if rate < 1e12:
+                await asyncio.sleep(len(chunk) / rate)
+        await response.write_eof()
+        return response
+
+    async def __aenter__(self):
+        self.server = TestServer(self.app)
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.server.close()
+
+
+class BotAPIServer:
+    """A Bot API stand-in that drains multipart uploads and counts the bytes"""
+
+    def __init__(self):
+        self.received = 0
+        self.server: Optional[TestServer] = None
+
+        self.app = web.Application(client_max_size=1 << 40)
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+
+    @property
+    def url(self) -> str:
+        return str(self.server.make_url("")).rstrip("/")
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if request.match_info["method"] == "getMe":
+            return web.json_response({
+                "ok": True,
+                "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"},
+            })
+
+        reader = await request.multipart()
+        received = 0
+        while True:
+            part = await reader.next()
+            if part is None:
+                break
+            if part.filename:
+                while True:
+                    chunk = await part.read_chunk(1 << 20)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+            else:
+                await part.read()
+        self.received += received
+        return web.json_response({
+            "ok": True,
+            "result": {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": 1, "type": "private"},
+                "video": {
+                    "file_id": "video", "file_unique_id": "video",
+                    "width": 0, "height": 0, "duration": 0, "file_size": received,
+                },
+            },
+        })
+
+    async def __aenter__(self):
+        self.server = TestServer(self.app)
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.server.close()
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """The given percentile of a list of samples"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def release(downloader, path: Path):
+    """Free a download, on trees with or without FileDownloader.release()"""
+    if hasattr(downloader, "release"):
+        downloader.release(path)
+    else:
+        path.unlink(missing_ok=True)
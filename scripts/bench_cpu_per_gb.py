@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Download CPU benchmark for TeraBox Downloader Bot
+Downloads from a stand-in CDN running in a separate process and reports the
+downloading process's CPU seconds, page faults and progress callbacks per GB
+
+    python scripts/bench_cpu_per_gb.py --size-mb 512 --rounds 4 --checksums none
+
+Use --checksums none to compare against trees from before downloads were
+hashed, since hashing roughly doubles the CPU per GB.
+"""
+
+import asyncio
+import logging
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench_common import RangeServer, parser, release, use_root
+
+
+async def serve(size_mb: int):
+    """Run the stand-in CDN and print its URL for the parent"""
+    data = bytes(range(256)) * (size_mb * 4096)
+    async with RangeServer(data) as server:
+        print(server.url, flush=True)
+        await asyncio.Event().wait()
+
+
+async def measure(label: str, url: str, rounds: int):
+    """Download the file rounds times and print the cost per GB"""
+    from helpers.downloader import FileDownloader
+
+    callbacks = 0
+
+    async def on_progress(percentage, downloaded, total):
+        nonlocal callbacks
+        callbacks += 1
+
+    downloader = FileDownloader()
+    total = 0
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.monotonic()
+    for i in range(rounds):
+        path = await downloader.download(url, f"cpu{i}.bin", progress_callback=on_progress)
+        total += path.stat().st_size
+        release(downloader, path)
+    wall = time.monotonic() - started
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    await downloader.close_session()
+
+    gb = total / 2 ** 30
+    user = (after.ru_utime - before.ru_utime) / gb
+    system = (after.ru_stime - before.ru_stime) / gb
+    print(
+        f"{label:10s} {gb:.1f}GB in {wall:.1f}s, cpu {user + system:.2f}s/GB "
+        f"(user {user:.2f} sys {system:.2f}), "
+        f"minor faults {(after.ru_minflt - before.ru_minflt) / gb:.0f}/GB, "
+        f"progress callbacks {callbacks}"
+    )
+
+
+async def main():
+    args = parser(__doc__)
+    args.add_argument("--size-mb", type=int, default=512, help="size of the served file")
+    args.add_argument("--rounds", type=int, default=4, help="downloads per mode")
+    args.add_argument("--checksums", help="comma-separated CHECKSUM_ALGORITHMS, or none")
+    args.add_argument("--serve", action="store_true", help="run only the stand-in CDN")
+    options = args.parse_args()
+
+    if options.serve:
+        await serve(options.size_mb)
+        return
+
+    use_root(options.root)
+    import config
+    config.DOWNLOAD_DIR = Path(tempfile.mkdtemp(prefix="bench_cpu_"))
+    config.MEMORY_FAST_PATH_SIZE = 0
+    config.SIZE_LIMIT_CHANNEL_MB = 10 ** 6
+    config.DISK_BUDGET_BYTES = 10 ** 12
+    if options.checksums:
+        config.CHECKSUM_ALGORITHMS = [
+            name for name in options.checksums.split(",") if name and name != "none"
+        ]
+    logging.disable(logging.INFO)
+
+    # The server gets its own process so its CPU time isn't counted
+    server = await asyncio.create_subprocess_exec(
+        sys.executable, __file__, "--serve", "--size-mb", str(options.size_mb),
+        stdout=asyncio.subprocess.PIPE,
+    )
+    try:
+        url = (await server.stdout.readline()).decode().strip()
+        for segmented in (False, True):
+            config.SEGMENTED_DOWNLOADS = segmented
+            await measure("segmented" if segmented else "single", url, options.rounds)
+    finally:
+        server.terminate()
+        await server.wait()
+        shutil.rmtree(config.DOWNLOAD_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
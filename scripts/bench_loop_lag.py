@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Event loop lag benchmark for TeraBox Downloader Bot
+Runs concurrent downloads from a local stand-in CDN onto a simulated slow
+disk while a ticker measures how late the event loop wakes it up
+
+    python scripts/bench_loop_lag.py --downloads 10 --size-mb 64 --disk-ms-per-mb 5
+"""
+
+import asyncio
+import builtins
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from bench_common import RangeServer, parser, percentile, release, use_root
+
+TICK = 0.005
+
+
+class SlowFile:
+    """A file whose writes block like a contended disk"""
+
+    def __init__(self, file, delay_per_mb: float):
+        self.file = file
+        self.delay_per_mb = delay_per_mb
+
+    def write(self, data) -> int:
+        time.sleep(self.delay_per_mb * len(data) / 1048576)
+        return self.file.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def slow_disk(delay_per_mb: float):
+    """Make every download write block for delay_per_mb seconds per MB"""
+    import helpers.downloader
+
+    pwrite = os.pwrite
+
+    def slow_pwrite(fd, data, offset):
+        time.sleep(delay_per_mb * len(data) / 1048576)
+        return pwrite(fd, data, offset)
+
+    os.pwrite = slow_pwrite
+    # Trees that write with open()/f.write() on the event loop
+    helpers.downloader.open = lambda *args, **kwargs: SlowFile(builtins.open(*args, **kwargs), delay_per_mb)
+
+
+async def main():
+    args = parser(__doc__)
+    args.add_argument("--downloads", type=int, default=10, help="concurrent downloads")
+    args.add_argument("--size-mb", type=int, default=64, help="size of each download")
+    args.add_argument("--disk-ms-per-mb", type=float, default=5, help="simulated write cost")
+    options = args.parse_args()
+    use_root(options.root)
+
+    import config
+    config.DOWNLOAD_DIR = Path(tempfile.mkdtemp(prefix="bench_lag_"))
+    config.SEGMENTED_DOWNLOADS = False
+    config.MEMORY_FAST_PATH_SIZE = 0
+    config.SIZE_LIMIT_CHANNEL_MB = 10 ** 6
+    logging.disable(logging.INFO)
+    from helpers.downloader import FileDownloader
+
+    if options.disk_ms_per_mb:
+        slow_disk(options.disk_ms_per_mb / 1000)
+
+    data = os.urandom(options.size_mb * 1024 * 1024)
+    lags = []
+    stopped = asyncio.Event()
+
+    async def ticker():
+        while not stopped.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - started - TICK)
+
+    try:
+        async with RangeServer(data) as server:
+            downloader = FileDownloader()
+            ticking = asyncio.ensure_future(ticker())
+            started = time.monotonic()
+            paths = await asyncio.gather(*[
+                downloader.download(server.url, f"lag{i}.bin") for i in range(options.downloads)
+            ])
+            elapsed = time.monotonic() - started
+            stopped.set()
+            await ticking
+            for path in paths:
+                if path:
+                    release(downloader, path)
+            await downloader.close_session()
+    finally:
+        shutil.rmtree(config.DOWNLOAD_DIR, ignore_errors=True)
+
+    print(
+        f"{options.downloads} x {options.size_mb}MB, {options.disk_ms_per_mb}ms/MB disk: "
+        f"{elapsed:.2f}s, completed {sum(1 for p in paths if p)}/{options.downloads}, "
+        f"loop lag p50 {percentile(lags, 0.5) * 1000:.1f}ms "
+        f"p99 {percentile(lags, 0.99) * 1000:.1f}ms max {max(lags) * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Range download benchmark for TeraBox Downloader Bot
+Times single-stream and segmented downloads from a local stand-in CDN whose
+connections are each capped at a fixed bandwidth
+
+    python scripts/bench_range_download.py --size-mb 32 --rate-mb 2
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from bench_common import RangeServer, parser, release, use_root
+
+
+async def run(label: str, data: bytes, rate: float, segmented: bool, **server_options):
+    """Download the blob once and print throughput and connection count"""
+    import config
+    from helpers.downloader import FileDownloader
+
+    config.SEGMENTED_DOWNLOADS = segmented
+    expected = hashlib.md5(data).hexdigest()
+
+    async with RangeServer(data, rate=rate, **server_options) as server:
+        downloader = FileDownloader()
+        started = time.monotonic()
+        path = await downloader.download(server.url, f"{label.replace(' ', '_')}.bin")
+        elapsed = time.monotonic() - started
+        intact = bool(path) and hashlib.md5(path.read_bytes()).hexdigest() == expected
+        if path:
+            release(downloader, path)
+        await downloader.close_session()
+
+    print(
+        f"{label:32s} {elapsed:6.2f}s {len(data) / elapsed / 1e6:7.1f} MB/s "
+        f"connections {server.connections:3d} intact {intact}"
+    )
+
+
+async def main():
+    args = parser(__doc__)
+    args.add_argument("--size-mb", type=int, default=32, help="size of the served file")
+    args.add_argument("--rate-mb", type=float, default=2, help="per-connection cap in MB/s")
+    options = args.parse_args()
+    use_root(options.root)
+
+    import config
+    config.DOWNLOAD_DIR = Path(tempfile.mkdtemp(prefix="bench_range_"))
+    config.SEGMENT_MIN_SIZE = 1024 * 1024
+    config.MEMORY_FAST_PATH_SIZE = 0
+    config.SIZE_LIMIT_CHANNEL_MB = 10 ** 6
+    logging.disable(logging.INFO)
+
+    data = os.urandom(options.size_mb * 1024 * 1024)
+    rate = options.rate_mb * 1024 * 1024
+    print(f"{options.size_mb}MB file, {options.rate_mb}MB/s per connection")
+
+    try:
+        await run("single stream", data, rate, segmented=False)
+        await run("segmented", data, rate, segmented=True)
+        await run("segmented, one slow connection", data, rate, segmented=True, throttle_nth=2)
+        await run("segmented, no Range support", data, rate, segmented=True, ranges=False)
+    finally:
+        shutil.rmtree(config.DOWNLOAD_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
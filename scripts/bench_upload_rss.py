@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Upload memory benchmark for TeraBox Downloader Bot
+Uploads a large local file to a stand-in Bot API server and reports the
+uploading process's peak RSS, for the streaming uploader and for
+python-telegram-bot's send_video (which reads the whole file first)
+
+    python scripts/bench_upload_rss.py --size-mb 1024
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+from pathlib import Path
+
+from bench_common import BotAPIServer, parser, use_root
+
+MODES = ("streamed", "telegram")
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def upload(mode: str, api_url: str, path: Path, warmup: Path):
+    """Upload warmup then path in this process and print the peak RSS growth"""
+    import config
+    config.TELEGRAM_API_URL = api_url
+
+    if mode == "streamed":
+        from helpers.uploader import TelegramUploader
+
+        uploader = TelegramUploader()
+        await uploader.send_video(1, warmup, caption="warmup")
+        before = peak_rss_mb()
+        await uploader.send_video(1, path, caption="bench", supports_streaming=True)
+        await uploader.close_session()
+    else:
+        from telegram import Bot
+        from telegram.request import HTTPXRequest
+
+        request = HTTPXRequest(read_timeout=600, write_timeout=600)
+        async with Bot(config.BOT_TOKEN, base_url=f"{api_url}/bot", request=request) as bot:
+            with open(warmup, "rb") as f:
+                await bot.send_video(1, video=f, caption="warmup")
+            before = peak_rss_mb()
+            with open(path, "rb") as f:
+                await bot.send_video(1, video=f, caption="bench", supports_streaming=True)
+
+    after = peak_rss_mb()
+    print(f"{mode:10s} peak RSS {before:7.0f}MB -> {after:7.0f}MB (+{after - before:.0f}MB)")
+
+
+async def main():
+    args = parser(__doc__)
+    args.add_argument("--size-mb", type=int, default=1024, help="size of the uploaded file")
+    args.add_argument("--mode", choices=MODES, help="run one upload in this process")
+    args.add_argument("--api-url", help=argparse.SUPPRESS)
+    args.add_argument("--file", type=Path, help=argparse.SUPPRESS)
+    options = args.parse_args()
+    use_root(options.root)
+
+    if options.mode:
+        await upload(options.mode, options.api_url, options.file, options.file.with_suffix(".warmup.mp4"))
+        return
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench_upload_"))
+    path = workdir / "bench.mp4"
+    with open(path, "wb") as f:
+        for _ in range(options.size_mb):
+            f.write(os.urandom(1 << 20))
+    path.with_suffix(".warmup.mp4").write_bytes(os.urandom(1 << 16))
+
+    print(f"{options.size_mb}MB upload")
+    try:
+        async with BotAPIServer() as server:
+            for mode in MODES:
+                # A fresh process per mode so each peak RSS is its own
+                child = await asyncio.create_subprocess_exec(
+                    sys.executable, __file__, "--root", str(options.root), "--mode", mode,
+                    "--api-url", server.url, "--file", str(path),
+                )
+                await child.wait()
+                print(f"{'':10s} server received {server.received / 2 ** 20:.0f}MB")
+                server.received = 0
+    finally:
+        for leftover in workdir.iterdir():
+            leftover.unlink()
+        workdir.rmdir()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
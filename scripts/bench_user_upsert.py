@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+User recording benchmark for TeraBox Downloader Bot
+Times the database work each update does to record its user, against a
+stand-in users collection with a fixed round trip time or a real MongoDB
+
+    python scripts/bench_user_upsert.py --users 20 --messages 10 --rtt-ms 5
+    python scripts/bench_user_upsert.py --mongodb-uri mongodb://localhost:27017
+
+Trees without helpers/users.py are measured with the handlers' old
+get_user/create_user/update_user sequence.
+"""
+
+import asyncio
+import copy
+import logging
+import time
+from types import SimpleNamespace
+from typing import Any, Dict
+
+from bench_common import parser, percentile, use_root
+
+
+class StandInCollection:
+    """The subset of a motor collection the user path uses, with a fixed round trip time"""
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.docs: Dict[int, Dict[str, Any]] = {}
+        self.round_trips = 0
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        await asyncio.sleep(self.rtt)
+
+    async def find_one(self, query):
+        await self._round_trip()
+        return copy.deepcopy(self.docs.get(query["user_id"]))
+
+    async def insert_one(self, doc):
+        await self._round_trip()
+        self.docs[doc["user_id"]] = dict(doc)
+        return SimpleNamespace(inserted_id=doc["user_id"])
+
+    async def update_one(self, query, update, upsert=False):
+        await self._round_trip()
+        doc = self.docs.get(query["user_id"])
+        if doc is None:
+            if not upsert:
+                return SimpleNamespace(modified_count=0)
+            doc = self.docs[query["user_id"]] = {"user_id": query["user_id"], **update.get("$setOnInsert", {})}
+        doc.update(update.get("$set", {}))
+        for key, value in update.get("$max", {}).items():
+            doc[key] = max(doc.get(key, value), value)
+        for key in update.get("$unset", {}):
+            doc.pop(key, None)
+        return SimpleNamespace(modified_count=1)
+
+
+async def run(label: str, record, collection, users: int, messages: int):
+    """Record every user's burst of messages and print the per-update latency"""
+    from helpers.db import db
+
+    db.users_collection = collection
+    round_trips = getattr(collection, "round_trips", 0)
+    latencies = []
+    for user_id in range(users):
+        for _ in range(messages):
+            started = time.perf_counter()
+            await record(user_id)
+            latencies.append(time.perf_counter() - started)
+
+    updates = len(latencies)
+    line = (
+        f"{label:26s} mean {sum(latencies) / updates * 1000:6.2f}ms "
+        f"p50 {percentile(latencies, 0.5) * 1000:6.2f}ms p95 {percentile(latencies, 0.95) * 1000:6.2f}ms"
+    )
+    if hasattr(collection, "round_trips"):
+        line += f" round trips {(collection.round_trips - round_trips) / updates:.2f}/update"
+    print(line)
+
+
+async def main():
+    args = parser(__doc__)
+    args.add_argument("--users", type=int, default=20, help="distinct users")
+    args.add_argument("--messages", type=int, default=10, help="back-to-back messages per user")
+    args.add_argument("--rtt-ms", type=float, default=5, help="stand-in round trip time")
+    args.add_argument("--mongodb-uri", help="benchmark a real MongoDB (uses a scratch database)")
+    options = args.parse_args()
+    use_root(options.root)
+    logging.disable(logging.INFO)
+
+    from helpers.db import db
+
+    client = None
+    if options.mongodb_uri:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(options.mongodb_uri)
+        database = client["terabox_bot_bench"]
+
+        def fresh_collection():
+            return database[f"users_{time.monotonic_ns()}"]
+    else:
+        def fresh_collection():
+            return StandInCollection(options.rtt_ms / 1000)
+
+    async def legacy(user_id: int):
+        # What handle_message/start_command did before the upsert
+        if not await db.get_user(user_id):
+            await db.create_user(user_id, "Bench", "User")
+        await db.update_user(user_id, last_active_now=True)
+
+    try:
+        workload = (options.users, options.messages)
+        try:
+            from helpers.users import UserCache
+        except ImportError:
+            await run("get/create/update", legacy, fresh_collection(), *workload)
+        else:
+            await run("upsert, no cache", lambda user_id: db.upsert_user(user_id, "Bench", "User"),
+                      fresh_collection(), *workload)
+            cache = UserCache()
+            await run(f"upsert + cache ({cache.ttl:g}s)", lambda user_id: cache.touch(user_id, "Bench", "User"),
+                      fresh_collection(), *workload)
+    finally:
+        if client:
+            await client.drop_database("terabox_bot_bench")
+            client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
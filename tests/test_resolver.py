@@ -0,0 +1,223 @@
+"""
+Resolver tests for TeraBox Downloader Bot
+Runs TeraBoxAPI against local stand-in resolvers with injected latency and failures
+"""
+
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import config
+from helpers.api_client import ResolverController, TeraBoxAPI
+
+LINK = "https://www.terabox.com/s/1abcdef"
+
+
+class StandInResolver:
+    """A local resolver endpoint whose latency and status can be changed mid-test"""
+
+    def __init__(self, name: str, latency: float = 0.0, status: int = 200, headers=None):
+        self.name = name
+        self.latency = latency
+        self.status = status
+        self.headers = headers or {}
+        self.hits = 0
+        self.cancelled = 0
+        self.server = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/api", self.handle)
+
+    @property
+    def url(self) -> str:
+        return str(self.server.make_url("/api"))
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.hits += 1
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            # The client dropped the connection (a cancelled hedge)
+            self.cancelled += 1
+            raise
+        if self.status != 200:
+            return web.Response(status=self.status, headers=self.headers)
+        return web.json_response({
+            "status": "✅ Successfully",
+            "file_name": "video.mp4",
+            "size_bytes": 1024,
+            "download_link": f"https://cdn.example/{self.name}",
+        })
+
+    async def __aenter__(self):
+        self.server = TestServer(self.app)
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.server.close()
+
+
+def run(coro):
+    """Run a test coroutine on a fresh event loop"""
+    return asyncio.run(coro)
+
+
+@pytest.fixture(autouse=True)
+def resolver_config(monkeypatch):
+    """Single attempts and a long default hedge delay unless a test lowers it"""
+    monkeypatch.setattr(config, "MAX_RETRIES", 1)
+    monkeypatch.setattr(config, "HEDGE_DEFAULT_DELAY", 5.0)
+
+
+def test_prefers_fastest_backend():
+    async def scenario():
+        async with StandInResolver("slow", latency=0.2) as slow, StandInResolver("fast") as fast:
+            api = TeraBoxAPI([slow.url, fast.url])
+            try:
+                for _ in range(4):
+                    assert await api.resolve_link(LINK, fresh=True)
+            finally:
+                await api.close_session()
+            # Each untried backend gets one request, then the faster one wins
+            assert (slow.hits, fast.hits) == (1, 3)
+
+    run(scenario())
+
+
+def test_hedges_slow_primary_and_cancels_loser(monkeypatch):
+    monkeypatch.setattr(config, "HEDGE_DEFAULT_DELAY", 0.1)
+
+    async def scenario():
+        async with StandInResolver("stalled", latency=5) as stalled, StandInResolver("spare") as spare:
+            api = TeraBoxAPI([stalled.url, spare.url])
+            try:
+                started = time.monotonic()
+                result = await api.resolve_link(LINK)
+                elapsed = time.monotonic() - started
+                await asyncio.sleep(0.1)
+            finally:
+                await api.close_session()
+
+            assert result["download_link"] == "https://cdn.example/spare"
+            assert elapsed < 1
+            assert stalled.cancelled == 1
+            primary = api.backends[0]
+            assert primary.controller.in_flight == 0
+            # A cancelled hedge isn't held against the backend's success rate
+            assert primary.success_ewma == 1.0
+
+    run(scenario())
+
+
+def test_fails_over_on_server_error():
+    async def scenario():
+        async with StandInResolver("broken", status=503) as broken, StandInResolver("spare") as spare:
+            api = TeraBoxAPI([broken.url, spare.url])
+            try:
+                result = await api.resolve_link(LINK)
+            finally:
+                await api.close_session()
+
+            assert result["download_link"] == "https://cdn.example/spare"
+            assert broken.hits == 1
+            assert api.backends[0].controller.consecutive_failures == 1
+
+    run(scenario())
+
+
+def test_circuit_opens_and_fails_fast():
+    async def scenario():
+        async with StandInResolver("broken", status=502) as broken:
+            api = TeraBoxAPI([broken.url])
+            api.backends[0].controller = ResolverController(failure_threshold=2, reset_timeout=60)
+            try:
+                assert await api.resolve_link(LINK, fresh=True) is None
+                assert await api.resolve_link(LINK, fresh=True) is None
+                assert api.backends[0].controller.state == ResolverController.OPEN
+
+                assert await api.resolve_link(LINK, fresh=True) is None
+            finally:
+                await api.close_session()
+            assert broken.hits == 2
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_throttling_and_server_errors_halve_limit(status):
+    async def scenario():
+        async with StandInResolver("busy", status=status) as busy:
+            api = TeraBoxAPI([busy.url])
+            controller = api.backends[0].controller = ResolverController(min_limit=1, max_limit=16)
+            try:
+                assert await api.resolve_link(LINK) is None
+            finally:
+                await api.close_session()
+            assert controller.limit == 8
+            assert controller.consecutive_failures == 1
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("retry_after", ["3600", "Fri, 31 Dec 2100 23:59:59 GMT"])
+def test_long_retry_after_is_capped_and_fails_fast(monkeypatch, retry_after):
+    monkeypatch.setattr(config, "MAX_RETRIES", 2)
+    monkeypatch.setattr(config, "RESOLVER_MAX_RETRY_AFTER", 30)
+
+    async def scenario():
+        async with StandInResolver("busy", status=429, headers={"Retry-After": retry_after}) as busy:
+            api = TeraBoxAPI([busy.url])
+            controller = api.backends[0].controller = ResolverController(max_wait=5)
+            try:
+                started = time.monotonic()
+                assert await api.resolve_link(LINK) is None
+                assert await api.resolve_link(LINK, fresh=True) is None
+                elapsed = time.monotonic() - started
+            finally:
+                await api.close_session()
+            # Blocked for the capped time, and callers fail fast instead of sleeping
+            assert elapsed < 1
+            assert busy.hits == 1
+            assert 25 < controller.blocked_until - time.monotonic() <= 30
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("status", [403, 404])
+def test_rejected_link_leaves_backend_alone(status):
+    async def scenario():
+        async with StandInResolver("picky", status=status) as picky:
+            api = TeraBoxAPI([picky.url])
+            controller = api.backends[0].controller = ResolverController(min_limit=1, max_limit=16)
+            try:
+                assert await api.resolve_link(LINK) is None
+            finally:
+                await api.close_session()
+            assert controller.limit == 16
+            assert controller.consecutive_failures == 0
+            assert api.backends[0].success_ewma == 1.0
+
+    run(scenario())
+
+
+def test_cancelled_waiter_passes_on_its_slot():
+    async def scenario():
+        controller = ResolverController(min_limit=1, max_limit=1)
+        await controller.acquire()
+        first = asyncio.ensure_future(controller.acquire())
+        second = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+
+        # first is woken for the freed slot but cancelled before it runs
+        controller.release(0.01, ResolverController.SUCCESS)
+        first.cancel()
+        await asyncio.wait_for(second, 1)
+
+        assert first.cancelled()
+        assert controller.in_flight == 1
+
+    run(scenario())
@@ -0,0 +1,102 @@
+"""
+Uploader tests for TeraBox Downloader Bot
+Uploads a large file to a local stand-in Bot API server and checks the
+uploading process's peak RSS stays flat
+"""
+
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FILE_SIZE = 256 * 1024 * 1024
+# Allowance for allocator noise; reading the file into memory would add FILE_SIZE
+MAX_RSS_GROWTH = 32 * 1024 * 1024
+
+# Runs in a fresh process so its peak RSS reflects only this upload
+UPLOAD_SCRIPT = """
+import asyncio, json, resource, sys
+from pathlib import Path
+sys.path.insert(0, sys.argv[1])
+import config
+config.TELEGRAM_API_URL = sys.argv[2]
+from helpers.uploader import TelegramUploader
+
+def peak():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+async def main():
+    path, size = Path(sys.argv[3]), int(sys.argv[4])
+    byte_range = (0, size) if sys.argv[5] == "range" else None
+    uploader = TelegramUploader()
+    await uploader.send_video(1, path.with_suffix(".warmup"), file_name="warmup.mp4")
+    before = peak()
+    await uploader.send_video(1, path, byte_range=byte_range, caption="test")
+    await uploader.close_session()
+    print(json.dumps({"before": before, "after": peak()}))
+
+asyncio.run(main())
+"""
+
+
+class StandInBotAPI:
+    """A Bot API server that drains multipart uploads and counts file bytes"""
+
+    def __init__(self):
+        self.received = 0
+        self.app = web.Application(client_max_size=1 << 40)
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        reader = await request.multipart()
+        while True:
+            part = await reader.next()
+            if part is None:
+                break
+            while True:
+                chunk = await part.read_chunk(1 << 20)
+                if not chunk:
+                    break
+                if part.filename:
+                    self.received += len(chunk)
+        return web.json_response({"ok": True, "result": {"message_id": 1}})
+
+
+@pytest.fixture(scope="module")
+def large_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp("upload") / "large.mp4"
+    with open(path, "wb") as f:
+        for _ in range(FILE_SIZE // (1 << 20)):
+            f.write(os.urandom(1 << 20))
+    path.with_suffix(".warmup").write_bytes(os.urandom(1 << 16))
+    return path
+
+
+@pytest.mark.parametrize("mode", ["file", "range"])
+def test_upload_keeps_peak_rss_flat(large_file, mode):
+    async def scenario():
+        api = StandInBotAPI()
+        server = TestServer(api.app)
+        await server.start_server()
+        try:
+            child = await asyncio.create_subprocess_exec(
+                sys.executable, "-c", UPLOAD_SCRIPT,
+                str(REPO_ROOT), str(server.make_url("")).rstrip("/"), str(large_file), str(FILE_SIZE), mode,
+                stdout=asyncio.subprocess.PIPE,
+            )
+            output, _ = await child.communicate()
+        finally:
+            await server.close()
+        assert child.returncode == 0
+        return api.received, json.loads(output.decode().strip().splitlines()[-1])
+
+    received, rss = asyncio.run(scenario())
+
+    assert received == FILE_SIZE + (1 << 16)
+    assert rss["after"] - rss["before"] < MAX_RSS_GROWTH